@@ -0,0 +1,156 @@
+import time
+import logging
+
+from telegram.ext import CommandHandler
+
+from config import (
+    ADMISSION_USER_RATE,
+    ADMISSION_USER_BURST,
+    ADMISSION_CHAT_RATE,
+    ADMISSION_CHAT_BURST,
+    ADMISSION_REUSE_TTL,
+    ADMISSION_NOTICE_TTL
+)
+from cache import SingleFlight, TTLCache
+from outbox import TokenBucket, detach
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Buckets en memoria antes de descartar los que están llenos (inactivos)
+MAX_BUCKETS = 10000
+
+def message_link(chat, message_id):
+    """Enlace a un mensaje de un supergrupo o canal público (None en otro caso)"""
+    # En un chat privado username es el del usuario: no hay enlace al mensaje
+    if chat.type in ('supergroup', 'channel') and chat.username:
+        return f"https://t.me/{chat.username}/{message_id}"
+    return None
+
+class CommandAdmission:
+    """Control de admisión de los comandos registrados en la aplicación.
+
+    Cada comando gasta un token del usuario y, si va a generar trabajo nuevo,
+    otro del chat; sin tokens se descarta (con un aviso como mucho por minuto).
+    En los comandos compartidos (`shared`) las peticiones idénticas de un chat
+    se unen a la que está en curso y, durante `reuse_ttl` segundos, se responden
+    señalando el mensaje con el resultado en lugar de repetir el trabajo. Para
+    ello el handler debe devolver el message_id de su respuesta.
+    """
+
+    def __init__(self, outbox, user_rate=ADMISSION_USER_RATE, user_burst=ADMISSION_USER_BURST,
+                 chat_rate=ADMISSION_CHAT_RATE, chat_burst=ADMISSION_CHAT_BURST,
+                 reuse_ttl=ADMISSION_REUSE_TTL, notice_ttl=ADMISSION_NOTICE_TTL):
+        self.outbox = outbox
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self._user_buckets = {}
+        self._chat_buckets = {}
+        self.flight = SingleFlight()
+        # (chat_id, comando, args) -> (message_id del resultado, instante monotónico)
+        self.recent = TTLCache(maxsize=MAX_BUCKETS, ttl=reuse_ttl)
+        # Usuarios ya avisados de que van demasiado rápido
+        self._notified = TTLCache(maxsize=MAX_BUCKETS, ttl=notice_ttl)
+        self.stats = {'admitted': 0, 'throttled': 0, 'joined': 0, 'reused': 0}
+
+    def _bucket(self, buckets, key, rate, burst):
+        bucket = buckets.get(key)
+        if bucket is None:
+            if len(buckets) > MAX_BUCKETS:
+                now = time.monotonic()
+                for old in [k for k, b in buckets.items() if b.is_full(now)]:
+                    del buckets[old]
+            bucket = buckets[key] = TokenBucket(rate, burst)
+        return bucket
+
+    def _admit(self, user_id, chat_id=None):
+        """Gasta los tokens del usuario (y del chat si se indica); 0 si se admite o segundos de espera"""
+        now = time.monotonic()
+        buckets = [self._bucket(self._user_buckets, user_id, self.user_rate, self.user_burst)]
+        if chat_id is not None:
+            buckets.append(self._bucket(self._chat_buckets, chat_id, self.chat_rate, self.chat_burst))
+        # Sin tokens en alguno no se gasta ninguno
+        wait = max(bucket.wait_time(now) for bucket in buckets)
+        if wait > 0:
+            return wait
+        for bucket in buckets:
+            bucket.consume(now)
+        return 0
+
+    def _throttled(self, message, user_id, wait):
+        self.stats['throttled'] += 1
+        if self._notified.get(user_id) is None:
+            self._notified.set(user_id, True)
+            detach(self.outbox.reply_text(message, f"⏳ Demasiadas peticiones, espera {max(1, round(wait))} s."))
+
+    def _point_to(self, message, message_id, since):
+        """Respuesta barata: señala el mensaje que ya tiene el resultado"""
+        link = message_link(message.chat, message_id)
+        text = f"👆 Resultado de hace {max(0, round(time.monotonic() - since))} s"
+        detach(self.outbox.reply_text(
+            message,
+            f"{text}: {link}" if link else f"{text}, justo arriba.",
+            disable_web_page_preview=True
+        ))
+
+    def wrap(self, callback, command, shared=False):
+        """Envuelve el callback de un comando con la admisión"""
+        async def admitted(update, context):
+            message = update.effective_message
+            user = update.effective_user
+            if message is None or user is None:
+                return await callback(update, context)
+            chat_id = message.chat_id
+            key = (chat_id, command, tuple(arg.lower() for arg in context.args or ()))
+
+            if shared:
+                recent = self.recent.get(key)
+                in_flight = self.flight.in_flight(key)
+                if recent is not None or in_flight:
+                    # Unirse o reutilizar solo gasta el token del usuario
+                    wait = self._admit(user.id)
+                    if wait:
+                        return self._throttled(message, user.id, wait)
+                    if recent is None:
+                        self.stats['joined'] += 1
+                        try:
+                            result = await self.flight.do(key, lambda: callback(update, context))
+                        except Exception:
+                            return None
+                        if result is None:
+                            return None
+                        recent = self.recent.get(key) or (result, time.monotonic())
+                    else:
+                        self.stats['reused'] += 1
+                    self._point_to(message, *recent)
+                    return recent[0]
+
+            wait = self._admit(user.id, chat_id)
+            if wait:
+                return self._throttled(message, user.id, wait)
+            self.stats['admitted'] += 1
+            if not shared:
+                return await callback(update, context)
+
+            result = await self.flight.do(key, lambda: callback(update, context))
+            if result is not None:
+                self.recent.set(key, (result, time.monotonic()))
+            return result
+        return admitted
+
+    def wrap_handlers(self, application, shared=()):
+        """Aplica la admisión a todos los CommandHandler ya registrados"""
+        for handlers in application.handlers.values():
+            for handler in handlers:
+                if isinstance(handler, CommandHandler):
+                    command = sorted(handler.commands)[0]
+                    handler.callback = self.wrap(handler.callback, command, command in shared)
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['users'] = len(self._user_buckets)
+        stats['chats'] = len(self._chat_buckets)
+        stats['recent'] = len(self.recent)
+        return stats
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""Micro-benchmarks de los caminos calientes del bot.
+
+Uso:
+    python benchmarks/bench.py                       # imprime resultados
+    python benchmarks/bench.py -o resultados.json    # guarda JSON
+    python benchmarks/bench.py --compare base.json   # compara con una ejecución anterior
+    python benchmarks/bench.py -k proxy              # solo los que contienen "proxy"
+
+Las entradas son sintéticas, de tamaño fijo y con semilla fija, así que dos
+ejecuciones sobre el mismo código miden exactamente el mismo trabajo.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from email.utils import formatdate
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# frases.json se carga con ruta relativa
+os.chdir(ROOT)
+
+from config import FEED_ENTRIES
+from feeds import NewsFeedFetcher, merge_timeline
+from proxies import ProxyFetcher, ProxyPool, parse_proxy_bytes
+from personality import TiffanyPersonality
+from state import StateStore
+
+SEED = 1234
+PROXY_LINES = 100_000
+RSS_ENTRIES = 2_000
+MESSAGES = 10_000
+
+WORDS = (
+    "hola buenos días alguien sabe cómo configurar un firewall con nmap el exploit de ayer "
+    "malware ransomware phishing python linux docker kubernetes vpn proxy socks5 api token "
+    "hoy llueve mucho qué tal el partido adiós hasta luego contraseña cifrado tls"
+).split()
+
+def make_messages(rng, count=MESSAGES):
+    return [' '.join(rng.choices(WORDS, k=rng.randint(3, 25))) for _ in range(count)]
+
+def make_proxy_payload(rng, lines=PROXY_LINES):
+    """Respuesta de una fuente de proxies: ip:puerto por línea, con algo de basura"""
+    out = []
+    for i in range(lines):
+        if i % 50 == 0:
+            out.append('# comentario o linea invalida')
+        elif i % 97 == 0:
+            out.append(f"999.1.2.3:{rng.randint(1, 65535)}")
+        else:
+            out.append(f"{rng.randint(1, 254)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}."
+                       f"{rng.randint(0, 255)}:{rng.choice((80, 1080, 3128, 8080, rng.randint(1, 65535)))}")
+    return '\r\n'.join(out).encode('ascii')
+
+def make_rss(rng, entries=RSS_ENTRIES, name='bench'):
+    items = []
+    for i in range(entries):
+        title = ' '.join(rng.choices(WORDS, k=8)).capitalize()
+        items.append(
+            f"<item><title>{title} [{i}]</title><link>https://example.com/{name}/{i}</link>"
+            f"<guid>{name}-{i}</guid><pubDate>{formatdate(1_700_000_000 - i * 37)}</pubDate>"
+            f"<description>{' '.join(rng.choices(WORDS, k=60))}</description></item>"
+        )
+    return (f"<?xml version='1.0' encoding='UTF-8'?><rss version='2.0'><channel><title>{name}</title>"
+            f"{''.join(items)}</channel></rss>").encode('utf-8')
+
+def make_news(rng, count=50):
+    return [{
+        'title': ' '.join(rng.choices(WORDS, k=10)) + ' `code` [tag] (v1.2)!',
+        'link': f"https://example.com/news/{i}?a=(1)",
+        'guid': f"n{i}",
+        'published': formatdate(1_700_000_000 - i * 60),
+        'timestamp': 1_700_000_000 - i * 60,
+        'source': 'Bench',
+        'summary': ' '.join(rng.choices(WORDS, k=30))
+    } for i in range(count)]
+
+def measure(function, repeat, number):
+    """Ejecuta function() `number` veces por repetición; devuelve los tiempos por repetición"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+def build_benchmarks(tmpdir):
+    rng = random.Random(SEED)
+    messages = make_messages(rng)
+    payload = make_proxy_payload(rng)
+    proxy_strings = payload.decode('ascii').split('\r\n')
+    rss = make_rss(rng)
+    news = make_news(rng)
+
+    tiffany = TiffanyPersonality(state=StateStore(path=os.path.join(tmpdir, 'bench_state.db')))
+    # Solo el camino local: sin API configurada
+    tiffany.client.api_key = ''
+    fetcher = ProxyFetcher()
+    news_fetcher = NewsFeedFetcher()
+
+    keys = parse_proxy_bytes(payload, 'http')
+    fetcher.pool.merge(keys, 'bench')
+    proxies = fetcher.fetch_proxies(limit=500)
+    latencies = {proxy: rng.random() for proxy in proxies[::3]}
+    timelines = [sorted(make_news(rng, 200), key=lambda item: -item['timestamp']) for _ in range(8)]
+
+    loop = asyncio.new_event_loop()
+
+    def respond_all():
+        for i, message in enumerate(messages[:2000]):
+            loop.run_until_complete(tiffany.respond(message, f"user{i % 50}", -100 - i % 20))
+
+    def merge_pools():
+        pool = ProxyPool()
+        pool.merge(keys, 'a')
+        pool.merge(parse_proxy_bytes(payload[: len(payload) // 2], 'http'), 'b')
+
+    # nombre -> (función, repeticiones, llamadas por repetición, operaciones por llamada)
+    return loop, {
+        'personality.detect_topic': (lambda: [tiffany.detect_topic(m) for m in messages], 5, 1, len(messages)),
+        'personality.respond_local': (respond_all, 3, 1, 2000),
+        'proxies.is_valid_proxy': (lambda: [fetcher.is_valid_proxy(p) for p in proxy_strings], 5, 1, len(proxy_strings)),
+        'proxies.parse_proxy_bytes': (lambda: parse_proxy_bytes(payload, 'http'), 5, 1, PROXY_LINES),
+        'proxies.pool_merge': (merge_pools, 3, 1, len(keys)),
+        'proxies.format_proxies_pages': (lambda: fetcher.format_proxies_pages(proxies, 'HTTP', latencies), 5, 20, 1),
+        'feeds.format_news_message': (lambda: news_fetcher.format_news_message(news, 'Bench'), 5, 200, 1),
+        'feeds.format_news_pages': (lambda: news_fetcher.format_news_pages(news, 'Bench'), 5, 50, 1),
+        'feeds.parse_entries': (lambda: news_fetcher.parse_entries(rss, 'Bench', limit=RSS_ENTRIES, with_summary=True), 3, 1, RSS_ENTRIES),
+        # Lo que hace el bot: las primeras FEED_ENTRIES de un feed enorme
+        'feeds.parse_entries_head': (lambda: news_fetcher.parse_entries(rss, 'Bench', with_summary=True), 5, 20, FEED_ENTRIES),
+        'feeds.merge_timeline': (lambda: list(merge_timeline(timelines)), 5, 50, 1)
+    }
+
+def run(selected=None):
+    results = {}
+    with tempfile.TemporaryDirectory() as tmpdir:
+        loop, benchmarks = build_benchmarks(tmpdir)
+        try:
+            for name, (function, repeat, number, ops) in benchmarks.items():
+                if selected and not any(pattern in name for pattern in selected):
+                    continue
+                function()  # calentamiento
+                timings = measure(function, repeat, number)
+                best = min(timings) / number
+                results[name] = {
+                    'repeat': repeat,
+                    'number': number,
+                    'ops': ops,
+                    'best_s': best,
+                    'median_s': statistics.median(timings) / number,
+                    'per_op_us': best / ops * 1e6
+                }
+                print(f"{name:<32} {best * 1000:10.3f} ms  {best / ops * 1e6:10.3f} µs/op", flush=True)
+        finally:
+            loop.close()
+    return {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'seed': SEED,
+        'results': results
+    }
+
+def compare(current, baseline):
+    """Imprime la relación actual/base de cada benchmark (<1 es más rápido)"""
+    print(f"\n{'benchmark':<32} {'base ms':>10} {'actual ms':>10} {'ratio':>8}")
+    for name, result in current['results'].items():
+        base = baseline['results'].get(name)
+        if base is None:
+            continue
+        ratio = result['best_s'] / base['best_s']
+        print(f"{name:<32} {base['best_s'] * 1000:10.3f} {result['best_s'] * 1000:10.3f} {ratio:8.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks del bot")
+    parser.add_argument('-o', '--output', help="fichero JSON donde guardar los resultados")
+    parser.add_argument('--compare', help="JSON de una ejecución anterior para comparar")
+    parser.add_argument('-k', action='append', dest='selected', help="solo benchmarks que contengan este texto")
+    args = parser.parse_args()
+
+    current = run(args.selected)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(current, f, indent=2)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            compare(current, json.load(f))
+
+if __name__ == '__main__':
+    main()
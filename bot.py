@@ -2,6 +2,10 @@
 import os
 import sys
 import signal
+import time
+
+# Inicio del proceso, para medir el tiempo de importación y hasta la primera respuesta
+STARTED_AT = time.monotonic()
 
 # Manejar señales de cierre
 def signal_handler(signum, frame):
@@ -16,25 +20,48 @@ WEBHOOK_MODE = os.getenv('WEBHOOK_MODE', 'False').lower() == 'true'
 WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
 PORT = int(os.getenv('PORT', 8443))
 import logging
-from telegram import Update, BotCommand
+from telegram import Update, BotCommand, InputFile
 from telegram.ext import (
     Application,
     CommandHandler,
+    CallbackQueryHandler,
     MessageHandler,
     filters,
-    ContextTypes,
-    CallbackContext
+    ContextTypes
 )
 import asyncio
+import random
 from datetime import datetime
-import schedule
-import time
-from threading import Thread
 
-from config import BOT_TOKEN, GROUPS_CONFIG
-from feeds import NewsFeedFetcher
-from proxies import ProxyFetcher
+from config import (
+    BOT_TOKEN,
+    TELEGRAM_API_URL,
+    STATE_FLUSH_INTERVAL,
+    GROUPS_CONFIG,
+    FEED_CACHE_TTL,
+    PROXY_REFRESH_INTERVAL,
+    PROXY_CHECK_INTERVAL,
+    BROADCAST_TICK,
+    CONCURRENT_UPDATES,
+    BROADCAST_INCREMENTAL,
+    SEEN_EXPIRE_INTERVAL,
+    SHARDS,
+    SHARD_SYNC_INTERVAL,
+    SHARD_METRICS_PORT
+)
+from cache import SnapshotCache
+from feeds import NewsFeedFetcher, merge_timeline
+from proxies import ProxyFetcher, ProxyQuery
 from personality import TiffanyPersonality
+from state import StateStore
+from outbox import OutboundScheduler, OutboxDropped, TokenBucket, detach, PRIORITY_BACKGROUND
+from broadcast import SubscriptionTable, BroadcastEngine
+from inactivity import InactivityMonitor
+from seen import SeenIndex
+from render import RenderCache, page_keyboard
+from metrics import Counter, Gauge, MetricsServer, instrument_handlers
+from warmstart import WarmStart
+from admission import CommandAdmission
 
 # Configurar logging
 logging.basicConfig(
@@ -43,96 +70,214 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+IMPORT_SECONDS = time.monotonic() - STARTED_AT
+
 # Inicializar componentes
 news_fetcher = NewsFeedFetcher()
 proxy_fetcher = ProxyFetcher()
-tiffany = TiffanyPersonality()
+state = StateStore()
+
+async def notify_inactivity(chat_id):
+    """Avisa a un grupo que lleva demasiado tiempo en silencio"""
+    await state.load_async('activity', chat_id)
+    if tiffany.check_inactivity(chat_id):
+        message = tiffany.get_inactivity_message()
+        await outbox.send_message(chat_id, message, priority=PRIORITY_BACKGROUND)
+
+# Un solo planificador despierta únicamente a los grupos inactivos
+inactivity = InactivityMonitor(notify_inactivity)
+tiffany = TiffanyPersonality(state=state, monitor=inactivity)
+
+# Todos los envíos pasan por la cola de salida (límites de Telegram y prioridades)
+outbox = OutboundScheduler()
+
+# Límites por usuario/chat y deduplicación de los comandos caros
+admission = CommandAdmission(outbox)
 
-# Diccionario para almacenar últimos mensajes enviados
-sent_messages = {}
+# Snapshots compartidos de los feeds de config.FEEDS (una descarga sirve a todos los chats)
+feed_cache = SnapshotCache(news_fetcher.loaders(), ttl=FEED_CACHE_TTL)
+
+# Mensajes ya renderizados, compartidos por todos los chats
+render_cache = RenderCache()
+
+# Últimos mensajes enviados se guardan en state, espacio 'sent_messages'
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Maneja el comando /start"""
     welcome_message = (
         "👋 ¡Hola! Soy *Tiffany*, tu asistente de ciberseguridad.\n\n"
         "🔧 *Comandos disponibles:*\n"
-        "• /news - Últimas noticias de ciberseguridad\n"
+        "• /news - Últimas noticias de ciberseguridad (/news 2 para la siguiente página)\n"
         "• /hackernews - Noticias de HackerNews\n"
         "• /zeroclick - Noticias de ZeroClickZero\n"
         "• /proxies - Lista de proxies actualizados\n"
+        "• /proxies socks5 port:1080 alive - Filtra por protocolo, puerto y estado (añade file para recibir un archivo)\n"
         "• /randomproxies - 10 proxies aleatorios\n"
         "• /help - Muestra esta ayuda\n\n"
         "💬 También puedo conversar contigo sobre ciberseguridad y tecnología."
     )
     
-    await update.message.reply_text(welcome_message, parse_mode='Markdown')
+    detach(outbox.reply_text(update.message, welcome_message, parse_mode='Markdown'))
+
+async def news_pages(source=None):
+    """Páginas de noticias de un feed o de la línea temporal de todos, renderizadas una vez por versión"""
+    names = [source] if source else list(news_fetcher.feeds)
+    snapshots = await asyncio.gather(*(feed_cache.get(name) for name in names))
+    key = ('news', source, tuple(snapshot.version for snapshot in snapshots))
+    page_size = GROUPS_CONFIG['max_news_per_message']
+    
+    def render():
+        if source:
+            return news_fetcher.format_news_pages(snapshots[0].items, news_fetcher.title(source), page_size)
+        timeline = list(merge_timeline(snapshot.items for snapshot in snapshots))
+        return news_fetcher.format_news_pages(timeline, "Ciberseguridad", page_size)
+    
+    return render_cache.pages(key, render)
+
+def proxy_pages():
+    """Páginas de la lista de proxies, renderizadas una vez por versión del pool y de las comprobaciones"""
+    key = ('proxies', proxy_fetcher.pool.version, proxy_fetcher.checker.version)
+    
+    def render():
+        # Los más rápidos comprobados; si aún no hay comprobaciones, los del pool
+        proxies = proxy_fetcher.get_fastest_proxies(50) or proxy_fetcher.fetch_proxies()
+        return proxy_fetcher.format_proxies_pages(
+            proxies, "HTTP/SOCKS", latencies=proxy_fetcher.latencies(proxies)
+        )
+    
+    return render_cache.pages(key, render)
 
 async def send_news(update: Update, context: ContextTypes.DEFAULT_TYPE, source=None):
-    """Envía noticias"""
+    """Envía noticias; devuelve el message_id con el resultado (para reutilizarlo)"""
     chat_id = update.effective_chat.id
     
-    # Mensaje de espera
-    wait_msg = await update.message.reply_text("📡 Buscando noticias recientes...")
+    # Mensaje de espera (su message_id hace falta para editarlo; las ediciones no se esperan)
+    try:
+        wait_msg = await outbox.reply_text(update.message, "📡 Buscando noticias recientes...")
+    except OutboxDropped:
+        return None
     
     try:
-        if source == 'hackernews':
-            news = news_fetcher.fetch_hackernews()
-            message = news_fetcher.format_news_message(news, "HackerNews")
-        elif source == 'zeroclickzero':
-            news = news_fetcher.fetch_zeroclickzero()
-            message = news_fetcher.format_news_message(news, "ZeroClickZero")
-        else:
-            # Noticias combinadas
-            hn_news = news_fetcher.fetch_hackernews()[:3]
-            zcz_news = news_fetcher.fetch_zeroclickzero()[:3]
-            all_news = hn_news + zcz_news
-            message = news_fetcher.format_news_message(all_news, "Ciberseguridad")
+        pages = await news_pages(source)
+        # /news 2 abre directamente la segunda página
+        page = int(context.args[0]) - 1 if context.args and context.args[0].isdigit() else 0
+        page = min(max(page, 0), len(pages) - 1)
         
         # Editar mensaje original con las noticias
-        await context.bot.edit_message_text(
-            chat_id=chat_id,
-            message_id=wait_msg.message_id,
-            text=message,
-            parse_mode='Markdown',
-            disable_web_page_preview=False
-        )
+        detach(outbox.edit_message_text(
+            chat_id,
+            wait_msg.message_id,
+            pages[page],
+            parse_mode='MarkdownV2',
+            disable_web_page_preview=False,
+            reply_markup=page_keyboard(f"news:{source or 'all'}", page, len(pages))
+        ))
+        state.set('sent_messages', f"{chat_id}:news:{source or 'all'}", wait_msg.message_id)
+        return wait_msg.message_id
         
     except Exception as e:
         logger.error(f"Error sending news: {e}")
-        await context.bot.edit_message_text(
-            chat_id=chat_id,
-            message_id=wait_msg.message_id,
-            text="❌ Error al obtener noticias. Intenta más tarde."
-        )
+        detach(outbox.edit_message_text(
+            chat_id,
+            wait_msg.message_id,
+            "❌ Error al obtener noticias. Intenta más tarde."
+        ))
 
 async def send_proxies(update: Update, context: ContextTypes.DEFAULT_TYPE, random_only=False):
-    """Envía lista de proxies"""
+    """Envía lista de proxies; devuelve el message_id con el resultado (salvo los aleatorios)"""
     chat_id = update.effective_chat.id
     
-    wait_msg = await update.message.reply_text("🔍 Buscando proxies actualizados...")
+    try:
+        wait_msg = await outbox.reply_text(update.message, "🔍 Buscando proxies actualizados...")
+    except OutboxDropped:
+        return None
     
     try:
+        # Solo espera a la red si el pool aún no se ha llenado
+        await proxy_fetcher.ensure_loaded()
+        if context.args and not random_only:
+            return await send_proxy_query(chat_id, wait_msg, context.args)
         if random_only:
-            proxies = proxy_fetcher.get_random_proxies(10)
-            message = proxy_fetcher.format_proxies_message(proxies, "HTTP Aleatorios")
+            # Cada petición es distinta, no se cachea
+            proxies = proxy_fetcher.get_random_proxies(10, alive_only=True)
+            pages = proxy_fetcher.format_proxies_pages(
+                proxies, "HTTP Aleatorios", latencies=proxy_fetcher.latencies(proxies)
+            )
+            keyboard = None
         else:
-            proxies = proxy_fetcher.fetch_proxies()
-            message = proxy_fetcher.format_proxies_message(proxies, "HTTP/SOCKS")
+            pages = proxy_pages()
+            keyboard = page_keyboard("proxies:all", 0, len(pages))
         
-        await context.bot.edit_message_text(
-            chat_id=chat_id,
-            message_id=wait_msg.message_id,
-            text=message,
-            parse_mode='Markdown'
-        )
+        detach(outbox.edit_message_text(
+            chat_id,
+            wait_msg.message_id,
+            pages[0],
+            parse_mode='MarkdownV2',
+            reply_markup=keyboard
+        ))
+        state.set('sent_messages', f"{chat_id}:proxies:{'random' if random_only else 'all'}", wait_msg.message_id)
+        return None if random_only else wait_msg.message_id
         
     except Exception as e:
         logger.error(f"Error sending proxies: {e}")
-        await context.bot.edit_message_text(
-            chat_id=chat_id,
-            message_id=wait_msg.message_id,
-            text="❌ Error al obtener proxies. Intenta más tarde."
-        )
+        detach(outbox.edit_message_text(
+            chat_id,
+            wait_msg.message_id,
+            "❌ Error al obtener proxies. Intenta más tarde."
+        ))
+
+async def send_proxy_query(chat_id, wait_msg, args):
+    """Responde a /proxies con filtros: pocos resultados como texto, el resto como archivo"""
+    try:
+        query = ProxyQuery.parse(args)
+    except ValueError as e:
+        detach(outbox.edit_message_text(
+            chat_id,
+            wait_msg.message_id,
+            f"❌ {e}\nEjemplo: /proxies socks5 port:1080 alive"
+        ))
+        return None
+    
+    keys = await proxy_fetcher.query(query)
+    if keys and (query.as_file or len(keys) > GROUPS_CONFIG['max_proxies_per_message']):
+        buffer = await asyncio.to_thread(proxy_fetcher.export, keys)
+        detach(outbox.send_document(
+            chat_id,
+            InputFile(buffer, filename='proxies.txt'),
+            caption=f"🔒 {len(keys)} proxies ({query})"
+        ))
+        detach(outbox.edit_message_text(chat_id, wait_msg.message_id, f"📎 {len(keys)} proxies en el archivo adjunto"))
+        return wait_msg.message_id
+    
+    labels, latencies = proxy_fetcher.describe(keys)
+    pages = proxy_fetcher.format_proxies_pages(labels, str(query), latencies=latencies)
+    detach(outbox.edit_message_text(chat_id, wait_msg.message_id, pages[0], parse_mode='MarkdownV2'))
+    return wait_msg.message_id
+
+async def handle_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Cambia de página un mensaje de noticias o proxies (botones ◀️ ▶️)"""
+    query = update.callback_query
+    kind, name, page = query.data.split(':')
+    await query.answer()
+    
+    try:
+        if kind == 'news':
+            pages = await news_pages(None if name == 'all' else name)
+            preview = {'disable_web_page_preview': False}
+        else:
+            pages = proxy_pages()
+            preview = {}
+        page = min(int(page), len(pages) - 1)
+        detach(outbox.edit_message_text(
+            query.message.chat_id,
+            query.message.message_id,
+            pages[page],
+            parse_mode='MarkdownV2',
+            reply_markup=page_keyboard(f"{kind}:{name}", page, len(pages)),
+            **preview
+        ))
+    except Exception as e:
+        logger.error(f"Error changing page: {e}")
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Maneja mensajes de texto normales"""
@@ -152,47 +297,149 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         for member in update.message.new_chat_members:
             if not member.is_bot:
                 greeting = tiffany.get_greeting(member.username or member.first_name)
-                await update.message.reply_text(greeting)
+                detach(outbox.reply_text(update.message, greeting))
         return
     
     # Despedir a miembros que se van
     if update.message.left_chat_member:
         if not update.message.left_chat_member.is_bot:
             farewell = tiffany.get_farewell(update.message.left_chat_member.username or update.message.left_chat_member.first_name)
-            await update.message.reply_text(farewell)
+            detach(outbox.reply_text(update.message, farewell))
         return
     
     # Responder a mensajes normales
     response = await tiffany.respond(message, username, chat_id)
     if response and random.random() < 0.3:  # 30% de probabilidad de responder
-        await update.message.reply_text(response)
+        detach(outbox.reply_text(update.message, response))
 
-async def scheduled_news(context: CallbackContext):
-    """Envía noticias programadas a grupos configurados"""
-    job = context.job
-    chat_id = job.chat_id
-    
+def render_broadcast(feeds, items):
+    """Texto de la difusión programada para una combinación de feeds"""
+    news = list(merge_timeline(items.get(feed, []) for feed in feeds))
+    title = news_fetcher.title(feeds[0]) if len(feeds) == 1 else "Ciberseguridad"
+    return news_fetcher.format_news_message(news, title)
+
+# Difusión programada: una descarga y un render por feed, repartido a todos los grupos
+subscriptions = SubscriptionTable()
+# Con BROADCAST_INCREMENTAL cada grupo recibe solo lo que aún no ha visto
+seen = SeenIndex() if BROADCAST_INCREMENTAL else None
+
+# Modo multiproceso (SHARDS): run_shard fija el índice de este worker y el anillo de chats
+shard = {'index': 0, 'count': 1, 'ring': None, 'published': None}
+
+def owns_chat(chat_id):
+    """Si el chat pertenece a este proceso (siempre, salvo en modo multiproceso)"""
+    return shard['ring'] is None or shard['ring'].node_for(chat_id) == shard['index']
+
+broadcaster = BroadcastEngine(subscriptions, feed_cache, outbox, render_broadcast, seen=seen, owns=owns_chat)
+
+# Feeds y proxies del último cierre: tras un despliegue no se arranca en frío
+warm_start = WarmStart()
+startup = {'import': IMPORT_SECONDS}
+
+async def restore_snapshot():
+    """Carga el snapshot de disco en las cachés (la lectura se hace en un hilo)"""
+    parts = await asyncio.to_thread(warm_start.load)
     try:
-        news = news_fetcher.fetch_hackernews()[:3]
-        message = news_fetcher.format_news_message(news, "HackerNews")
-        
-        await context.bot.send_message(
-            chat_id=chat_id,
-            text=message,
-            parse_mode='Markdown',
-            disable_web_page_preview=False
-        )
+        feeds = feed_cache.restore(parts.get('feeds', {}))
+        proxies = proxy_fetcher.restore(parts['proxies']) if 'proxies' in parts else 0
     except Exception as e:
-        logger.error(f"Error in scheduled news: {e}")
+        logger.error(f"Error restaurando el snapshot: {e}")
+        return
+    if parts:
+        logger.info(f"Restaurados {feeds} feeds y {proxies} proxies del snapshot")
 
-async def check_inactivity(context: CallbackContext):
-    """Verifica inactividad en grupos"""
-    job = context.job
-    chat_id = job.chat_id
-    
-    if tiffany.check_inactivity(chat_id):
-        message = tiffany.get_inactivity_message()
-        await context.bot.send_message(chat_id=chat_id, text=message)
+async def save_snapshot():
+    """Guarda feeds y proxies para el próximo arranque"""
+    parts = {'feeds': feed_cache.dump(), 'proxies': proxy_fetcher.dump()}
+    await asyncio.to_thread(warm_start.save, parts)
+
+def shares_caches():
+    """Con varios workers solo el 0 descarga feeds y proxies; el resto los lee de su snapshot"""
+    return shard['count'] > 1 and warm_start.enabled
+
+async def publish_snapshot_job(context):
+    """Worker 0: publica feeds y proxies para los demás workers cuando cambian"""
+    versions = (
+        tuple(snapshot.version for snapshot in feed_cache.snapshots.values()),
+        proxy_fetcher.pool.version,
+        proxy_fetcher.checker.version
+    )
+    if versions != shard['published']:
+        shard['published'] = versions
+        await save_snapshot()
+
+async def sync_snapshot_job(context):
+    """Resto de workers: cargan el snapshot publicado si ha cambiado"""
+    parts = await asyncio.to_thread(warm_start.load_if_changed)
+    if not parts:
+        return
+    try:
+        feed_cache.restore(parts.get('feeds', {}), replace=True)
+        if 'proxies' in parts:
+            proxy_fetcher.restore(parts['proxies'], replace=True)
+    except Exception as e:
+        # Se sigue con los datos actuales hasta la siguiente publicación
+        logger.error(f"Error cargando el snapshot publicado: {e}")
+
+def register_metrics():
+    """Expone en /metrics las estadísticas que ya llevan los componentes"""
+    Counter('tiffany_cache_hits_total', 'Aciertos de caché', ['cache']).set_function(lambda: {
+        ('feeds',): feed_cache.stats['hits'] + feed_cache.stats['stale_hits'],
+        ('responses',): tiffany.response_cache.hits,
+        ('render',): render_cache.cache.hits,
+        ('state',): state.stats['hits']
+    })
+    Counter('tiffany_cache_misses_total', 'Fallos de caché', ['cache']).set_function(lambda: {
+        ('feeds',): feed_cache.stats['misses'],
+        ('responses',): tiffany.response_cache.misses,
+        ('render',): render_cache.cache.misses,
+        ('state',): state.stats['loads']
+    })
+    Counter('tiffany_telegram_flood_waits_total', 'Respuestas 429 (RetryAfter) de Telegram').set_function(
+        lambda: outbox.stats['flood_waits']
+    )
+    Counter('tiffany_outbox_total', 'Envíos de la cola de salida por resultado', ['result']).set_function(
+        lambda: {(name,): value for name, value in outbox.stats.items()}
+    )
+    Counter('tiffany_admission_total', 'Comandos por decisión de admisión', ['result']).set_function(
+        lambda: {(name,): value for name, value in admission.stats.items()}
+    )
+    Counter('tiffany_feed_refresh_errors_total', 'Recargas de feeds fallidas').set_function(
+        lambda: feed_cache.stats['errors']
+    )
+    Gauge('tiffany_outbox_queue', 'Envíos pendientes en la cola de salida').set_function(outbox.pending)
+    Gauge('tiffany_tracked_chats', 'Chats con estado en memoria', ['kind']).set_function(lambda: {
+        ('inactivity',): len(inactivity),
+        ('subscriptions',): len(subscriptions),
+        ('state_entries',): len(state)
+    })
+    Gauge('tiffany_feed_age_seconds', 'Edad del snapshot de cada feed', ['feed']).set_function(
+        lambda: {(name,): snapshot.age() for name, snapshot in feed_cache.snapshots.items()}
+    )
+    Gauge('tiffany_proxy_pool_size', 'Proxies en el pool').set_function(lambda: len(proxy_fetcher.pool))
+    Gauge('tiffany_proxy_pool_age_seconds', 'Segundos desde la última actualización del pool').set_function(
+        lambda: (datetime.now() - proxy_fetcher.pool.updated_at).total_seconds() if proxy_fetcher.pool.updated_at else {}
+    )
+    Gauge('tiffany_proxies_alive', 'Proxies vivos en la última comprobación').set_function(
+        lambda: len(proxy_fetcher.checker.alive_keys())
+    )
+    Gauge('tiffany_chat_api_available', '1 si el circuito de la API de chat está cerrado').set_function(
+        lambda: int(tiffany.api_available)
+    )
+    Gauge('tiffany_startup_seconds', 'Segundos desde el inicio del proceso hasta cada fase', ['phase']).set_function(
+        lambda: {(phase,): seconds for phase, seconds in startup_phases().items()}
+    )
+
+def startup_phases():
+    """Importación, bot listo y primera respuesta enviada, en segundos desde el inicio"""
+    phases = dict(startup)
+    if outbox.first_sent_at is not None:
+        phases['first_reply'] = outbox.first_sent_at - STARTED_AT
+    return phases
+
+register_metrics()
+metrics_server = None if WEBHOOK_MODE else MetricsServer()
+metrics_port = PORT
 
 async def setup_commands(application: Application):
     """Configura los comandos del bot"""
@@ -210,25 +457,85 @@ async def setup_commands(application: Application):
 
 async def post_init(application: Application):
     """Tareas posteriores a la inicialización"""
+    await restore_snapshot()
     await setup_commands(application)
+    outbox.start(application.bot)
+    
+    # Mantener los feeds frescos en segundo plano
+    if shard['index'] == 0 or not shares_caches():
+        application.job_queue.run_repeating(feed_cache.refresh_job, interval=FEED_CACHE_TTL, first=5)
+        application.job_queue.run_repeating(proxy_fetcher.refresh_job, interval=PROXY_REFRESH_INTERVAL, first=1)
+        application.job_queue.run_repeating(proxy_fetcher.check_job, interval=PROXY_CHECK_INTERVAL, first=30)
+    if shares_caches():
+        if shard['index'] == 0:
+            application.job_queue.run_repeating(publish_snapshot_job, interval=SHARD_SYNC_INTERVAL, first=10)
+        else:
+            # Los feeds se renuevan con el snapshot, no caducan por su cuenta (solo se descargan si faltan)
+            feed_cache.ttl = float('inf')
+            # Mirar el mtime es barato: se comprueba a menudo
+            application.job_queue.run_repeating(sync_snapshot_job, interval=5, first=5)
+    application.job_queue.run_repeating(state.flush_job, interval=STATE_FLUSH_INTERVAL, first=STATE_FLUSH_INTERVAL)
+    
+    # Noticias programadas según la tabla de suscripciones (NEWS_SUBSCRIPTIONS)
+    count = await asyncio.to_thread(subscriptions.load)
+    logger.info(f"{count} grupos suscritos a noticias")
+    application.job_queue.run_repeating(broadcaster.tick_job, interval=BROADCAST_TICK, first=10)
+    if seen is not None:
+        application.job_queue.run_repeating(seen.flush_job, interval=STATE_FLUSH_INTERVAL, first=STATE_FLUSH_INTERVAL)
+        application.job_queue.run_repeating(seen.expire_job, interval=SEEN_EXPIRE_INTERVAL, first=SEEN_EXPIRE_INTERVAL)
+        application.job_queue.run_once(seen.bloom_job, when=0)
+    
+    # Avisos de inactividad (GROUPS_CONFIG['inactivity_timeout'])
+    inactivity.start()
     
-    # Programar tareas para grupos específicos (configura esto según tus grupos)
-    # Ejemplo: Enviar noticias cada 6 horas
-    # context.job_queue.run_repeating(scheduled_news, interval=21600, first=10, chat_id=TU_GRUPO_ID)
+    # En modo webhook /metrics lo sirve el propio servidor del webhook
+    if metrics_server is not None:
+        await metrics_server.start('0.0.0.0', metrics_port)
     
-    # Verificar inactividad cada 5 minutos
-    # context.job_queue.run_repeating(check_inactivity, interval=300, first=60, chat_id=TU_GRUPO_ID)
+    startup['ready'] = time.monotonic() - STARTED_AT
+    logger.info(f"Listo en {startup['ready']:.2f} s (importaciones: {IMPORT_SECONDS:.2f} s)")
 
-def run_schedule():
-    """Ejecuta el planificador en un hilo separado"""
-    while True:
-        schedule.run_pending()
-        time.sleep(1)
+async def post_stop(application: Application):
+    """Vacía la cola de salida mientras el bot aún puede enviar"""
+    await inactivity.stop()
+    await outbox.stop()
 
-def main():
-    """Función principal"""
-    # Crear aplicación
-    application = Application.builder().token(BOT_TOKEN).post_init(post_init).build()
+async def post_shutdown(application: Application):
+    """Libera recursos al cerrar el bot"""
+    # Con varios workers solo el 0 tiene los datos de referencia
+    if shard['index'] == 0:
+        await save_snapshot()
+    if metrics_server is not None:
+        await metrics_server.stop()
+    await news_fetcher.close()
+    await proxy_fetcher.close()
+    await tiffany.client.close()
+    # Espera al volcado en curso para que el último lote no se adelante a él
+    await state.flush_async()
+    state.close()
+    subscriptions.close()
+    if seen is not None:
+        await seen.flush_async()
+        seen.close()
+
+def build_application(webhook=WEBHOOK_MODE):
+    """Crea la aplicación con todos sus handlers"""
+    builder = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .base_url(f"{TELEGRAM_API_URL}/bot")
+        .base_file_url(f"{TELEGRAM_API_URL}/file/bot")
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+    )
+    if webhook:
+        # Los updates llegan por nuestro servidor, no hace falta el Updater
+        builder = builder.updater(None)
+    else:
+        # Un comando lento no bloquea al resto de chats
+        builder = builder.concurrent_updates(CONCURRENT_UPDATES)
+    application = builder.build()
     
     # Comandos
     application.add_handler(CommandHandler("start", start))
@@ -238,17 +545,56 @@ def main():
     application.add_handler(CommandHandler("proxies", lambda u, c: send_proxies(u, c)))
     application.add_handler(CommandHandler("randomproxies", lambda u, c: send_proxies(u, c, True)))
     application.add_handler(CommandHandler("help", start))
+    application.add_handler(CallbackQueryHandler(handle_page, pattern=r'^(news|proxies):'))
     
     # Mensajes de texto
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
     
-    # Iniciar hilo para schedule
-    schedule_thread = Thread(target=run_schedule, daemon=True)
-    schedule_thread.start()
+    # Límites por usuario y chat; los comandos idénticos comparten resultado
+    admission.wrap_handlers(application, shared=('news', 'hackernews', 'zeroclick', 'proxies'))
+    
+    # Latencia y errores de cada handler, sin tocar los handlers uno a uno
+    instrument_handlers(application)
+    return application
+
+def run_shard(index, count, updates):
+    """Proceso worker del modo multiproceso: atiende solo los chats que le asigna el anillo"""
+    global metrics_server, metrics_port
+    from shards import HashRing, serve_shard
+    
+    shard.update(index=index, count=count, ring=HashRing(range(count)))
+    # El límite global de Telegram es por bot: se reparte entre los workers
+    rate = outbox.global_bucket.rate / count
+    outbox.global_bucket = TokenBucket(rate, max(1, rate))
+    if SHARD_METRICS_PORT:
+        metrics_server = MetricsServer()
+        metrics_port = SHARD_METRICS_PORT + index
     
+    logger.info(f"Worker {index + 1}/{count} iniciado (pid {os.getpid()})")
+    asyncio.run(serve_shard(build_application(webhook=True), updates))
+
+def main():
+    """Función principal"""
     # Iniciar el bot
-    logger.info("Bot iniciado...")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    if WEBHOOK_MODE:
+        if not WEBHOOK_URL:
+            logger.error("WEBHOOK_MODE activo pero WEBHOOK_URL está vacío")
+            sys.exit(1)
+        shards = SHARDS or os.cpu_count()
+        if shards > 1:
+            # Este proceso solo recibe y reparte; los handlers corren en los workers
+            from shards import run_sharded
+            logger.info(f"Bot iniciado en modo webhook con {shards} workers ({WEBHOOK_URL})...")
+            asyncio.run(run_sharded(WEBHOOK_URL, PORT, shards))
+            return
+        from webhook import run_webhook
+        application = build_application()
+        logger.info(f"Bot iniciado en modo webhook ({WEBHOOK_URL})...")
+        asyncio.run(run_webhook(application, WEBHOOK_URL, PORT))
+    else:
+        application = build_application()
+        logger.info("Bot iniciado...")
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,263 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from itertools import islice
+from zoneinfo import ZoneInfo
+import logging
+
+from telegram.error import Forbidden, BadRequest
+
+from config import (
+    STATE_DB_PATH,
+    NEWS_SUBSCRIPTIONS,
+    BROADCAST_DEFAULT_INTERVAL,
+    BROADCAST_TIMEZONE,
+    BROADCAST_NEWS_PER_FEED,
+    GROUPS_CONFIG
+)
+from outbox import PRIORITY_SCHEDULED
+from seen import item_digest
+from feeds import merge_timeline
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class Subscription:
+    """Suscripción de un grupo a uno o varios feeds"""
+    __slots__ = ('chat_id', 'feeds', 'interval', 'quiet_hours', 'next_due')
+
+    def __init__(self, chat_id, feeds, interval=BROADCAST_DEFAULT_INTERVAL, quiet_hours=None, next_due=0.0):
+        self.chat_id = int(chat_id)
+        self.feeds = tuple(sorted(feeds))
+        self.interval = int(interval)
+        # (hora_inicio, hora_fin) en la zona BROADCAST_TIMEZONE; puede cruzar medianoche
+        self.quiet_hours = tuple(quiet_hours) if quiet_hours else None
+        self.next_due = next_due
+
+    def is_quiet(self, hour):
+        """Indica si la hora local cae dentro de las horas de silencio"""
+        if not self.quiet_hours:
+            return False
+        start, end = self.quiet_hours
+        if start <= end:
+            return start <= hour < end
+        return hour >= start or hour < end
+
+    def to_row(self):
+        quiet = json.dumps(list(self.quiet_hours)) if self.quiet_hours else None
+        return (self.chat_id, json.dumps(list(self.feeds)), self.interval, quiet, self.next_due)
+
+    @classmethod
+    def from_row(cls, row):
+        chat_id, feeds, interval, quiet, next_due = row
+        return cls(chat_id, json.loads(feeds), interval, json.loads(quiet) if quiet else None, next_due)
+
+class SubscriptionTable:
+    """Tabla de suscripciones en memoria, persistida en SQLite"""
+
+    def __init__(self, path=STATE_DB_PATH):
+        self.path = path
+        self.subscriptions = {}
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS subscriptions ('
+                ' chat_id INTEGER PRIMARY KEY, feeds TEXT NOT NULL, interval INTEGER NOT NULL,'
+                ' quiet_hours TEXT, next_due REAL NOT NULL)'
+            )
+        return self._conn
+
+    def load(self, seed=NEWS_SUBSCRIPTIONS):
+        """Carga las suscripciones guardadas y añade las de configuración que falten"""
+        with self._lock:
+            rows = self._connect().execute('SELECT * FROM subscriptions').fetchall()
+        self.subscriptions = {row[0]: Subscription.from_row(row) for row in rows}
+        new = [
+            Subscription(entry['chat_id'], entry.get('feeds', ['hackernews']),
+                         entry.get('interval', BROADCAST_DEFAULT_INTERVAL), entry.get('quiet_hours'))
+            for entry in seed if int(entry['chat_id']) not in self.subscriptions
+        ]
+        for subscription in new:
+            self.subscriptions[subscription.chat_id] = subscription
+        self.save(new)
+        return len(self.subscriptions)
+
+    def __len__(self):
+        return len(self.subscriptions)
+
+    def get(self, chat_id):
+        return self.subscriptions.get(chat_id)
+
+    def add(self, subscription):
+        self.subscriptions[subscription.chat_id] = subscription
+        self.save([subscription])
+
+    def remove(self, chat_id):
+        if self.subscriptions.pop(chat_id, None) is None:
+            return False
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute('DELETE FROM subscriptions WHERE chat_id = ?', (chat_id,))
+        return True
+
+    def save(self, subscriptions):
+        """Guarda (inserta o reemplaza) las suscripciones indicadas"""
+        rows = [subscription.to_row() for subscription in subscriptions]
+        if not rows:
+            return
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.executemany('INSERT OR REPLACE INTO subscriptions VALUES (?, ?, ?, ?, ?)', rows)
+
+    def due(self, now, hour):
+        """Suscripciones cuyo envío toca ahora y no están en horas de silencio"""
+        return [
+            subscription for subscription in self.subscriptions.values()
+            if subscription.next_due <= now and not subscription.is_quiet(hour)
+        ]
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+class BroadcastEngine:
+    """Envía las noticias programadas a todos los grupos suscritos.
+
+    En cada tick se juntan las suscripciones pendientes, se obtiene cada feed
+    una sola vez de la caché de snapshots, se renderiza cada combinación de
+    feeds una sola vez y el mismo texto se reparte en paralelo a todos los
+    grupos a través de la cola de salida.
+
+    Con un índice de vistas (seen) cada grupo recibe solo las noticias que aún
+    no se le han entregado; los grupos con la misma selección comparten render
+    y los que no tienen nada nuevo no reciben mensaje. Como mucho se eligen
+    `max_news` noticias por envío (las que caben en el mensaje), y solo esas
+    se marcan como entregadas.
+    """
+
+    def __init__(self, table, feed_cache, outbox, render, seen=None,
+                 news_per_feed=BROADCAST_NEWS_PER_FEED, timezone=BROADCAST_TIMEZONE, owns=None,
+                 max_news=GROUPS_CONFIG['max_news_per_message']):
+        self.table = table
+        self.feed_cache = feed_cache
+        self.outbox = outbox
+        # render(feeds, {feed: items}) -> texto del mensaje
+        self.render = render
+        self.seen = seen
+        self.news_per_feed = news_per_feed
+        self.max_news = max_news
+        self.timezone = ZoneInfo(timezone)
+        # owns(chat_id) -> bool: en modo multiproceso cada worker difunde solo a sus chats
+        self.owns = owns
+        self.last_tick = {}
+
+    async def tick(self):
+        """Un ciclo de difusión; devuelve las métricas del tick"""
+        start = time.perf_counter()
+        now = time.time()
+        hour = datetime.now(self.timezone).hour
+        due = self.table.due(now, hour)
+        if self.owns is not None:
+            due = [subscription for subscription in due if self.owns(subscription.chat_id)]
+        if not due:
+            return None
+
+        feeds = sorted({feed for subscription in due for feed in subscription.feeds if feed in self.feed_cache.loaders})
+        snapshots = await asyncio.gather(*(self.feed_cache.get_items(feed) for feed in feeds))
+        items = dict(zip(feeds, snapshots))
+        fetched = time.perf_counter()
+
+        if self.seen is not None:
+            # Los conjuntos de vistas que falten se leen de disco en un hilo, no en _select
+            await self.seen.preload([
+                (subscription.chat_id, feed, items.get(feed, []))
+                for subscription in due for feed in subscription.feeds
+            ])
+
+        rendered = {}
+        sends = []
+        skipped = 0
+        for subscription in due:
+            selected = self._select(subscription, items)
+            if not any(selected.values()):
+                # Nada nuevo para este grupo
+                skipped += 1
+                continue
+            key = (subscription.feeds, tuple(item_digest(item) for news in selected.values() for item in news))
+            if key not in rendered:
+                rendered[key] = self.render(subscription.feeds, selected)
+            sends.append(self._send(subscription, rendered[key], selected))
+        rendered_at = time.perf_counter()
+
+        results = await asyncio.gather(*sends)
+        finished = time.perf_counter()
+
+        # Las suscripciones eliminadas durante el envío no se vuelven a guardar
+        kept = [subscription for subscription in due if self.table.get(subscription.chat_id) is subscription]
+        for subscription in kept:
+            subscription.next_due = now + subscription.interval
+        await asyncio.to_thread(self.table.save, kept)
+
+        self.last_tick = {
+            'groups': len(due),
+            'skipped': skipped,
+            'removed': len(due) - len(kept),
+            'feeds': len(feeds),
+            'renders': len(rendered),
+            'sent': sum(results),
+            'fetch_ms': round((fetched - start) * 1000, 1),
+            'render_ms': round((rendered_at - fetched) * 1000, 1),
+            'fanout_ms': round((finished - rendered_at) * 1000, 1)
+        }
+        logger.info(f"Broadcast: {self.last_tick}")
+        return self.last_tick
+
+    def _select(self, subscription, items):
+        """Noticias de cada feed que recibirá el grupo en este envío"""
+        selected = {}
+        for feed in subscription.feeds:
+            news = items.get(feed, [])
+            if self.seen is not None:
+                news = self.seen.filter_new(subscription.chat_id, feed, news)
+            selected[feed] = news[:self.news_per_feed]
+        if sum(map(len, selected.values())) > self.max_news:
+            # Las más recientes de la línea temporal, la misma que se renderiza
+            chosen = {id(item) for item in islice(merge_timeline(selected.values()), self.max_news)}
+            selected = {feed: [item for item in news if id(item) in chosen] for feed, news in selected.items()}
+        return selected
+
+    async def _send(self, subscription, text, selected):
+        try:
+            await self.outbox.send_message(
+                subscription.chat_id,
+                text,
+                priority=PRIORITY_SCHEDULED,
+                parse_mode='MarkdownV2',
+                disable_web_page_preview=False
+            )
+            if self.seen is not None:
+                for feed, news in selected.items():
+                    self.seen.mark(subscription.chat_id, feed, news)
+            return True
+        except (Forbidden, BadRequest) as e:
+            # El bot ya no está en el grupo o el chat no existe
+            logger.warning(f"Suscripción de {subscription.chat_id} eliminada: {e}")
+            await asyncio.to_thread(self.table.remove, subscription.chat_id)
+        except Exception as e:
+            logger.error(f"Error in scheduled news for {subscription.chat_id}: {e}")
+        return False
+
+    async def tick_job(self, context):
+        """Callback para el JobQueue de PTB"""
+        await self.tick()
@@ -0,0 +1,202 @@
+import asyncio
+import time
+from collections import OrderedDict
+import logging
+
+from state import monotonic_to_wall, wall_to_monotonic
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class SingleFlight:
+    """Agrupa las llamadas concurrentes con la misma clave en una sola ejecución"""
+
+    def __init__(self):
+        self._inflight = {}
+        # Llamadas que se unieron a una ejecución ya en curso
+        self.joined = 0
+
+    def in_flight(self, key):
+        """Indica si ya hay una ejecución en curso para la clave"""
+        return key in self._inflight
+
+    async def do(self, key, factory):
+        """Ejecuta factory() una sola vez por clave; el resto de llamadas esperan su resultado"""
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(factory())
+            self._inflight[key] = future
+            future.add_done_callback(lambda f: self._forget(key, f))
+        else:
+            self.joined += 1
+        # shield: si un llamante se cancela, la ejecución compartida sigue
+        return await asyncio.shield(future)
+
+    def _forget(self, key, future):
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+
+class TTLCache:
+    """Caché LRU acotada en tamaño cuyas entradas caducan tras `ttl` segundos"""
+
+    def __init__(self, maxsize=1000, ttl=600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        """Devuelve el valor si existe y no ha caducado (y lo marca como reciente)"""
+        entry = self._data.get(key)
+        if entry is None or entry[1] < time.monotonic():
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def set(self, key, value):
+        """Guarda un valor, expulsando el menos usado si se supera maxsize"""
+        self._data[key] = (value, time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def get_stats(self):
+        """Tamaño, aciertos, fallos y tasa de acierto"""
+        total = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0
+        }
+
+class Snapshot:
+    """Copia inmutable del contenido de un feed en un momento dado"""
+    __slots__ = ('items', 'fetched_at', 'version')
+
+    def __init__(self, items, version=1, fetched_at=None):
+        self.items = items
+        self.version = version
+        self.fetched_at = time.monotonic() if fetched_at is None else fetched_at
+
+    def age(self):
+        """Segundos transcurridos desde la descarga"""
+        return time.monotonic() - self.fetched_at
+
+class SnapshotCache:
+    """Caché de snapshots por nombre con TTL y stale-while-revalidate.
+
+    `loaders` asocia cada nombre con una corrutina sin argumentos que devuelve
+    la lista de elementos. Si un snapshot ha caducado se devuelve igualmente y
+    se lanza una única recarga en segundo plano.
+    """
+
+    def __init__(self, loaders, ttl=300):
+        self.loaders = dict(loaders)
+        self.ttl = ttl
+        self.snapshots = {}
+        self.flight = SingleFlight()
+        self._background = set()
+        self.stats = {'hits': 0, 'stale_hits': 0, 'misses': 0, 'refreshes': 0, 'errors': 0}
+
+    async def get(self, name):
+        """Devuelve el snapshot de un feed, descargándolo solo si no existe"""
+        snapshot = self.snapshots.get(name)
+        if snapshot is None:
+            self.stats['misses'] += 1
+            return await self.refresh(name)
+
+        if snapshot.age() > self.ttl:
+            self.stats['stale_hits'] += 1
+            self.refresh_in_background(name)
+        else:
+            self.stats['hits'] += 1
+        return snapshot
+
+    async def get_items(self, name):
+        """Atajo que devuelve solo los elementos del snapshot"""
+        return (await self.get(name)).items
+
+    async def refresh(self, name):
+        """Recarga un feed; las recargas concurrentes comparten la misma descarga"""
+        return await self.flight.do(name, lambda: self._load(name))
+
+    def refresh_in_background(self, name):
+        """Lanza una recarga sin esperar su resultado (si no hay otra en curso)"""
+        if self.flight.in_flight(name):
+            return
+        task = asyncio.ensure_future(self.refresh(name))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def refresh_all(self):
+        """Recarga todos los feeds registrados en paralelo"""
+        await asyncio.gather(*(self.refresh(name) for name in self.loaders), return_exceptions=True)
+
+    async def refresh_job(self, context):
+        """Callback para el JobQueue de PTB"""
+        await self.refresh_all()
+
+    async def _load(self, name):
+        previous = self.snapshots.get(name)
+        try:
+            items = await self.loaders[name]()
+        except Exception as e:
+            self.stats['errors'] += 1
+            logger.error(f"Error refreshing {name}: {e}")
+            if previous is not None:
+                return previous
+            raise
+
+        self.stats['refreshes'] += 1
+        if previous is None:
+            snapshot = Snapshot(items)
+        elif not items and previous.items:
+            # Una descarga vacía no debe borrar un snapshot válido
+            snapshot = Snapshot(previous.items, previous.version)
+        else:
+            version = previous.version if items == previous.items else previous.version + 1
+            snapshot = Snapshot(items, version)
+        self.snapshots[name] = snapshot
+        return snapshot
+
+    def dump(self):
+        """Snapshots como {nombre: (items, versión, hora de descarga)} para guardarlos en disco"""
+        return {
+            name: (snapshot.items, snapshot.version, monotonic_to_wall(snapshot.fetched_at))
+            for name, snapshot in self.snapshots.items()
+        }
+
+    def restore(self, data, replace=False):
+        """Carga snapshots de dump() conservando su edad: los caducados se sirven y se recargan.
+
+        Sin `replace` solo se rellenan los que faltan; con él también se
+        sustituyen los que han cambiado (sincronización entre procesos).
+        """
+        restored = 0
+        for name, (items, version, fetched_at) in data.items():
+            if name not in self.loaders:
+                continue
+            current = self.snapshots.get(name)
+            if current is not None:
+                if not replace or items == current.items:
+                    continue
+                # La versión solo puede crecer: invalida los renders hechos con la anterior
+                version = max(version, current.version + 1)
+            self.snapshots[name] = Snapshot(items, version, min(wall_to_monotonic(fetched_at), time.monotonic()))
+            restored += 1
+        return restored
+
+    def get_stats(self):
+        """Contadores de aciertos/fallos y edad de cada snapshot"""
+        stats = dict(self.stats)
+        stats['ages'] = {name: round(snapshot.age(), 1) for name, snapshot in self.snapshots.items()}
+        return stats
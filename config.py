@@ -1,4 +1,6 @@
 import os
+import json
+import secrets
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -6,32 +8,129 @@ load_dotenv()
 # Configuración del Bot
 BOT_TOKEN = os.getenv('BOT_TOKEN', 'TU_TOKEN_AQUI')
 ADMIN_IDS = [int(id) for id in os.getenv('ADMIN_IDS', '').split(',') if id]
+# Servidor de la Bot API (cambiar solo para pruebas de carga o un servidor propio)
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org')
+
+# Configuración del webhook (WEBHOOK_MODE=true)
+# Si no se define un secreto se genera uno por proceso; el webhook se registra en cada arranque
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or secrets.token_urlsafe(32)
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_QUEUE_SIZE = int(os.getenv('WEBHOOK_QUEUE_SIZE', 1000))  # updates pendientes antes de responder 503
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', 16))  # updates procesados en paralelo
+WEBHOOK_DEDUP_SIZE = 10000  # update_id recientes que se recuerdan
+
+# Modo multiproceso (solo webhook): un proceso frontal reparte los updates por chat_id
+# entre SHARDS procesos worker (1 = todo en un proceso, 0 = uno por núcleo)
+SHARDS = int(os.getenv('SHARDS', 1))
+SHARD_VNODES = 128  # puntos de cada worker en el anillo de hashing consistente
+SHARD_SYNC_INTERVAL = int(os.getenv('SHARD_SYNC_INTERVAL', 30))  # segundos entre publicaciones de feeds/proxies
+SHARD_METRICS_PORT = int(os.getenv('SHARD_METRICS_PORT', 0))  # /metrics del worker i en este puerto + i (0 = no)
+SHARD_MAX_RESTARTS = int(os.getenv('SHARD_MAX_RESTARTS', 5))  # caídas seguidas de un worker antes de parar el bot
+SHARD_RESTART_BACKOFF = 1  # segundos antes del primer reinicio; se duplica en cada caída seguida
+
+# Límites de envío de Telegram para la cola de salida
+OUTBOX_GLOBAL_RATE = float(os.getenv('OUTBOX_GLOBAL_RATE', 30))  # mensajes por segundo en total
+OUTBOX_GROUP_RATE = float(os.getenv('OUTBOX_GROUP_RATE', 20 / 60))  # mensajes por segundo en cada grupo (20/min)
+OUTBOX_PRIVATE_RATE = float(os.getenv('OUTBOX_PRIVATE_RATE', 1))  # mensajes por segundo en cada chat privado
+OUTBOX_MAX_RETRIES = 3  # reintentos ante errores de red
+OUTBOX_CHAT_QUEUE = int(os.getenv('OUTBOX_CHAT_QUEUE', 10))  # respuestas interactivas pendientes por chat (se descartan las más antiguas)
+OUTBOX_REPLY_TTL = int(os.getenv('OUTBOX_REPLY_TTL', 30))  # segundos que una respuesta interactiva puede esperar en la cola
+
+# Admisión de comandos (token buckets por usuario y por chat, en comandos por segundo)
+ADMISSION_USER_RATE = float(os.getenv('ADMISSION_USER_RATE', 1 / 10))
+ADMISSION_USER_BURST = int(os.getenv('ADMISSION_USER_BURST', 3))
+ADMISSION_CHAT_RATE = float(os.getenv('ADMISSION_CHAT_RATE', 1 / 5))
+ADMISSION_CHAT_BURST = int(os.getenv('ADMISSION_CHAT_BURST', 5))
+ADMISSION_REUSE_TTL = int(os.getenv('ADMISSION_REUSE_TTL', 60))  # segundos que se reutiliza un resultado
+ADMISSION_NOTICE_TTL = 60  # como mucho un aviso de "espera" por usuario en este tiempo
+# Updates procesados en paralelo en modo polling (en webhook: WEBHOOK_WORKERS)
+CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', 16))
 
 # Configuración de Feeds
+# nombre -> título visible, url y si se incluye el resumen de cada noticia
 FEEDS = {
-    'hackernews': 'https://hnrss.org/frontpage',
-    'zeroclickzero': 'https://feeds.feedburner.com/TheHackersNews',
-    'securityweek': 'https://feeds.feedburner.com/securityweek',
-    'threatpost': 'https://threatpost.com/feed/'
+    'hackernews': {'title': 'HackerNews', 'url': 'https://hnrss.org/frontpage'},
+    'zeroclickzero': {'title': 'ZeroClickZero', 'url': 'https://feeds.feedburner.com/TheHackersNews', 'summary': True},
+    'securityweek': {'title': 'SecurityWeek', 'url': 'https://feeds.feedburner.com/securityweek'},
+    'threatpost': {'title': 'Threatpost', 'url': 'https://threatpost.com/feed/'}
 }
+FEED_ENTRIES = 10  # noticias que se guardan de cada feed
+FEED_MAX_BYTES = int(os.getenv('FEED_MAX_BYTES', 2 * 1024 * 1024))  # se deja de leer un feed al pasar de aquí
+
+# Segundos que un snapshot de feed se considera fresco
+FEED_CACHE_TTL = int(os.getenv('FEED_CACHE_TTL', 300))
 
 # Configuración de Proxies
+# (protocolo, url) de cada fuente de proxies
 PROXY_SOURCES = [
-    'https://api.proxyscrape.com/v2/?request=getproxies&protocol=http&timeout=10000&country=all&ssl=all&anonymity=all',
-    'https://www.proxy-list.download/api/v1/get?type=http'
+    ('http', 'https://api.proxyscrape.com/v2/?request=getproxies&protocol=http&timeout=10000&country=all&ssl=all&anonymity=all'),
+    ('socks4', 'https://api.proxyscrape.com/v2/?request=getproxies&protocol=socks4&timeout=10000&country=all'),
+    ('socks5', 'https://api.proxyscrape.com/v2/?request=getproxies&protocol=socks5&timeout=10000&country=all'),
+    ('http', 'https://www.proxy-list.download/api/v1/get?type=http'),
+    ('https', 'https://www.proxy-list.download/api/v1/get?type=https')
 ]
+PROXY_REFRESH_INTERVAL = int(os.getenv('PROXY_REFRESH_INTERVAL', 900))  # 15 minutos
+PROXY_MAX_AGE = int(os.getenv('PROXY_MAX_AGE', 3600))  # se olvidan tras 1 hora sin verlos
+
+# Comprobación de proxies vivos
+PROXY_CHECK_INTERVAL = int(os.getenv('PROXY_CHECK_INTERVAL', 120))
+PROXY_CHECK_BATCH = int(os.getenv('PROXY_CHECK_BATCH', 2000))  # proxies por ronda
+PROXY_CHECK_CONCURRENCY = int(os.getenv('PROXY_CHECK_CONCURRENCY', 500))  # sockets simultáneos
+PROXY_CHECK_TIMEOUT = float(os.getenv('PROXY_CHECK_TIMEOUT', 5))
+PROXY_CHECK_HOST = os.getenv('PROXY_CHECK_HOST', 'example.com')
+PROXY_CHECK_PORT = int(os.getenv('PROXY_CHECK_PORT', 80))
+PROXY_CHECK_MODE = os.getenv('PROXY_CHECK_MODE', 'http')  # 'http' o 'connect'
 
 # Configuración de la Personalidad
 LAOZHANG_API_URL = os.getenv('LAOZHANG_API_URL', 'https://api.laozhang.com/chat')
 LAOZHANG_API_KEY = os.getenv('LAOZHANG_API_KEY', '')
+LAOZHANG_TIMEOUT = float(os.getenv('LAOZHANG_TIMEOUT', 10))
+LAOZHANG_CONCURRENCY = int(os.getenv('LAOZHANG_CONCURRENCY', 8))  # peticiones simultáneas
+LAOZHANG_FAILURE_THRESHOLD = 3  # fallos seguidos antes de abrir el circuito
+LAOZHANG_RESET_TIMEOUT = 60  # segundos hasta la siguiente llamada de prueba
+
+# Caché de respuestas conversacionales
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', 1000))
+RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', 600))
+
+# Caché de mensajes ya renderizados (la clave incluye la versión de los datos)
+RENDER_CACHE_SIZE = 256
+RENDER_CACHE_TTL = 3600
 
 # Configuración de Grupos
 GROUPS_CONFIG = {
     'inactivity_timeout': 300,  # 5 minutos en segundos
+    'inactivity_timeouts': {},  # timeouts propios por grupo: {chat_id: segundos}
     'max_proxies_per_message': 20,
     'max_news_per_message': 5
 }
 
+# Estado persistente por chat (actividad, interacciones, mensajes enviados)
+STATE_DB_PATH = os.getenv('STATE_DB_PATH', 'tiffany_state.db')
+STATE_CACHE_SIZE = int(os.getenv('STATE_CACHE_SIZE', 50000))  # entradas en memoria
+STATE_FLUSH_BATCH = 500  # escrituras pendientes que fuerzan un volcado
+STATE_FLUSH_INTERVAL = 30  # segundos entre volcados periódicos
+
+# Snapshot en disco de feeds y proxies: se escribe al cerrar y se carga al arrancar
+SNAPSHOT_PATH = os.getenv('SNAPSHOT_PATH', 'tiffany_snapshot.pickle')  # vacío = desactivado
+SNAPSHOT_MAX_AGE = int(os.getenv('SNAPSHOT_MAX_AGE', 86400))  # segundos; más antiguo se ignora
+
+# Difusión programada de noticias a grupos
+# Suscripciones iniciales en JSON, p. ej.:
+# [{"chat_id": -100123, "feeds": ["hackernews"], "interval": 21600, "quiet_hours": [23, 8]}]
+NEWS_SUBSCRIPTIONS = json.loads(os.getenv('NEWS_SUBSCRIPTIONS', '[]'))
+BROADCAST_TICK = int(os.getenv('BROADCAST_TICK', 60))  # segundos entre revisiones de suscripciones
+BROADCAST_DEFAULT_INTERVAL = 21600  # 6 horas entre envíos a un grupo
+BROADCAST_TIMEZONE = os.getenv('BROADCAST_TIMEZONE', 'UTC')  # zona de las horas de silencio
+BROADCAST_NEWS_PER_FEED = 3  # noticias de cada feed por envío
+BROADCAST_INCREMENTAL = os.getenv('BROADCAST_INCREMENTAL', 'True').lower() == 'true'  # solo noticias no enviadas
+
+# Índice de noticias ya entregadas a cada chat
+SEEN_TTL = int(os.getenv('SEEN_TTL', 7 * 86400))  # segundos que se recuerda una entrega
+SEEN_EXPIRE_INTERVAL = 3600  # segundos entre limpiezas del índice
+SEEN_BLOOM_BITS = int(os.getenv('SEEN_BLOOM_BITS', 1 << 20))  # bits del filtro de Bloom por feed (0 = sin filtro)
+SEEN_BLOOM_HASHES = 7
+
 # Saludos y despedidas
 SALUDOS = [
     "¡Bienvenido {nombre}! 👋",
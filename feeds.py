@@ -1,89 +1,309 @@
-import feedparser
-import requests
-from bs4 import BeautifulSoup
-import re
-from datetime import datetime, timedelta
+import asyncio
+import heapq
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from xml.etree.ElementTree import XMLPullParser, ParseError
 import logging
 
+from config import FEEDS, FEED_ENTRIES, FEED_MAX_BYTES, GROUPS_CONFIG
+from render import escape_markdown, escape_url, paginate
+from metrics import UPSTREAM_LATENCY, UPSTREAM_ERRORS
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Tiempo máximo por feed (segundos) y tamaño del pool de conexiones
+FEED_TIMEOUT = 10
+MAX_CONNECTIONS = 20
+# Tamaño de los trozos en que se lee y parsea el cuerpo de un feed
+STREAM_CHUNK = 64 * 1024
+# Longitud de los resúmenes; del HTML original solo se mira un múltiplo de ella
+SUMMARY_LENGTH = 200
+SUMMARY_SOURCE = SUMMARY_LENGTH * 20
+
+# Elementos que son una entrada (RSS 2.0, RSS 1.0 y Atom) y campos equivalentes, por preferencia
+ENTRY_TAGS = {'item', 'entry'}
+GUID_FIELDS = ('guid', 'id')
+DATE_FIELDS = ('pubDate', 'published', 'updated', 'date')
+SUMMARY_FIELDS = ('description', 'summary', 'encoded', 'content')
+
+def local_name(tag):
+    """Nombre de un elemento XML sin su espacio de nombres"""
+    return tag.rpartition('}')[2]
+
+def first_field(fields, names):
+    """Primer campo no vacío de los indicados"""
+    return next((fields[name] for name in names if fields.get(name)), '')
+
+def parse_timestamp(value):
+    """Fecha RFC 822 (RSS) o ISO 8601 (Atom) como timestamp UTC (0 si no se entiende)"""
+    if not value:
+        return 0
+    try:
+        parsed = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        try:
+            parsed = datetime.fromisoformat(value)
+        except ValueError:
+            return 0
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp())
+
+def summary_text(html, length=SUMMARY_LENGTH):
+    """Resumen en texto plano: sin etiquetas ni entidades y cortado entre palabras"""
+    html = html[:SUMMARY_SOURCE]
+    if '<' in html or '&' in html:
+        from bs4 import BeautifulSoup
+        html = BeautifulSoup(html, 'html.parser').get_text(' ')
+    text = ' '.join(html.split())
+    if len(text) <= length:
+        return text
+    return text[:length].rsplit(' ', 1)[0] + '...'
+
+def raw_entry(element):
+    """Campos de texto de un <item>/<entry> como dict (nombre local -> texto)"""
+    fields = {}
+    for child in element:
+        name = local_name(child.tag)
+        href = child.get('href')
+        if name == 'link' and href is not None:
+            # Atom: <link rel="alternate" href="..."/>
+            if child.get('rel', 'alternate') == 'alternate':
+                fields.setdefault('link', href)
+            continue
+        fields.setdefault(name, ''.join(child.itertext()).strip())
+    return fields
+
+def make_item(fields, source, with_summary=False):
+    """Noticia a partir de los campos en bruto de una entrada"""
+    published = first_field(fields, DATE_FIELDS)
+    item = {
+        'title': fields['title'],
+        'link': fields['link'],
+        'guid': first_field(fields, GUID_FIELDS) or fields['link'],
+        'published': published,
+        'timestamp': parse_timestamp(published),
+        'source': source
+    }
+    if with_summary:
+        item['summary'] = summary_text(first_field(fields, SUMMARY_FIELDS))
+    return item
+
+def merge_timeline(feeds_items):
+    """Mezcla (k-way, con heap) listas ya ordenadas en una línea temporal, más recientes primero"""
+    return heapq.merge(*feeds_items, key=lambda item: item['timestamp'], reverse=True)
+
+class FeedStream:
+    """Parser incremental de RSS/Atom.
+
+    Recibe el documento a trozos y reúne entradas hasta tener `limit`; cada
+    entrada se vacía al leerla, así que ni la memoria ni el trabajo dependen
+    de lo largo que sea el feed. Lanza ParseError si el XML no es válido.
+    """
+
+    def __init__(self, limit=FEED_ENTRIES):
+        self.limit = limit
+        self.entries = []
+        self._parser = XMLPullParser(events=('end',))
+
+    @property
+    def done(self):
+        return len(self.entries) >= self.limit
+
+    def feed(self, chunk):
+        """Procesa un trozo del documento"""
+        self._parser.feed(chunk)
+        for _, element in self._parser.read_events():
+            if self.done:
+                break
+            if local_name(element.tag) in ENTRY_TAGS:
+                fields = raw_entry(element)
+                if fields.get('title') and fields.get('link'):
+                    self.entries.append(fields)
+                element.clear()
+
 class NewsFeedFetcher:
-    def __init__(self):
+    """Descarga los feeds registrados en config.FEEDS"""
+
+    def __init__(self, feeds=FEEDS, timeout=FEED_TIMEOUT, max_bytes=FEED_MAX_BYTES):
+        # nombre -> {'title', 'url', 'summary'}
+        self.feeds = feeds
+        # url -> {'etag', 'modified', 'items', 'fetched_at'}
         self.last_fetch = {}
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self._session = None
         
-    def fetch_hackernews(self):
-        """Obtiene noticias de HackerNews"""
+    async def get_session(self):
+        """Devuelve la sesión HTTP compartida, creándola si hace falta"""
+        if self._session is None or self._session.closed:
+            # aiohttp, feedparser y bs4 se importan en el primer uso: arranque más rápido
+            import aiohttp
+            connector = aiohttp.TCPConnector(limit=MAX_CONNECTIONS, ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers={'User-Agent': 'TiffanyBot/3.0 (+https://t.me)'}
+            )
+        return self._session
+
+    async def close(self):
+        """Cierra la sesión HTTP compartida"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def title(self, name):
+        """Título visible de un feed registrado"""
+        return self.feeds[name]['title'] if name in self.feeds else name
+
+    def parse_loose(self, content, limit=FEED_ENTRIES):
+        """Entradas en bruto con feedparser, que tolera lo que el parser XML no
+        acepta (entidades HTML sin declarar, codificaciones raras, etiquetas sin cerrar)
+        """
+        import feedparser
+        feed = feedparser.parse(content)
+        return [
+            {
+                'title': entry.title,
+                'link': entry.link,
+                'id': entry.get('id', ''),
+                'published': entry.get('published') or entry.get('updated', ''),
+                'summary': entry.get('summary', '')
+            }
+            for entry in feed.entries[:limit]
+            if entry.get('title') and entry.get('link')
+        ]
+
+    def build_items(self, entries, source, with_summary=False):
+        """Convierte entradas en bruto en noticias, más recientes primero"""
+        news_items = [make_item(fields, source, with_summary) for fields in entries]
+        # La mezcla de la línea temporal necesita cada feed ordenado por fecha
+        news_items.sort(key=lambda item: item['timestamp'], reverse=True)
+        return news_items
+
+    def parse_entries(self, content, source, limit=FEED_ENTRIES, with_summary=False):
+        """Convierte el contenido de un feed en una lista de noticias, más recientes primero"""
+        content = content[:self.max_bytes]
+        stream = FeedStream(limit)
         try:
-            feed = feedparser.parse('https://hnrss.org/frontpage')
-            news_items = []
-            
-            for entry in feed.entries[:10]:  # Últimas 10 noticias
-                item = {
-                    'title': entry.title,
-                    'link': entry.link,
-                    'published': entry.published if hasattr(entry, 'published') else '',
-                    'source': 'HackerNews'
-                }
-                news_items.append(item)
-                
-            return news_items
-        except Exception as e:
-            logger.error(f"Error fetching HackerNews: {e}")
-            return []
-    
-    def fetch_zeroclickzero(self):
-        """Obtiene noticias de Zero Click Zero"""
+            for start in range(0, len(content), STREAM_CHUNK):
+                stream.feed(content[start:start + STREAM_CHUNK])
+                if stream.done:
+                    break
+            entries = stream.entries
+        except ParseError:
+            entries = self.parse_loose(content, limit)
+        return self.build_items(entries, source, with_summary)
+
+    async def _feed_stream(self, stream, data, source):
+        """Parsea un tramo en un hilo; False si el XML no es válido"""
+        try:
+            await asyncio.to_thread(stream.feed, data)
+        except ParseError as e:
+            logger.warning(f"XML no válido en {source} ({e}); se usa feedparser")
+            return False
+        return True
+
+    async def read_entries(self, response, source, limit=FEED_ENTRIES):
+        """Lee el cuerpo a trozos y lo parsea en un hilo; deja de descargar al reunir `limit` entradas"""
+        stream = FeedStream(limit)
+        # Solo se guarda el cuerpo por si hay que recurrir a feedparser
+        body = bytearray()
+        parsed = 0
+        async for chunk in response.content.iter_chunked(STREAM_CHUNK):
+            body += chunk
+            if len(body) >= self.max_bytes:
+                logger.warning(f"{source} supera {self.max_bytes} bytes; se usa lo leído")
+                break
+            # Se parsea por tramos de al menos STREAM_CHUNK bytes: pocos saltos al hilo
+            if stream is not None and len(body) - parsed >= STREAM_CHUNK:
+                if not await self._feed_stream(stream, bytes(body[parsed:]), source):
+                    stream = None
+                elif stream.done:
+                    return stream.entries
+                parsed = len(body)
+        if stream is not None and parsed < len(body):
+            if not await self._feed_stream(stream, bytes(body[parsed:self.max_bytes]), source):
+                stream = None
+        if stream is not None:
+            return stream.entries
+        return await asyncio.to_thread(self.parse_loose, bytes(body[:self.max_bytes]), limit)
+
+    async def fetch_feed(self, url, source, limit=FEED_ENTRIES, with_summary=False):
+        """Descarga un feed sin bloquear el event loop, usando GET condicional"""
+        cached = self.last_fetch.get(url)
+        headers = {}
+        if cached:
+            if cached.get('etag'):
+                headers['If-None-Match'] = cached['etag']
+            if cached.get('modified'):
+                headers['If-Modified-Since'] = cached['modified']
+
         try:
-            feed = feedparser.parse('https://feeds.feedburner.com/TheHackersNews')
-            news_items = []
-            
-            for entry in feed.entries[:10]:
-                item = {
-                    'title': entry.title,
-                    'link': entry.link,
-                    'published': entry.published if hasattr(entry, 'published') else '',
-                    'summary': entry.summary[:200] + '...' if hasattr(entry, 'summary') else '',
-                    'source': 'ZeroClickZero'
-                }
-                news_items.append(item)
-                
-            return news_items
+            session = await self.get_session()
+            with UPSTREAM_LATENCY.time(upstream='feed', name=source):
+                async with session.get(url, headers=headers) as response:
+                    if response.status == 304 and cached:
+                        cached['fetched_at'] = datetime.now()
+                        return cached['items']
+                    response.raise_for_status()
+                    etag = response.headers.get('ETag')
+                    modified = response.headers.get('Last-Modified')
+                    entries = await self.read_entries(response, source, limit)
         except Exception as e:
-            logger.error(f"Error fetching ZeroClickZero: {e}")
-            return []
+            UPSTREAM_ERRORS.inc(upstream='feed', name=source, reason=type(e).__name__)
+            logger.error(f"Error fetching {source}: {e!r}")
+            return cached['items'] if cached else []
     
-    def fetch_security_forums(self):
-        """Obtiene noticias de foros de seguridad"""
-        forums = []
-        # Aquí puedes añadir más foros
         try:
-            # Ejemplo: SecurityWeek RSS
-            feed = feedparser.parse('https://feeds.feedburner.com/securityweek')
-            for entry in feed.entries[:5]:
-                forums.append({
-                    'title': entry.title,
-                    'link': entry.link,
-                    'source': 'SecurityWeek'
-                })
+            # Fechas y limpieza del HTML de los resúmenes son CPU puro: van al pool de hilos
+            items = await asyncio.to_thread(self.build_items, entries, source, with_summary)
         except Exception as e:
-            logger.error(f"Error fetching forums: {e}")
-            
-        return forums
+            logger.error(f"Error parsing {source}: {e}")
+            return cached['items'] if cached else []
+
+        self.last_fetch[url] = {
+            'etag': etag,
+            'modified': modified,
+            'items': items,
+            'fetched_at': datetime.now()
+        }
+        return items
+
+    async def fetch(self, name):
+        """Obtiene las noticias de un feed registrado"""
+        feed = self.feeds[name]
+        return await self.fetch_feed(feed['url'], feed['title'], with_summary=feed.get('summary', False))
+
+    async def fetch_many(self, names=None):
+        """Descarga varios feeds registrados a la vez; devuelve nombre -> noticias"""
+        names = list(self.feeds if names is None else names)
+        results = await asyncio.gather(*(self.fetch(name) for name in names))
+        return dict(zip(names, results))
+
+    def loaders(self):
+        """Funciones de carga por feed, para SnapshotCache"""
+        return {name: (lambda name=name: self.fetch(name)) for name in self.feeds}
     
-    def format_news_message(self, news_items, source=None):
-        """Formatea las noticias para enviar por Telegram"""
+    def format_news_pages(self, news_items, source=None, per_page=5):
+        """Formatea las noticias en MarkdownV2, en páginas que caben en un mensaje"""
         if not news_items:
-            return "No se encontraron noticias recientes."
-        
-        message = f"📰 *Últimas noticias de {source if source else 'Ciberseguridad'}*\n\n"
+            return [escape_markdown("No se encontraron noticias recientes.")]
         
-        for i, item in enumerate(news_items[:5], 1):
-            title = item['title'].replace('*', '\\*').replace('_', '\\_')
-            message += f"{i}. *{title}*\n"
+        header = f"📰 *Últimas noticias de {escape_markdown(source or 'Ciberseguridad')}*\n\n"
+        blocks = []
+        for i, item in enumerate(news_items, 1):
+            block = f"{i}\\. *{escape_markdown(item['title'])}*\n"
             if 'summary' in item:
-                message += f"   {item['summary']}\n"
-            message += f"   🔗 [Leer más]({item['link']})\n\n"
+                block += f"   {escape_markdown(item['summary'])}\n"
+            block += f"   🔗 [Leer más]({escape_url(item['link'])})\n\n"
+            blocks.append(block)
         
-        message += f"\n📊 Total: {len(news_items)} noticias"
-        return message
+        footer = f"\n📊 Total: {len(news_items)} noticias"
+        return paginate(header, blocks, footer, per_page=per_page)
+
+    def format_news_message(self, news_items, source=None):
+        """Formatea las primeras noticias en un solo mensaje MarkdownV2"""
+        return self.format_news_pages(news_items[:GROUPS_CONFIG['max_news_per_message']], source)[0]
@@ -0,0 +1,124 @@
+import asyncio
+import heapq
+import time
+import logging
+
+from config import GROUPS_CONFIG
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class InactivityMonitor:
+    """Un único planificador de plazos para la inactividad de todos los grupos.
+
+    Cada grupo tiene un plazo (última actividad + timeout) en un heap. Al haber
+    actividad se añade el nuevo plazo y el anterior queda obsoleto (se descarta
+    al salir del heap), así que reprogramar cuesta O(log n). Una sola tarea
+    duerme hasta el plazo vivo más próximo y solo avisa a los grupos que de
+    verdad se han quedado inactivos, una vez por periodo de silencio.
+    """
+
+    def __init__(self, on_idle, timeout=None, timeouts=None):
+        # on_idle(group_id) es una corrutina que se lanza cuando vence el plazo
+        self.on_idle = on_idle
+        self.timeout = timeout or GROUPS_CONFIG['inactivity_timeout']
+        # Timeouts propios de algunos grupos (group_id -> segundos)
+        self.timeouts = timeouts if timeouts is not None else GROUPS_CONFIG.get('inactivity_timeouts', {})
+        self._heap = []
+        # group_id -> plazo vigente (monotónico)
+        self._deadlines = {}
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._callbacks = set()
+        self.stats = {'scheduled': 0, 'fired': 0, 'stale': 0, 'wakeups': 0}
+
+    def __len__(self):
+        return len(self._deadlines)
+
+    def timeout_for(self, group_id):
+        return self.timeouts.get(group_id, self.timeout)
+
+    def touch(self, group_id, now=None):
+        """Registra actividad en un grupo y reprograma su plazo"""
+        if group_id is None or int(group_id) > 0:
+            # Los chats privados (id positivo) no se vigilan
+            return
+        now = time.monotonic() if now is None else now
+        deadline = now + self.timeout_for(group_id)
+        first = self._heap[0][0] if self._heap else None
+        self._deadlines[group_id] = deadline
+        heapq.heappush(self._heap, (deadline, group_id))
+        self.stats['scheduled'] += 1
+        if len(self._heap) > 2 * len(self._deadlines) + 64:
+            self._compact()
+        if first is None or deadline < first:
+            # El nuevo plazo es el más próximo: la tarea debe despertar antes
+            self._wakeup.set()
+
+    def forget(self, group_id):
+        """Deja de vigilar un grupo (su entrada en el heap queda obsoleta)"""
+        self._deadlines.pop(group_id, None)
+
+    def _compact(self):
+        self._heap = [(deadline, group_id) for group_id, deadline in self._deadlines.items()]
+        heapq.heapify(self._heap)
+
+    def _is_current(self, entry):
+        return self._deadlines.get(entry[1]) == entry[0]
+
+    def pop_expired(self, now=None):
+        """Saca del heap los grupos cuyo plazo ya venció"""
+        now = time.monotonic() if now is None else now
+        expired = []
+        heap = self._heap
+        while heap and (heap[0][0] <= now or not self._is_current(heap[0])):
+            deadline, group_id = heapq.heappop(heap)
+            if self._deadlines.get(group_id) != deadline:
+                self.stats['stale'] += 1
+                continue
+            del self._deadlines[group_id]
+            expired.append(group_id)
+        return expired
+
+    def next_deadline(self):
+        """Plazo vivo más próximo (el heap ya está limpio tras pop_expired)"""
+        return self._heap[0][0] if self._heap else None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+            for group_id in self.pop_expired(now):
+                self.stats['fired'] += 1
+                task = asyncio.create_task(self._notify(group_id))
+                self._callbacks.add(task)
+                task.add_done_callback(self._callbacks.discard)
+            deadline = self.next_deadline()
+            timeout = None if deadline is None else max(0, deadline - now)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self.stats['wakeups'] += 1
+
+    async def _notify(self, group_id):
+        try:
+            await self.on_idle(group_id)
+        except Exception as e:
+            logger.error(f"Error notificando inactividad en {group_id}: {e}")
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['groups'] = len(self._deadlines)
+        stats['heap'] = len(self._heap)
+        return stats
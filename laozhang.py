@@ -0,0 +1,169 @@
+import asyncio
+import time
+import logging
+
+from config import (
+    LAOZHANG_API_URL,
+    LAOZHANG_API_KEY,
+    LAOZHANG_TIMEOUT,
+    LAOZHANG_CONCURRENCY,
+    LAOZHANG_FAILURE_THRESHOLD,
+    LAOZHANG_RESET_TIMEOUT
+)
+from metrics import UPSTREAM_LATENCY, UPSTREAM_ERRORS
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class CircuitBreaker:
+    """Circuit breaker cerrado/abierto/semiabierto.
+
+    Tras `failure_threshold` fallos seguidos se abre y rechaza llamadas durante
+    `reset_timeout` segundos; después deja pasar una única llamada de prueba
+    (semiabierto) que decide si se vuelve a cerrar o se abre otra vez.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=LAOZHANG_FAILURE_THRESHOLD, reset_timeout=LAOZHANG_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+    def is_open(self):
+        """True mientras el circuito rechaza llamadas (sin contar la prueba pendiente)"""
+        return self.state == self.OPEN and time.monotonic() - self.opened_at < self.reset_timeout
+
+    def allow(self):
+        """Indica si se puede hacer una llamada ahora"""
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def cancel_probe(self):
+        """Libera la llamada de prueba si se canceló antes de terminar"""
+        self._probing = False
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logger.info("API de Laozhang recuperada, circuito cerrado")
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(f"API de Laozhang no disponible, circuito abierto {self.reset_timeout}s")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+class LaozhangClient:
+    """Cliente asíncrono de la API de chat con pool de conexiones y circuit breaker"""
+
+    def __init__(self, url=LAOZHANG_API_URL, api_key=LAOZHANG_API_KEY,
+                 timeout=LAOZHANG_TIMEOUT, concurrency=LAOZHANG_CONCURRENCY):
+        self.url = url
+        self.api_key = api_key
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.breaker = CircuitBreaker()
+        self.stats = {
+            'requests': 0,
+            'successes': 0,
+            'errors': 0,
+            'timeouts': 0,
+            'rejected': 0,
+            'latency_total': 0.0,
+            'latency_max': 0.0
+        }
+        self._semaphore = None
+        self._session = None
+
+    @property
+    def enabled(self):
+        return bool(self.url and self.api_key)
+
+    @property
+    def available(self):
+        """True salvo que el circuito esté abierto"""
+        return self.enabled and not self.breaker.is_open()
+
+    async def get_session(self):
+        """Devuelve la sesión HTTP compartida, creándola si hace falta"""
+        if self._session is None or self._session.closed:
+            import aiohttp
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.concurrency, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers={'Authorization': f'Bearer {self.api_key}'}
+            )
+        return self._session
+
+    async def close(self):
+        """Cierra la sesión HTTP compartida"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def complete(self, message, bot_name='Tiffany'):
+        """Pide una respuesta a la API; devuelve None si no está disponible o falla"""
+        if not self.enabled:
+            return None
+        if not self.breaker.allow():
+            self.stats['rejected'] += 1
+            return None
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+
+        self.stats['requests'] += 1
+        start = time.perf_counter()
+        try:
+            async with self._semaphore:
+                session = await self.get_session()
+                data = {'message': message, 'bot_name': bot_name}
+                async with session.post(self.url, json=data) as response:
+                    # ClientResponseError si no es 2xx
+                    response.raise_for_status()
+                    payload = await response.json(content_type=None)
+        except asyncio.CancelledError:
+            self.breaker.cancel_probe()
+            raise
+        except asyncio.TimeoutError:
+            self.stats['timeouts'] += 1
+            UPSTREAM_ERRORS.inc(upstream='chat_api', name='laozhang', reason='timeout')
+            self.breaker.record_failure()
+            logger.warning(f"Timeout con API Laozhang ({self.timeout}s)")
+            return None
+        except Exception as e:
+            self.stats['errors'] += 1
+            UPSTREAM_ERRORS.inc(upstream='chat_api', name='laozhang', reason=type(e).__name__)
+            self.breaker.record_failure()
+            logger.error(f"Error con API Laozhang: {e}")
+            return None
+
+        latency = time.perf_counter() - start
+        UPSTREAM_LATENCY.observe(latency, upstream='chat_api', name='laozhang')
+        self.stats['successes'] += 1
+        self.stats['latency_total'] += latency
+        self.stats['latency_max'] = max(self.stats['latency_max'], latency)
+        self.breaker.record_success()
+        return payload.get('response') if isinstance(payload, dict) else None
+
+    def get_stats(self):
+        """Contadores de llamadas, errores y latencia media"""
+        stats = dict(self.stats)
+        stats['latency_avg'] = stats['latency_total'] / stats['successes'] if stats['successes'] else 0.0
+        stats['circuit'] = self.breaker.state
+        return stats
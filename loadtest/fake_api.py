@@ -0,0 +1,259 @@
+"""Bot API de Telegram falsa para pruebas de carga.
+
+Implementa lo que usa el bot (getMe, getUpdates, setWebhook, sendMessage,
+editMessageText, sendDocument...) y mide, para cada update inyectado, cuánto
+tarda la primera respuesta (sendMessage que lo cita) y, en los comandos, la
+edición final. Si el bot registra un webhook, los updates se le envían por
+POST como haría Telegram (reintentando tras un 503).
+"""
+import asyncio
+import json
+import random
+import time
+from collections import Counter, deque
+
+from aiohttp import ClientError, ClientSession, web
+
+COMMANDS = ('/start', '/news', '/hackernews', '/zeroclick', '/proxies', '/randomproxies')
+TEXTS = (
+    "hola a todos", "alguien sabe de nmap?", "nuevo ransomware en la red", "qué tal el partido",
+    "cómo configuro un firewall en linux", "hay algún exploit para esto", "buenos días",
+    "el phishing de ayer era muy bueno", "recomendáis alguna vpn", "hasta luego"
+)
+
+def percentile(values, q):
+    """Percentil q (0-100) por el método del rango más cercano"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(q / 100 * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+def summarize(latencies):
+    """p50/p90/p99/máx en milisegundos"""
+    return {
+        'count': len(latencies),
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+        'p90_ms': round(percentile(latencies, 90) * 1000, 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+        'max_ms': round(max(latencies) * 1000, 2) if latencies else None
+    }
+
+class FakeBotAPI:
+    """Servidor aiohttp que imita la Bot API y registra latencias de respuesta"""
+
+    def __init__(self, token, chats=100, users=500, command_ratio=0.2, seed=1):
+        self.token = token
+        self.chats = [-1000000000000 - i for i in range(chats)]
+        self.users = users
+        self.command_ratio = command_ratio
+        self.rng = random.Random(seed)
+        self.web_app = web.Application()
+        self.web_app.router.add_route('*', f'/bot{token}/{{method}}', self.handle)
+
+        self._updates = deque()
+        self._update_id = 0
+        self._message_ids = {}
+        self._new_updates = asyncio.Event()
+        # El bot ya está conectado (primer getUpdates o setWebhook)
+        self.connected = asyncio.Event()
+        self.webhook = None
+        self._session = None
+        self._posts = set()
+        # Conexiones simultáneas al webhook (max_connections de Telegram)
+        self._post_slots = asyncio.Semaphore(40)
+        self.webhook_retries = 0
+        # (chat_id, message_id) del update -> instante de inyección
+        self.injected = {}
+        self.commands = set()
+        # (chat_id, message_id) del bot -> (chat_id, message_id) del update original
+        self._sent = {}
+        self.first_reply = {}
+        self.final_reply = {}
+        self.acknowledged = 0
+        self.last_ack_at = None
+        self.last_reply_at = None
+        self.calls = Counter()
+
+    # --- Inyección de updates ---------------------------------------------
+
+    def _next_message_id(self, chat_id):
+        self._message_ids[chat_id] = self._message_ids.get(chat_id, 0) + 1
+        return self._message_ids[chat_id]
+
+    def make_update(self, text=None):
+        chat_id = self.rng.choice(self.chats)
+        user_id = self.rng.randrange(1, self.users + 1)
+        message_id = self._next_message_id(chat_id)
+        if text is None:
+            is_command = self.rng.random() < self.command_ratio
+            text = self.rng.choice(COMMANDS) if is_command else self.rng.choice(TEXTS)
+        else:
+            is_command = text.startswith('/')
+        message = {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'supergroup', 'title': f"Grupo {chat_id}"},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f"Usuario{user_id}", 'username': f"user{user_id}"},
+            'text': text
+        }
+        if is_command:
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text)}]
+            self.commands.add((chat_id, message_id))
+        self._update_id += 1
+        self.injected[(chat_id, message_id)] = time.monotonic()
+        return {'update_id': self._update_id, 'message': message}
+
+    def deliver(self, update):
+        """Entrega un update: a la cola de getUpdates o por POST al webhook"""
+        if self.webhook is None:
+            self._updates.append(update)
+            self._new_updates.set()
+            return
+        task = asyncio.ensure_future(self._post(update))
+        self._posts.add(task)
+        task.add_done_callback(self._posts.discard)
+
+    async def _post(self, update):
+        url, secret = self.webhook
+        headers = {'X-Telegram-Bot-Api-Secret-Token': secret} if secret else {}
+        if self._session is None:
+            self._session = ClientSession()
+        async with self._post_slots:
+            while True:
+                try:
+                    async with self._session.post(url, json=update, headers=headers) as response:
+                        if response.status == 200:
+                            self.acknowledged += 1
+                            self.last_ack_at = time.monotonic()
+                            return
+                except ClientError:
+                    pass
+                self.webhook_retries += 1
+                await asyncio.sleep(1)
+
+    def probe(self, text='/news'):
+        """Entrega un único update y devuelve su clave, para medir el arranque"""
+        update = self.make_update(text)
+        self.deliver(update)
+        message = update['message']
+        return message['chat']['id'], message['message_id']
+
+    async def inject(self, total, rate):
+        """Encola `total` updates a `rate` por segundo (en ráfagas de 10 ms)"""
+        interval = 0.01
+        per_tick = max(1, round(rate * interval))
+        start = time.monotonic()
+        sent = 0
+        while sent < total:
+            for _ in range(min(per_tick, total - sent)):
+                self.deliver(self.make_update())
+                sent += 1
+            delay = start + sent / rate - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    # --- Bot API ----------------------------------------------------------
+
+    async def handle(self, request):
+        method = request.match_info['method']
+        self.calls[method] += 1
+        params = dict(await request.post()) if request.method == 'POST' else dict(request.query)
+        handler = getattr(self, f"api_{method}", None)
+        result = await handler(params) if handler is not None else True
+        return web.json_response({'ok': True, 'result': result})
+
+    def _bot_message(self, chat_id, message_id, text=''):
+        return {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'supergroup', 'title': f"Grupo {chat_id}"},
+            'from': {'id': 1, 'is_bot': True, 'first_name': 'Tiffany', 'username': 'tiffany_bot'},
+            'text': text
+        }
+
+    async def api_getMe(self, params):
+        return {'id': 1, 'is_bot': True, 'first_name': 'Tiffany', 'username': 'tiffany_bot'}
+
+    async def api_setWebhook(self, params):
+        self.webhook = (params['url'], params.get('secret_token'))
+        self.connected.set()
+        return True
+
+    async def api_getUpdates(self, params):
+        self.connected.set()
+        offset = int(params.get('offset') or 0)
+        while self._updates and self._updates[0]['update_id'] < offset:
+            self._updates.popleft()
+            self.acknowledged += 1
+            self.last_ack_at = time.monotonic()
+        if not self._updates:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), float(params.get('timeout') or 0) or 0.1)
+            except asyncio.TimeoutError:
+                return []
+        limit = int(params.get('limit') or 100)
+        return [self._updates[i] for i in range(min(limit, len(self._updates)))]
+
+    def _reply_origin(self, params):
+        reply_to = params.get('reply_to_message_id')
+        if reply_to is None and 'reply_parameters' in params:
+            reply_to = json.loads(params['reply_parameters']).get('message_id')
+        return None if reply_to is None else (int(params['chat_id']), int(reply_to))
+
+    def _record_send(self, params):
+        chat_id = int(params['chat_id'])
+        message_id = self._next_message_id(chat_id)
+        origin = self._reply_origin(params)
+        if origin in self.injected:
+            now = time.monotonic()
+            self.first_reply.setdefault(origin, now - self.injected[origin])
+            self._sent[(chat_id, message_id)] = origin
+            self.last_reply_at = now
+        return self._bot_message(chat_id, message_id, params.get('text', ''))
+
+    async def api_sendMessage(self, params):
+        return self._record_send(params)
+
+    async def api_sendDocument(self, params):
+        return self._record_send(params)
+
+    async def api_editMessageText(self, params):
+        chat_id = int(params['chat_id'])
+        message_id = int(params['message_id'])
+        origin = self._sent.get((chat_id, message_id))
+        if origin is not None:
+            now = time.monotonic()
+            self.final_reply[origin] = now - self.injected[origin]
+            self.last_reply_at = now
+        return self._bot_message(chat_id, message_id, params.get('text', ''))
+
+    # --- Resultados -------------------------------------------------------
+
+    def report(self, started_at, exclude=()):
+        """Throughput y latencias de la prueba (sin los updates de `exclude`)"""
+        finished = self.last_ack_at or time.monotonic()
+        duration = max(finished - started_at, 1e-9)
+        first_reply = {key: latency for key, latency in self.first_reply.items() if key not in exclude}
+        final_reply = {key: latency for key, latency in self.final_reply.items() if key not in exclude}
+        commands = self.commands.difference(exclude)
+        command_first = [latency for key, latency in first_reply.items() if key in commands]
+        text_first = [latency for key, latency in first_reply.items() if key not in commands]
+        return {
+            'injected': len(self.injected) - len(exclude),
+            'acknowledged': self.acknowledged - len(exclude),
+            'duration_s': round(duration, 3),
+            'updates_per_s': round(self.acknowledged / duration, 1),
+            'replies': len(first_reply),
+            'commands': len(commands),
+            'commands_unanswered': len(commands - first_reply.keys()),
+            'first_reply': summarize(list(first_reply.values())),
+            'command_first_reply': summarize(command_first),
+            'text_first_reply': summarize(text_first),
+            'command_completed': summarize([
+                latency for key, latency in final_reply.items() if key in commands
+            ]),
+            'webhook_retries': self.webhook_retries,
+            'api_calls': dict(self.calls)
+        }
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+"""Prueba de carga de extremo a extremo.
+
+Arranca una Bot API falsa y servidores locales para feeds, proxies y Laozhang,
+apunta el bot a ellos y ejecuta el main() real de bot.py en modo polling.
+Inyecta una tormenta de mensajes y comandos en muchos grupos y, cuando el bot
+la ha digerido, imprime throughput y latencias p50/p99 de respuesta.
+
+Uso:
+    python loadtest/run.py                                  # 2000 updates a 200/s en 100 grupos
+    python loadtest/run.py -n 10000 --rate 1000 --chats 1000 -o carga.json
+    python loadtest/run.py --upstream-latency 0.5           # upstreams lentos
+    python loadtest/run.py --telegram-limits                # con los límites de envío reales
+    python loadtest/run.py --snapshot /tmp/snap.pickle      # 2ª ejecución: arranque con snapshot
+    python loadtest/run.py --shards 4 --rate 2000           # webhook con 4 procesos worker
+
+Al primer getUpdates se envía un /news de prueba: el informe incluye cuánto
+tarda el arranque y cuánto la primera respuesta completa tras él.
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+# Inicio del proceso, para medir el arranque del bot
+PROCESS_START = time.monotonic()
+
+from aiohttp import ClientSession, web
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+# frases.json se carga con ruta relativa
+os.chdir(ROOT)
+
+from fake_api import FakeBotAPI
+from stubs import UpstreamStubs
+
+TOKEN = '123456:LOADTEST'
+FEED_NAMES = ('hackernews', 'zeroclickzero', 'securityweek', 'threatpost')
+
+def patch_config(stubs_url):
+    """Apunta feeds y fuentes de proxies a los stubs (config.py no los lee del entorno)"""
+    import config
+    config.FEEDS.clear()
+    config.FEEDS.update({
+        name: {'title': name.capitalize(), 'url': f"{stubs_url}/feeds/{name}.xml"}
+        for name in FEED_NAMES
+    })
+    config.PROXY_SOURCES[:] = [
+        (protocol, f"{stubs_url}/proxies/{protocol}.txt")
+        for protocol in ('http', 'socks4', 'socks5')
+    ]
+
+# Los workers del modo multiproceso (spawn) importan este módulo antes que bot.py
+if 'LOADTEST_STUBS_URL' in os.environ:
+    patch_config(os.environ['LOADTEST_STUBS_URL'])
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def port_is_free(port):
+    with socket.socket() as sock:
+        try:
+            sock.bind(('127.0.0.1', port))
+        except OSError:
+            return False
+        return True
+
+def free_port_range(count, exclude=()):
+    """Primer puerto de `count` puertos consecutivos libres que no incluyen `exclude`"""
+    for _ in range(100):
+        base = free_port()
+        ports = range(base, base + count)
+        if ports[-1] < 65536 and not set(ports) & set(exclude) and all(map(port_is_free, ports)):
+            return base
+    raise RuntimeError(f"No hay {count} puertos consecutivos libres")
+
+class Harness:
+    """Servidores falsos en su propio hilo y bucle de eventos"""
+
+    def __init__(self, args):
+        self.args = args
+        self.loop = asyncio.new_event_loop()
+        self.ready = threading.Event()
+        self.api = None
+        self.stubs = None
+        self.api_url = None
+        self.stubs_url = None
+        self.result = None
+        self.error = None
+
+    def start(self):
+        threading.Thread(target=self.loop.run_until_complete, args=(self._run(),), daemon=True).start()
+        if not self.ready.wait(10):
+            raise RuntimeError("Los servidores falsos no arrancaron")
+
+    async def _serve(self, web_app):
+        runner = web.AppRunner(web_app, access_log=None)
+        await runner.setup()
+        port = free_port()
+        await web.TCPSite(runner, '127.0.0.1', port).start()
+        return runner, f"http://127.0.0.1:{port}"
+
+    async def _run(self):
+        args = self.args
+        try:
+            self.api = FakeBotAPI(TOKEN, chats=args.chats, users=args.users,
+                                  command_ratio=args.command_ratio, seed=args.seed)
+            self.stubs = UpstreamStubs(latency=args.upstream_latency, jitter=args.upstream_jitter, seed=args.seed)
+            _, self.api_url = await self._serve(self.api.web_app)
+            _, self.stubs_url = await self._serve(self.stubs.web_app)
+            self.ready.set()
+
+            # El bot está listo cuando hace su primer getUpdates (o registra el webhook):
+            # /news de prueba y un margen para los jobs iniciales antes de la tormenta
+            await asyncio.wait_for(self.api.connected.wait(), 60)
+            first_poll = time.monotonic() - PROCESS_START
+            probe = self.api.probe('/news')
+            # En modo multiproceso los workers aún arrancan tras setWebhook: se
+            # espera a que respondan al /news antes de contar el margen
+            deadline = time.monotonic() + 60
+            while probe not in self.api.first_reply and time.monotonic() < deadline:
+                await asyncio.sleep(0.05)
+            await asyncio.sleep(args.warmup)
+
+            started_at = time.monotonic()
+            await self.api.inject(args.updates, args.rate)
+            await self._settle()
+            self.result = self.api.report(started_at, exclude={probe})
+            self.result['startup'] = {
+                'first_poll_s': round(first_poll, 3),
+                'news_first_reply_ms': round(self.api.first_reply[probe] * 1000, 2) if probe in self.api.first_reply else None,
+                'news_completed_ms': round(self.api.final_reply[probe] * 1000, 2) if probe in self.api.final_reply else None
+            }
+            self.result['upstream_requests'] = dict(self.stubs.requests)
+            self.result['admission'] = await self._bot_metric('tiffany_admission_total')
+            self.result['settings'] = {
+                'updates': args.updates, 'rate': args.rate, 'chats': args.chats,
+                'command_ratio': args.command_ratio, 'upstream_latency': args.upstream_latency,
+                'telegram_limits': args.telegram_limits, 'shards': args.shards
+            }
+        except Exception as e:
+            self.error = e
+            self.ready.set()
+        # Detiene run_polling como lo haría Ctrl+C; los servidores siguen atendiendo
+        # el último getUpdates del apagado hasta que termina el proceso
+        os.kill(os.getpid(), signal.SIGINT)
+        await asyncio.Event().wait()
+
+    async def _bot_metric(self, name):
+        """Series de una métrica del /metrics del bot (sumadas entre workers): {etiquetas: valor}"""
+        if self.args.shards > 1:
+            base = int(os.environ['SHARD_METRICS_PORT'])
+            ports = range(base, base + self.args.shards)
+        else:
+            ports = [int(os.environ['PORT'])]
+        series = {}
+        async with ClientSession() as session:
+            for port in ports:
+                try:
+                    async with session.get(f"http://127.0.0.1:{port}/metrics") as response:
+                        text = await response.text()
+                except Exception as e:
+                    series[f'error:{port}'] = repr(e)
+                    continue
+                for line in text.splitlines():
+                    if line.startswith(name):
+                        labels, value = line[len(name):].rsplit(' ', 1)
+                        key = labels.strip('{}') or name
+                        series[key] = series.get(key, 0) + float(value)
+        return series
+
+    async def _settle(self):
+        """Espera a que se confirmen todos los updates y dejen de llegar respuestas"""
+        deadline = time.monotonic() + self.args.timeout
+        api = self.api
+        while time.monotonic() < deadline:
+            await asyncio.sleep(0.2)
+            idle_since = max(api.last_ack_at or 0, api.last_reply_at or 0)
+            if api.acknowledged >= len(api.injected) and time.monotonic() - idle_since >= self.args.settle:
+                return
+
+def configure_environment(harness, args, tmpdir):
+    """Variables de entorno y configuración que deben fijarse antes de importar bot.py"""
+    os.environ.update({
+        'BOT_TOKEN': TOKEN,
+        'TELEGRAM_API_URL': harness.api_url,
+        'WEBHOOK_MODE': 'False',
+        'PORT': str(free_port()),
+        'STATE_DB_PATH': os.path.join(tmpdir, 'state.db'),
+        'LAOZHANG_API_URL': f"{harness.stubs_url}/laozhang",
+        'LAOZHANG_API_KEY': 'loadtest',
+        # Los proxies del stub son direcciones de documentación: no se comprueban
+        'PROXY_CHECK_BATCH': '0',
+        'NEWS_SUBSCRIPTIONS': '[]',
+        'SNAPSHOT_PATH': args.snapshot or os.path.join(tmpdir, 'snapshot.pickle'),
+        'LOADTEST_STUBS_URL': harness.stubs_url
+    })
+    if args.shards > 1:
+        port = int(os.environ['PORT'])
+        os.environ.update({
+            'WEBHOOK_MODE': 'True',
+            'WEBHOOK_URL': f"http://127.0.0.1:{port}",
+            'SHARDS': str(args.shards),
+            # Puertos consecutivos para el /metrics de cada worker
+            'SHARD_METRICS_PORT': str(free_port_range(args.shards, exclude={port}))
+        })
+    if not args.telegram_limits:
+        os.environ.update({'OUTBOX_GLOBAL_RATE': '1000000', 'OUTBOX_GROUP_RATE': '1000000',
+                           'OUTBOX_PRIVATE_RATE': '1000000'})
+    patch_config(harness.stubs_url)
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga del bot contra una Bot API falsa")
+    parser.add_argument('-n', '--updates', type=int, default=2000, help="updates a inyectar")
+    parser.add_argument('--rate', type=float, default=200, help="updates por segundo")
+    parser.add_argument('--chats', type=int, default=100, help="grupos distintos")
+    parser.add_argument('--users', type=int, default=500, help="usuarios distintos")
+    parser.add_argument('--command-ratio', type=float, default=0.2, help="fracción de updates que son comandos")
+    parser.add_argument('--upstream-latency', type=float, default=0.05, help="latencia de feeds/proxies/Laozhang (s)")
+    parser.add_argument('--upstream-jitter', type=float, default=0.0, help="latencia extra aleatoria máxima (s)")
+    parser.add_argument('--telegram-limits', action='store_true', help="mantener los límites de envío de Telegram")
+    parser.add_argument('--warmup', type=float, default=2.0, help="segundos de espera tras el arranque")
+    parser.add_argument('--settle', type=float, default=3.0, help="segundos sin actividad para dar la prueba por terminada")
+    parser.add_argument('--timeout', type=float, default=300.0, help="espera máxima tras la inyección (s)")
+    parser.add_argument('--shards', type=int, default=1, help="procesos worker (>1: modo webhook multiproceso)")
+    parser.add_argument('--snapshot', help="snapshot persistente entre ejecuciones (por defecto, arranque en frío)")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('-o', '--output', help="fichero JSON donde guardar el informe")
+    args = parser.parse_args()
+
+    harness = Harness(args)
+    harness.start()
+    with tempfile.TemporaryDirectory() as tmpdir:
+        configure_environment(harness, args, tmpdir)
+        import bot
+        try:
+            bot.main()
+        except SystemExit:
+            pass
+
+    if harness.error is not None:
+        raise harness.error
+    if harness.result is None:
+        sys.exit("La prueba no terminó")
+    report = json.dumps(harness.result, indent=2, ensure_ascii=False)
+    print(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(report)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""Servidores locales que sustituyen a los feeds RSS, las fuentes de proxies y la API de Laozhang"""
+import asyncio
+import random
+from email.utils import formatdate
+
+from aiohttp import web
+
+TEST_NETS = ('192.0.2', '198.51.100', '203.0.113')
+
+class UpstreamStubs:
+    """Feeds, fuentes de proxies y API de chat con latencia configurable"""
+
+    def __init__(self, latency=0.05, jitter=0.0, feed_entries=30, proxies_per_source=5000, seed=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.feed_entries = feed_entries
+        self.proxies_per_source = proxies_per_source
+        self.rng = random.Random(seed)
+        self.requests = {'feeds': 0, 'proxies': 0, 'laozhang': 0}
+        self.web_app = web.Application()
+        self.web_app.router.add_get('/feeds/{name}.xml', self.handle_feed)
+        self.web_app.router.add_get('/proxies/{protocol}.txt', self.handle_proxies)
+        self.web_app.router.add_post('/laozhang', self.handle_laozhang)
+
+    async def _delay(self):
+        delay = self.latency + (self.rng.uniform(0, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def handle_feed(self, request):
+        self.requests['feeds'] += 1
+        await self._delay()
+        name = request.match_info['name']
+        now = 1_700_000_000
+        items = ''.join(
+            f"<item><title>{name} noticia {i}</title><link>https://example.com/{name}/{i}</link>"
+            f"<guid>{name}-{i}</guid><pubDate>{formatdate(now - i * 600)}</pubDate>"
+            f"<description>Resumen de la noticia {i} de {name}</description></item>"
+            for i in range(self.feed_entries)
+        )
+        body = f"<?xml version='1.0'?><rss version='2.0'><channel><title>{name}</title>{items}</channel></rss>"
+        return web.Response(text=body, content_type='application/rss+xml')
+
+    async def handle_proxies(self, request):
+        self.requests['proxies'] += 1
+        await self._delay()
+        # Direcciones de documentación (RFC 5737): nunca se conectará a nadie real
+        rng = random.Random(request.match_info['protocol'])
+        lines = (
+            f"{rng.choice(TEST_NETS)}.{rng.randrange(1, 255)}:{rng.randrange(1, 65536)}"
+            for _ in range(self.proxies_per_source)
+        )
+        return web.Response(text='\n'.join(lines))
+
+    async def handle_laozhang(self, request):
+        self.requests['laozhang'] += 1
+        data = await request.json()
+        await self._delay()
+        return web.json_response({'response': f"Respuesta simulada a: {data.get('message', '')[:50]}"})
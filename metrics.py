@@ -0,0 +1,189 @@
+import time
+from contextlib import contextmanager
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Límites (segundos) de los histogramas de latencia
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{_escape(value)}"' for name, value in extra]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    """Métrica con etiquetas; cada combinación de valores es una serie"""
+    kind = 'untyped'
+
+    def __init__(self, name, help, labelnames=(), registry=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._function = None
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def _key(self, labels):
+        return tuple(labels.get(name, '') for name in self.labelnames)
+
+    def set_function(self, function):
+        """Calcula las series al exportar: function() -> {valores de etiquetas: valor}"""
+        self._function = function
+        return self
+
+    def samples(self):
+        """Líneas (sufijo, etiquetas, valor) de todas las series"""
+        values = self._values
+        if self._function is not None:
+            try:
+                values = self._function()
+            except Exception as e:
+                logger.error(f"Error calculando la métrica {self.name}: {e}")
+                values = {}
+            if not isinstance(values, dict):
+                values = {(): values}
+        for key, value in values.items():
+            yield '', key, (), value
+
+    def expose(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, key, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labelnames, key, extra)} {_format_value(value)}")
+        return '\n'.join(lines)
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None):
+        super().__init__(name, help, labelnames, registry)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        series = self._values.get(key)
+        if series is None:
+            # [cuenta por límite..., +Inf, suma]
+            series = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+                break
+        else:
+            series[len(self.buckets)] += 1
+        series[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Mide la duración del bloque (sirve también dentro de corrutinas)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        for key, series in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series):
+                cumulative += count
+                yield '_bucket', key, (('le', _format_value(bound)),), cumulative
+            yield '_sum', key, (), series[-1]
+            yield '_count', key, (), cumulative
+
+class Registry:
+    """Conjunto de métricas que se exportan juntas"""
+
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+
+    def expose(self):
+        """Todas las métricas en formato de texto de Prometheus"""
+        return '\n'.join(metric.expose() for metric in self.metrics.values()) + '\n'
+
+REGISTRY = Registry()
+
+# Métricas de los caminos calientes; el resto se registra en bot.py a partir de las estadísticas
+HANDLER_LATENCY = Histogram('tiffany_handler_seconds', 'Duración de cada handler de Telegram', ['handler'])
+HANDLER_ERRORS = Counter('tiffany_handler_errors_total', 'Excepciones no capturadas en handlers', ['handler'])
+UPSTREAM_LATENCY = Histogram('tiffany_upstream_seconds', 'Latencia de las peticiones a servicios externos', ['upstream', 'name'])
+UPSTREAM_ERRORS = Counter('tiffany_upstream_errors_total', 'Errores de servicios externos', ['upstream', 'name', 'reason'])
+
+def handler_name(handler):
+    """Nombre legible de un handler de PTB para las etiquetas"""
+    commands = getattr(handler, 'commands', None)
+    if commands:
+        return '/' + sorted(commands)[0]
+    return type(handler).__name__
+
+def instrument(callback, name):
+    """Envuelve un callback de handler midiendo su duración y sus errores"""
+    async def wrapped(update, context):
+        start = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            HANDLER_ERRORS.inc(handler=name)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - start, handler=name)
+    return wrapped
+
+def instrument_handlers(application):
+    """Instrumenta todos los handlers ya registrados en la aplicación"""
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            handler.callback = instrument(handler.callback, handler_name(handler))
+
+async def handle_metrics(request):
+    """Ruta /metrics para aiohttp"""
+    from aiohttp import web
+    return web.Response(text=REGISTRY.expose(), content_type='text/plain', charset='utf-8',
+                        headers={'Cache-Control': 'no-cache'})
+
+class MetricsServer:
+    """Servidor HTTP mínimo con /metrics (para el modo polling)"""
+
+    def __init__(self):
+        self.web_app = None
+        self._runner = None
+
+    async def start(self, host, port):
+        # aiohttp solo se importa si de verdad se sirven las métricas
+        from aiohttp import web
+        self.web_app = web.Application()
+        self.web_app.router.add_get('/metrics', handle_metrics)
+        self._runner = web.AppRunner(self.web_app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logger.info(f"Métricas en http://{host}:{port}/metrics")
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
@@ -0,0 +1,394 @@
+import asyncio
+import heapq
+import itertools
+import time
+import logging
+
+from telegram.error import BadRequest, NetworkError, RetryAfter
+
+from config import (
+    OUTBOX_GLOBAL_RATE,
+    OUTBOX_GROUP_RATE,
+    OUTBOX_PRIVATE_RATE,
+    OUTBOX_MAX_RETRIES,
+    OUTBOX_CHAT_QUEUE,
+    OUTBOX_REPLY_TTL
+)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Carriles de prioridad: menor número sale antes
+PRIORITY_INTERACTIVE = 0
+PRIORITY_SCHEDULED = 1
+PRIORITY_BACKGROUND = 2
+
+# Estados de un chat dentro del planificador
+IDLE, QUEUED, WAITING, BUSY = 'idle', 'queued', 'waiting', 'busy'
+
+class OutboxDropped(Exception):
+    """El envío caducó en la cola o se descartó porque su chat tenía demasiados pendientes"""
+
+def _ignore_result(future):
+    if not future.cancelled():
+        future.exception()
+
+def detach(future):
+    """No esperar a un envío: los errores ya los registra la cola"""
+    future.add_done_callback(_ignore_result)
+    return future
+
+class TokenBucket:
+    """Token bucket clásico: `rate` tokens por segundo hasta `capacity`"""
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now=None):
+        """Segundos hasta que haya un token disponible (0 si ya lo hay)"""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def consume(self, now=None):
+        """Gasta un token si lo hay; devuelve True si se pudo"""
+        if self.wait_time(now) > 0:
+            return False
+        self.tokens -= 1
+        return True
+
+    def is_full(self, now=None):
+        self.wait_time(now)
+        return self.tokens >= self.capacity
+
+class OutboundItem:
+    """Una llamada pendiente a la API de Telegram"""
+    __slots__ = ('priority', 'seq', 'chat_id', 'method', 'kwargs', 'future', 'attempts', 'expiry')
+
+    def __init__(self, priority, seq, chat_id, method, kwargs, future):
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.method = method
+        self.kwargs = kwargs
+        self.future = future
+        self.attempts = 0
+        # Temporizador que descarta la respuesta si sigue en cola al caducar
+        self.expiry = None
+
+class OutboundScheduler:
+    """Cola de salida que respeta los límites de Telegram.
+
+    Hay un token bucket global (~30 msg/s) y uno por chat (~20 msg/min en
+    grupos, ~1 msg/s en privados). Los envíos se ordenan por prioridad y,
+    dentro de cada chat, por orden de llegada; cada chat tiene como mucho un
+    envío en vuelo para no desordenar sus mensajes. Un 429 pausa el chat el
+    tiempo indicado por retry_after y reintenta, y varias ediciones pendientes
+    del mismo mensaje se fusionan en la última. Las respuestas interactivas
+    caducan a los `reply_ttl` segundos en cola y cada chat tiene como mucho
+    `chat_queue` pendientes: una respuesta tardía ya no sirve de nada.
+    """
+
+    def __init__(self, global_rate=OUTBOX_GLOBAL_RATE, group_rate=OUTBOX_GROUP_RATE,
+                 private_rate=OUTBOX_PRIVATE_RATE, max_retries=OUTBOX_MAX_RETRIES,
+                 chat_queue=OUTBOX_CHAT_QUEUE, reply_ttl=OUTBOX_REPLY_TTL):
+        self.bot = None
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.group_rate = group_rate
+        self.private_rate = private_rate
+        self.max_retries = max_retries
+        self.chat_queue = chat_queue
+        self.reply_ttl = reply_ttl
+        self._seq = itertools.count()
+        self._chat_queues = {}    # chat_id -> heap de (prioridad, seq, item)
+        self._chat_state = {}     # chat_id -> IDLE/QUEUED/WAITING/BUSY
+        self._buckets = {}        # chat_id -> TokenBucket
+        self._paused_until = {}   # chat_id -> instante monotónico
+        self._ready = []          # heap de (prioridad, seq, chat_id)
+        self._timers = []         # heap de (instante, chat_id)
+        self._pending_edits = {}  # (chat_id, message_id) -> item aún no enviado
+        self._inflight = set()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        # Instante monotónico del primer envío correcto (tiempo hasta la primera respuesta)
+        self.first_sent_at = None
+        self.stats = {
+            'queued': 0,
+            'sent': 0,
+            'failed': 0,
+            'retries': 0,
+            'flood_waits': 0,
+            'coalesced': 0,
+            'dropped': 0
+        }
+
+    def start(self, bot):
+        """Empieza a despachar usando el bot de la aplicación"""
+        self.bot = bot
+        if self._task is None:
+            self._task = asyncio.create_task(self._dispatch_loop())
+
+    async def stop(self, drain_timeout=5):
+        """Intenta vaciar la cola y detiene el despachador"""
+        deadline = time.monotonic() + drain_timeout
+        while (self.pending() or self._inflight) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def pending(self):
+        """Número de envíos en cola"""
+        return sum(len(queue) for queue in self._chat_queues.values())
+
+    # --- API pública -----------------------------------------------------
+
+    def submit(self, chat_id, method, priority=PRIORITY_INTERACTIVE, **kwargs):
+        """Encola una llamada bot.<method>(chat_id=..., **kwargs); devuelve un Future"""
+        return self._submit(chat_id, method, priority, kwargs).future
+
+    def _submit(self, chat_id, method, priority, kwargs):
+        future = asyncio.get_running_loop().create_future()
+        item = OutboundItem(priority, next(self._seq), chat_id, method, dict(kwargs, chat_id=chat_id), future)
+        self.stats['queued'] += 1
+        if priority == PRIORITY_INTERACTIVE:
+            self._limit_chat(chat_id)
+            if self.reply_ttl:
+                item.expiry = asyncio.get_running_loop().call_later(self.reply_ttl, self._drop, item, "caducado")
+        self._push_chat(item)
+        self._wakeup.set()
+        return item
+
+    def send_message(self, chat_id, text, priority=PRIORITY_INTERACTIVE, **kwargs):
+        """Encola un sendMessage"""
+        return self.submit(chat_id, 'send_message', priority, text=text, **kwargs)
+
+    def send_document(self, chat_id, document, priority=PRIORITY_INTERACTIVE, **kwargs):
+        """Encola un sendDocument (document debe ser un InputFile para poder reintentarlo)"""
+        return self.submit(chat_id, 'send_document', priority, document=document, **kwargs)
+
+    def reply_text(self, message, text, priority=PRIORITY_INTERACTIVE, **kwargs):
+        """Encola una respuesta a un mensaje (equivalente a message.reply_text)"""
+        # Como PTB: en grupos se cita el mensaje original, en privado no
+        if message.chat.type != 'private':
+            kwargs.setdefault('reply_to_message_id', message.message_id)
+        return self.send_message(message.chat_id, text, priority, **kwargs)
+
+    def edit_message_text(self, chat_id, message_id, text, priority=PRIORITY_INTERACTIVE, **kwargs):
+        """Encola un editMessageText; si ya hay uno pendiente del mismo mensaje, lo sustituye"""
+        pending = self._pending_edits.get((chat_id, message_id))
+        if pending is not None and not pending.future.done():
+            # Conserva su posición en la cola; solo se envía el texto más reciente
+            pending.kwargs = dict(kwargs, chat_id=chat_id, message_id=message_id, text=text)
+            self.stats['coalesced'] += 1
+            return pending.future
+        item = self._submit(chat_id, 'edit_message_text', priority, dict(kwargs, message_id=message_id, text=text))
+        self._pending_edits[(chat_id, message_id)] = item
+        return item.future
+
+    # --- Planificación ---------------------------------------------------
+
+    def _limit_chat(self, chat_id):
+        """Descarta la respuesta interactiva más antigua si el chat ya tiene `chat_queue` pendientes"""
+        if not self.chat_queue:
+            return
+        live = [
+            item for _, _, item in self._chat_queues.get(chat_id, ())
+            if item.priority == PRIORITY_INTERACTIVE and not item.future.done()
+        ]
+        if len(live) >= self.chat_queue:
+            self._drop(min(live, key=lambda item: item.seq), "cola del chat llena")
+
+    def _drop(self, item, reason):
+        """Descarta un envío aún en cola; sale del heap al llegar a la cabeza"""
+        if item.future.done():
+            return
+        self.stats['dropped'] += 1
+        if item.expiry is not None:
+            item.expiry.cancel()
+        if item.method == 'edit_message_text':
+            key = (item.chat_id, item.kwargs['message_id'])
+            if self._pending_edits.get(key) is item:
+                del self._pending_edits[key]
+        item.future.set_exception(OutboxDropped(reason))
+        self._wakeup.set()
+
+    def _push_chat(self, item):
+        queue = self._chat_queues.setdefault(item.chat_id, [])
+        heapq.heappush(queue, (item.priority, item.seq, item))
+        state = self._chat_state.get(item.chat_id, IDLE)
+        if state in (IDLE, QUEUED):
+            # En QUEUED puede haber cambiado la cabeza; la entrada antigua se invalida sola
+            self._chat_state[item.chat_id] = QUEUED
+            head = queue[0]
+            heapq.heappush(self._ready, (head[0], head[1], item.chat_id))
+
+    def _bucket(self, chat_id):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if len(self._buckets) > 10000:
+                self._prune_buckets()
+            # Los grupos y canales tienen id negativo
+            rate = self.group_rate if chat_id < 0 else self.private_rate
+            bucket = self._buckets[chat_id] = TokenBucket(rate, max(1, min(3, rate * 60)))
+        return bucket
+
+    def _prune_buckets(self):
+        now = time.monotonic()
+        for chat_id in [c for c, b in self._buckets.items() if b.is_full(now) and c not in self._chat_queues]:
+            del self._buckets[chat_id]
+
+    def _chat_wait(self, chat_id, now):
+        paused = self._paused_until.get(chat_id, 0) - now
+        if paused > 0:
+            return paused
+        self._paused_until.pop(chat_id, None)
+        return self._bucket(chat_id).wait_time(now)
+
+    def _release_timers(self, now):
+        while self._timers and self._timers[0][0] <= now:
+            _, chat_id = heapq.heappop(self._timers)
+            if self._chat_state.get(chat_id) == WAITING:
+                self._after_chat(chat_id)
+
+    def _push_chat_head(self, chat_id):
+        head = self._chat_queues[chat_id][0]
+        self._chat_state[chat_id] = QUEUED
+        heapq.heappush(self._ready, (head[0], head[1], chat_id))
+
+    def _next_ready(self, now):
+        """Saca el siguiente chat listo para enviar, o None"""
+        while self._ready:
+            priority, seq, chat_id = heapq.heappop(self._ready)
+            queue = self._chat_queues.get(chat_id)
+            if self._chat_state.get(chat_id) != QUEUED or not queue or queue[0][:2] != (priority, seq):
+                continue  # entrada obsoleta
+            if queue[0][2].future.done():
+                # Descartado, o el llamante canceló el envío antes de salir
+                heapq.heappop(queue)
+                self._after_chat(chat_id)
+                continue
+            wait = self._chat_wait(chat_id, now)
+            if wait > 0:
+                self._chat_state[chat_id] = WAITING
+                heapq.heappush(self._timers, (now + wait, chat_id))
+                continue
+            return chat_id
+        return None
+
+    def _after_chat(self, chat_id):
+        """Decide el estado de un chat cuando termina un envío o se descarta uno"""
+        queue = self._chat_queues.get(chat_id)
+        if queue:
+            self._push_chat_head(chat_id)
+        else:
+            self._chat_queues.pop(chat_id, None)
+            self._chat_state.pop(chat_id, None)
+
+    async def _dispatch_loop(self):
+        while True:
+            self._wakeup.clear()
+            now = time.monotonic()
+            self._release_timers(now)
+
+            global_wait = self.global_bucket.wait_time(now)
+            if global_wait > 0:
+                await asyncio.sleep(global_wait)
+                continue
+
+            chat_id = self._next_ready(now)
+            if chat_id is None:
+                timeout = self._timers[0][0] - now if self._timers else None
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, _, item = heapq.heappop(self._chat_queues[chat_id])
+            if item.expiry is not None:
+                # Ya sale: no caduca aunque haya que reintentarlo
+                item.expiry.cancel()
+                item.expiry = None
+            if item.method == 'edit_message_text':
+                self._pending_edits.pop((chat_id, item.kwargs['message_id']), None)
+            self.global_bucket.consume(now)
+            self._bucket(chat_id).consume(now)
+            self._chat_state[chat_id] = BUSY
+            task = asyncio.create_task(self._deliver(item))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _deliver(self, item):
+        chat_id = item.chat_id
+        try:
+            result = await getattr(self.bot, item.method)(**item.kwargs)
+        except RetryAfter as e:
+            retry_after = e.retry_after
+            if hasattr(retry_after, 'total_seconds'):
+                retry_after = retry_after.total_seconds()
+            self.stats['flood_waits'] += 1
+            logger.warning(f"Flood control en {chat_id}: reintento en {retry_after}s")
+            self._retry(item, float(retry_after))
+            return
+        except BadRequest as e:
+            if 'not modified' in str(e).lower():
+                self._finish(item, None)
+            else:
+                self._fail(item, e)
+            return
+        except NetworkError as e:
+            if item.attempts < self.max_retries:
+                item.attempts += 1
+                self._retry(item, 2 ** item.attempts)
+            else:
+                self._fail(item, e)
+            return
+        except Exception as e:
+            self._fail(item, e)
+            return
+        self._finish(item, result)
+
+    def _retry(self, item, delay):
+        """Vuelve a poner el envío en cabeza de su chat y pausa el chat `delay` segundos"""
+        self.stats['retries'] += 1
+        chat_id = item.chat_id
+        heapq.heappush(self._chat_queues.setdefault(chat_id, []), (item.priority, item.seq, item))
+        until = time.monotonic() + delay
+        self._paused_until[chat_id] = until
+        self._chat_state[chat_id] = WAITING
+        heapq.heappush(self._timers, (until, chat_id))
+        self._wakeup.set()
+
+    def _finish(self, item, result):
+        self.stats['sent'] += 1
+        if self.first_sent_at is None:
+            self.first_sent_at = time.monotonic()
+        if not item.future.done():
+            item.future.set_result(result)
+        self._after_chat(item.chat_id)
+        self._wakeup.set()
+
+    def _fail(self, item, error):
+        self.stats['failed'] += 1
+        logger.error(f"Error enviando a {item.chat_id} ({item.method}): {error}")
+        if not item.future.done():
+            item.future.set_exception(error)
+        self._after_chat(item.chat_id)
+        self._wakeup.set()
+
+    def get_stats(self):
+        """Contadores y tamaño de la cola"""
+        stats = dict(self.stats)
+        stats['pending'] = self.pending()
+        stats['in_flight'] = len(self._inflight)
+        return stats
@@ -1,20 +1,37 @@
 import json
 import random
-import requests
+import re
 import logging
-from datetime import datetime, timedelta
 import asyncio
 
+from config import RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL, GROUPS_CONFIG
+from laozhang import LaozhangClient
+from cache import TTLCache, SingleFlight
+from topics import TopicClassifier
+from state import StateStore
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+NON_WORD_RE = re.compile(r'[^\w\s]+')
+SPACES_RE = re.compile(r'\s+')
+
+def normalize_message(message):
+    """Normaliza un mensaje para usarlo como clave de caché"""
+    return SPACES_RE.sub(' ', NON_WORD_RE.sub(' ', message.lower())).strip()
+
 class TiffanyPersonality:
-    def __init__(self, name="Tiffany"):
+    def __init__(self, name="Tiffany", state=None, monitor=None):
         self.name = name
         self.load_phrases()
-        self.user_interactions = {}
-        self.last_activity = {}
-        self.api_available = True
+        # Actividad por grupo e interacciones por usuario, acotadas y persistentes
+        self.state = state if state is not None else StateStore()
+        # Planificador de plazos de inactividad (opcional)
+        self.monitor = monitor
+        self.client = LaozhangClient()
+        # Respuestas de la API por (mensaje normalizado, tema)
+        self.response_cache = TTLCache(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_TTL)
+        self.reply_flight = SingleFlight()
         
     def load_phrases(self):
         """Carga las frases desde el archivo JSON"""
@@ -28,34 +45,18 @@ class TiffanyPersonality:
                 "general": ["Hola a todos!"]
             }
             logger.warning("Archivo frases.json no encontrado, usando frases por defecto")
+        
+        # Las palabras clave no son frases; se compilan una vez en el clasificador
+        self.classifier = TopicClassifier(self.phrases.pop("palabras_clave", None))
     
+    @property
+    def api_available(self):
+        """La API se considera disponible salvo que su circuito esté abierto"""
+        return self.client.available
+
     async def get_laozhang_response(self, message):
         """Obtiene respuesta de la API de Laozhang"""
-        if not self.api_available:
-            return None
-            
-        try:
-            headers = {'Authorization': f'Bearer {LAOZHANG_API_KEY}'}
-            data = {'message': message, 'bot_name': 'Tiffany'}
-            
-            response = requests.post(
-                LAOZHANG_API_URL,
-                headers=headers,
-                json=data,
-                timeout=10
-            )
-            
-            if response.status_code == 200:
-                return response.json().get('response')
-            else:
-                self.api_available = False
-                logger.warning("API de Laozhang no disponible, usando frases locales")
-                return None
-                
-        except Exception as e:
-            self.api_available = False
-            logger.error(f"Error con API Laozhang: {e}")
-            return None
+        return await self.client.complete(message, bot_name=self.name)
     
     def get_greeting(self, username):
         """Obtiene un saludo para nuevos usuarios"""
@@ -83,34 +84,28 @@ class TiffanyPersonality:
     
     def detect_topic(self, message):
         """Detecta el tema de la conversación"""
-        message_lower = message.lower()
-        
-        topics_keywords = {
-            "ciberseguridad": ["hack", "seguridad", "virus", "malware", "firewall", "ataque", "brecha", "vulnerabilidad"],
-            "tecnologia": ["python", "linux", "windows", "programar", "código", "github", "git"],
-            "proxies": ["proxy", "vpn", "ip", "conexión", "anonimato"],
-            "noticias": ["noticia", "novedad", "actualidad", "último", "nuevo"]
-        }
-        
-        for topic, keywords in topics_keywords.items():
-            if any(keyword in message_lower for keyword in keywords):
-                return topic
-        
-        return "general"
+        return self.classifier.classify(message)
     
     def check_inactivity(self, group_id):
-        """Verifica inactividad en el grupo"""
-        now = datetime.now()
-        last_activity = self.last_activity.get(group_id)
-        
-        if last_activity:
-            inactivity_time = (now - last_activity).seconds
-            return inactivity_time > 300  # 5 minutos
-        return True
+        """Verifica inactividad en el grupo (con su timeout propio si lo tiene)"""
+        inactivity_time = self.state.age('activity', group_id)
+        if inactivity_time is None:
+            return True
+        if self.monitor is not None:
+            return inactivity_time >= self.monitor.timeout_for(group_id)
+        return inactivity_time >= GROUPS_CONFIG['inactivity_timeout']
     
     def update_activity(self, group_id):
         """Actualiza el tiempo de última actividad"""
-        self.last_activity[group_id] = datetime.now()
+        # El instante de la modificación (monotónico) es la última actividad
+        self.state.set('activity', group_id, True)
+        if self.monitor is not None:
+            self.monitor.touch(group_id)
+    
+    def record_interaction(self, group_id, username):
+        """Cuenta los mensajes de cada usuario en cada grupo"""
+        key = f"{group_id}:{username}"
+        self.state.set('interactions', key, self.state.get('interactions', key, 0) + 1)
     
     def get_inactivity_message(self):
         """Obtiene mensaje para cuando hay inactividad"""
@@ -120,20 +115,36 @@ class TiffanyPersonality:
             "¿Nadie quiere hablar de ciberseguridad hoy?"
         ]))
     
+    def get_cache_stats(self):
+        """Estadísticas de la caché de respuestas"""
+        stats = self.response_cache.get_stats()
+        stats['coalesced'] = self.reply_flight.joined
+        return stats
+    
     async def respond(self, message, username=None, group_id=None):
         """Genera una respuesta apropiada"""
         if group_id:
             self.update_activity(group_id)
+            if username:
+                # El contador se lee de SQLite en un hilo si no está en memoria
+                await self.state.load_async('interactions', f"{group_id}:{username}")
+                self.record_interaction(group_id, username)
         
-        # Intentar con API de Laozhang primero
-        if self.api_available:
-            api_response = await self.get_laozhang_response(message)
-            if api_response:
-                return api_response
-        
-        # Si la API falla, usar sistema local
         topic = self.detect_topic(message)
         
+        # Intentar con API de Laozhang primero (caché y mensajes idénticos en vuelo compartidos)
+        if self.client.enabled:
+            key = (normalize_message(message), topic)
+            cached = self.response_cache.get(key)
+            if cached is not None:
+                return cached
+            if self.api_available:
+                api_response = await self.reply_flight.do(key, lambda: self.get_laozhang_response(message))
+                if api_response:
+                    self.response_cache.set(key, api_response)
+                    return api_response
+        
+        # Si la API falla, usar sistema local
         if "adiós" in message.lower() or "hasta luego" in message.lower():
             return f"Hasta luego @{username} 👋" if username else "Hasta luego 👋"
         
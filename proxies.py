@@ -1,73 +1,528 @@
-import requests
+import asyncio
+import io
 import re
 import random
+import time
+from array import array
+from bisect import bisect_left
+from itertools import chain, compress
 from datetime import datetime
+from socket import inet_aton
+from urllib.parse import urlsplit
 import logging
 
+from config import PROXY_SOURCES, PROXY_MAX_AGE, PROXY_CHECK_BATCH
+from cache import SingleFlight
+from proxy_checker import ProxyChecker
+from render import escape_markdown, escape_code, paginate
+from metrics import UPSTREAM_LATENCY, UPSTREAM_ERRORS
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-class ProxyFetcher:
+# Protocolos conocidos; su índice ocupa los bits altos de la clave empaquetada
+PROTOCOLS = ('http', 'https', 'socks4', 'socks5')
+PROTOCOL_IDS = {protocol: i for i, protocol in enumerate(PROTOCOLS)}
+
+# ip:puerto al principio de línea (admite espacios y \r alrededor). El patrón
+# del octeto ya limita a 0-255 y rechaza ceros a la izquierda
+OCTET = rb'(?:25[0-5]|2[0-4]\d|1\d\d|[1-9]?\d)'
+PROXY_LINE_RE = re.compile(
+    rb'^[ \t]*(' + OCTET + rb'\.' + OCTET + rb'\.' + OCTET + rb'\.' + OCTET + rb'):(\d{1,5})[ \t\r]*$',
+    re.M
+)
+PROXY_RE = re.compile(r'(\d{1,3})\.(\d{1,3})\.(\d{1,3})\.(\d{1,3}):(\d{1,5})')
+
+def pack_proxy(protocol_id, a, b, c, d, port):
+    """Empaqueta protocolo, IPv4 y puerto en un entero de 64 bits"""
+    return (protocol_id << 48) | (a << 40) | (b << 32) | (c << 24) | (d << 16) | port
+
+def pack_key(protocol, proxy):
+    """Convierte (protocolo, 'ip:puerto') en clave empaquetada, o None si no es válido"""
+    match = PROXY_RE.fullmatch(proxy)
+    if protocol not in PROTOCOL_IDS or match is None:
+        return None
+    return pack_proxy(PROTOCOL_IDS[protocol], *map(int, match.groups()))
+
+def unpack_proxy(key):
+    """Convierte una clave empaquetada en (protocolo, 'ip:puerto')"""
+    ip = (key >> 16) & 0xFFFFFFFF
+    proxy = f"{ip >> 24}.{(ip >> 16) & 255}.{(ip >> 8) & 255}.{ip & 255}:{key & 0xFFFF}"
+    return PROTOCOLS[key >> 48], proxy
+
+def parse_proxy_bytes(data, protocol='http'):
+    """Extrae de la respuesta cruda de una fuente las claves válidas, ordenadas y sin duplicados"""
+    high = PROTOCOL_IDS[protocol] << 48
+    # inet_aton convierte la IP en C; el regex garantiza que es una IPv4 completa
+    keys = {
+        high | (int.from_bytes(inet_aton(ip.decode()), 'big') << 16) | number
+        for ip, port in PROXY_LINE_RE.findall(data)
+        if 0 < (number := int(port)) <= 65535
+    }
+    return array('Q', sorted(keys))
+
+class ProxyPool:
+    """Pool de proxies compacto: claves de 64 bits ordenadas en arrays paralelos.
+
+    Cada proxy ocupa 17 bytes (clave, primera/última vez visto y fuente). La
+    deduplicación se hace sobre la clave, las búsquedas usan bisect y el
+    muestreo aleatorio elige índices sin recorrer el pool.
+
+    Los cuatro arrays viven en una única tupla inmutable que se sustituye de
+    una vez: merged()/expired() calculan la nueva en un hilo, swap() la
+    publica, y cada lectura trabaja sobre la tupla que tomó al empezar.
+    """
+
     def __init__(self):
-        self.proxy_sources = [
-            'https://api.proxyscrape.com/v2/?request=getproxies&protocol=http&timeout=10000&country=all&ssl=all&anonymity=all',
-            'https://api.proxyscrape.com/v2/?request=getproxies&protocol=socks4&timeout=10000&country=all',
-            'https://api.proxyscrape.com/v2/?request=getproxies&protocol=socks5&timeout=10000&country=all',
-            'https://www.proxy-list.download/api/v1/get?type=http',
-            'https://www.proxy-list.download/api/v1/get?type=https'
-        ]
+        # (claves, primera vez visto, última vez visto, fuente)
+        self._state = (array('Q'), array('I'), array('I'), array('B'))
+        # Índice de fuente -> url
+        self.sources = []
+        self.updated_at = None
+        self.version = 0
+        # Índice puerto -> claves, reconstruido solo cuando cambia la versión
+        self._ports = {}
+        self._ports_version = None
+
+    def __len__(self):
+        return len(self._state[0])
+
+    @staticmethod
+    def _find(keys, key):
+        i = bisect_left(keys, key)
+        return i if i < len(keys) and keys[i] == key else -1
+
+    def __contains__(self, item):
+        """Admite claves empaquetadas o tuplas (protocolo, 'ip:puerto')"""
+        if isinstance(item, tuple):
+            item = pack_key(*item)
+            if item is None:
+                return False
+        return self._find(self._state[0], item) >= 0
+
+    def _source_id(self, source):
+        if source not in self.sources:
+            self.sources.append(source)
+        return self.sources.index(source)
+
+    def swap(self, state):
+        """Publica de una vez los arrays calculados por merged()/expired()"""
+        self._state = state
+        self.version += 1
+
+    def merged(self, keys, source):
+        """Arrays tras fusionar un lote de claves, sin tocar el pool; devuelve (arrays, nuevas)"""
+        now = int(time.time())
+        source_id = self._source_id(source)
+        old_keys, first_seen, last_seen, sources = self._state
+
+        if not old_keys:
+            # Pool vacío: el lote ya viene ordenado y sin duplicados
+            count = len(keys)
+            state = (array('Q', keys), array('I', [now]) * count,
+                     array('I', [now]) * count, array('B', [source_id]) * count)
+            return state, count
+
+        batch = set(keys)
+        fresh = batch.difference(old_keys)
+        if fresh:
+            # Dos tramos ordenados: timsort los fusiona en tiempo lineal
+            merged = sorted(chain(old_keys, sorted(fresh)))
+            old = zip(first_seen, last_seen, sources)
+            rows = [(now, now, source_id) if key in fresh else next(old) for key in merged]
+            state = (
+                array('Q', merged),
+                array('I', [row[0] for row in rows]),
+                array('I', [now if key in batch else row[1] for key, row in zip(merged, rows)]),
+                array('B', [row[2] for row in rows])
+            )
+        else:
+            state = (old_keys, first_seen, array('I', [
+                now if key in batch else seen for key, seen in zip(old_keys, last_seen)
+            ]), sources)
+        return state, len(fresh)
+
+    def merge(self, keys, source):
+        """Fusiona un lote de claves empaquetadas; devuelve cuántas son nuevas"""
+        state, fresh = self.merged(keys, source)
+        self.swap(state)
+        self.updated_at = datetime.now()
+        return fresh
+
+    def expired(self, max_age):
+        """Arrays sin los proxies que ninguna fuente ha devuelto en max_age segundos; devuelve (arrays, eliminados)"""
+        cutoff = int(time.time() - max_age)
+        state = self._state
+        keep = [seen >= cutoff for seen in state[2]]
+        removed = len(keep) - sum(keep)
+        if not removed:
+            return state, 0
+        return tuple(array(column.typecode, compress(column, keep)) for column in state), removed
+
+    def expire(self, max_age):
+        """Elimina los proxies que ninguna fuente ha devuelto en max_age segundos"""
+        state, removed = self.expired(max_age)
+        if removed:
+            self.swap(state)
+        return removed
+
+    def dump(self):
+        """Arrays del pool y fuentes, para guardarlos en disco"""
+        keys, first_seen, last_seen, sources = self._state
+        return {
+            'keys': keys,
+            'first_seen': first_seen,
+            'last_seen': last_seen,
+            'sources': sources,
+            'source_urls': list(self.sources),
+            'updated_at': self.updated_at.timestamp() if self.updated_at else None
+        }
+
+    def restore(self, data, replace=False):
+        """Carga un pool de dump() si el actual está vacío (o siempre con `replace`); devuelve cuántos proxies se cargaron"""
+        if self._state[0] and not replace:
+            return 0
+        keys = data['keys']
+        if not (len(keys) == len(data['first_seen']) == len(data['last_seen']) == len(data['sources'])):
+            raise ValueError("snapshot del pool inconsistente")
+        self.sources = list(data['source_urls'])
+        self.swap((array('Q', keys), array('I', data['first_seen']),
+                   array('I', data['last_seen']), array('B', data['sources'])))
+        self.updated_at = datetime.fromtimestamp(data['updated_at']) if data['updated_at'] else None
+        return len(keys)
+
+    def _protocol_range(self, keys, protocol):
+        if protocol is None:
+            return 0, len(keys)
+        protocol_id = PROTOCOL_IDS[protocol]
+        return (bisect_left(keys, protocol_id << 48),
+                bisect_left(keys, (protocol_id + 1) << 48))
+
+    def proxies(self, limit=None, protocol=None):
+        """Devuelve proxies 'ip:puerto' (ordenados por protocolo e IP)"""
+        keys = self._state[0]
+        start, end = self._protocol_range(keys, protocol)
+        if limit is not None:
+            end = min(end, start + limit)
+        return [unpack_proxy(key)[1] for key in keys[start:end]]
+
+    def protocol_keys(self, protocol=None):
+        """Claves empaquetadas de un protocolo (un tramo contiguo del array)"""
+        keys = self._state[0]
+        start, end = self._protocol_range(keys, protocol)
+        return keys[start:end]
+
+    def port_index(self):
+        """Índice puerto -> claves empaquetadas ordenadas"""
+        if self._ports_version != self.version:
+            keys, version = self._state[0], self.version
+            index = {}
+            for key in keys:
+                index.setdefault(key & 0xFFFF, []).append(key)
+            self._ports = {port: array('Q', port_keys) for port, port_keys in index.items()}
+            self._ports_version = version
+        return self._ports
+
+    def keys(self):
+        """Itera las claves como (protocolo, 'ip:puerto')"""
+        return (unpack_proxy(key) for key in self._state[0])
+
+    def info(self, key):
+        """Metadatos de una clave empaquetada: fuente y primera/última vez visto"""
+        keys, first_seen, last_seen, sources = self._state
+        i = self._find(keys, key)
+        if i < 0:
+            return None
+        return {
+            'source': self.sources[sources[i]],
+            'first_seen': first_seen[i],
+            'last_seen': last_seen[i]
+        }
+
+    def sample(self, count):
+        """Devuelve `count` proxies aleatorios eligiendo índices, sin recorrer el pool"""
+        keys = self._state[0]
+        indexes = random.sample(range(len(keys)), min(count, len(keys)))
+        return [unpack_proxy(keys[i])[1] for i in indexes]
+
+class ProxyQuery:
+    """Consulta sobre el pool por protocolo, puerto y estado de comprobación.
+
+    Sintaxis (palabras separadas por espacios, en cualquier orden):
+    `socks5 port:1080 alive`, `http https port:8080,3128 unchecked`; `file`
+    pide el resultado completo como archivo.
+    """
+    STATUSES = ('alive', 'dead', 'unchecked')
+
+    def __init__(self, protocols=(), ports=(), status=None, as_file=False):
+        self.protocols = tuple(protocols)
+        self.ports = tuple(ports)
+        self.status = status
+        self.as_file = as_file
+
+    @classmethod
+    def parse(cls, args):
+        """Construye la consulta a partir de los argumentos del comando"""
+        protocols, ports, status, as_file = [], [], None, False
+        for token in (arg.lower() for arg in args):
+            if token in PROTOCOL_IDS:
+                protocols.append(token)
+            elif token in cls.STATUSES:
+                status = token
+            elif token == 'file':
+                as_file = True
+            elif token.startswith('port:'):
+                try:
+                    numbers = [int(port) for port in token[5:].split(',') if port]
+                except ValueError:
+                    numbers = []
+                if not numbers or not all(0 < number <= 65535 for number in numbers):
+                    raise ValueError(f"Puerto no válido: {token[5:]}")
+                ports.extend(numbers)
+            else:
+                raise ValueError(f"Filtro desconocido: {token}")
+        return cls(protocols, ports, status, as_file)
+
+    def __str__(self):
+        parts = list(self.protocols)
+        if self.ports:
+            parts.append('port:' + ','.join(map(str, self.ports)))
+        if self.status:
+            parts.append(self.status)
+        return ' '.join(parts) or 'all'
+
+class ProxyFetcher:
+    def __init__(self, sources=None, timeout=10):
+        self.proxy_sources = list(sources or PROXY_SOURCES)
+        self.timeout = timeout
+        self.pool = ProxyPool()
+        self.checker = ProxyChecker()
+        self.flight = SingleFlight()
+        # Las fusiones se hacen en un hilo; el lock evita que dos se pisen
+        self._merge_lock = asyncio.Lock()
+        self._session = None
+        # Claves vivas y muertas según el checker, por versión de comprobación
+        self._status = (set(), set())
+        self._status_version = None
         
-    def fetch_proxies(self, proxy_type='http'):
-        """Obtiene proxies de diferentes fuentes"""
-        all_proxies = set()
+    async def get_session(self):
+        """Devuelve la sesión HTTP compartida, creándola si hace falta"""
+        if self._session is None or self._session.closed:
+            import aiohttp
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=20),
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+        return self._session
         
-        for source in self.proxy_sources:
-            try:
-                response = requests.get(source, timeout=10)
-                if response.status_code == 200:
-                    proxies = response.text.strip().split('\n')
-                    # Filtrar proxies válidos
-                    for proxy in proxies:
-                        proxy = proxy.strip()
-                        if self.is_valid_proxy(proxy):
-                            all_proxies.add(proxy)
-            except Exception as e:
-                logger.error(f"Error fetching from {source}: {e}")
-                continue
+    async def close(self):
+        """Cierra la sesión HTTP compartida"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def fetch_source(self, protocol, source):
+        """Descarga una fuente y la incorpora al pool"""
+        name = f"{protocol}@{urlsplit(source).hostname}"
+        try:
+            session = await self.get_session()
+            with UPSTREAM_LATENCY.time(upstream='proxy_source', name=name):
+                async with session.get(source) as response:
+                    if response.status != 200:
+                        UPSTREAM_ERRORS.inc(upstream='proxy_source', name=name, reason=f"http_{response.status}")
+                        logger.warning(f"Source {source} returned {response.status}")
+                        return 0
+                    data = await response.read()
+        except Exception as e:
+            UPSTREAM_ERRORS.inc(upstream='proxy_source', name=name, reason=type(e).__name__)
+            logger.error(f"Error fetching from {source}: {e!r}")
+            return 0
         
-        return list(all_proxies)[:100]  # Limitar a 100 proxies
+        keys = await asyncio.to_thread(parse_proxy_bytes, data, protocol)
+        async with self._merge_lock:
+            # Los arrays nuevos se calculan en un hilo y se publican aquí, en el loop
+            state, fresh = await asyncio.to_thread(self.pool.merged, keys, source)
+            self.pool.swap(state)
+            self.pool.updated_at = datetime.now()
+        return fresh
+
+    def dump(self):
+        """Pool y resultados de las comprobaciones, para guardarlos en disco"""
+        return {'pool': self.pool.dump(), 'health': self.checker.dump()}
+
+    def restore(self, data, replace=False):
+        """Carga un dump() si aún no hay proxies (o siempre con `replace`); devuelve cuántos se cargaron"""
+        count = self.pool.restore(data['pool'], replace)
+        if count:
+            self.checker.restore(data['health'], replace)
+        return count
+
+    async def refresh(self):
+        """Descarga todas las fuentes en paralelo; cada una se fusiona al terminar"""
+        return await self.flight.do('refresh', self._refresh)
+
+    async def _refresh(self):
+        results = await asyncio.gather(
+            *(self.fetch_source(protocol, source) for protocol, source in self.proxy_sources)
+        )
+        async with self._merge_lock:
+            state, expired = await asyncio.to_thread(self.pool.expired, PROXY_MAX_AGE)
+            if expired:
+                self.pool.swap(state)
+        logger.info(f"Proxy pool: {len(self.pool)} proxies ({sum(results)} nuevos, {expired} caducados)")
+        return len(self.pool)
+
+    async def refresh_job(self, context):
+        """Callback para el JobQueue de PTB"""
+        await self.refresh()
+
+    async def check_round(self, batch=PROXY_CHECK_BATCH):
+        """Comprueba el lote de proxies con la comprobación más antigua"""
+        self.checker.forget_missing(self.pool)
+        keys = await asyncio.to_thread(self.checker.select_batch, self.pool.keys(), batch)
+        if not keys:
+            return 0
+        alive = await self.checker.check_many(keys)
+        logger.info(f"Proxy check: {alive}/{len(keys)} vivos")
+        return alive
+
+    async def check_job(self, context):
+        """Callback para el JobQueue de PTB"""
+        await self.flight.do('check', self.check_round)
+
+    async def ensure_loaded(self):
+        """Garantiza que el pool tenga datos (solo descarga si está vacío)"""
+        if not len(self.pool):
+            await self.refresh()
+
+    def fetch_proxies(self, proxy_type=None, limit=100):
+        """Obtiene proxies del pool en memoria"""
+        return self.pool.proxies(limit=limit, protocol=proxy_type)
+
+    def get_fastest_proxies(self, count=50, proxy_type=None):
+        """Devuelve los proxies vivos más rápidos, ordenados por puntuación"""
+        return [proxy for _, proxy in self.checker.fastest(count, proxy_type)]
+
+    def status_index(self):
+        """Conjuntos de claves empaquetadas (vivas, muertas) según la última comprobación"""
+        if self._status_version != self.checker.version:
+            alive, dead = set(), set()
+            for (protocol, proxy), health in self.checker.health.items():
+                key = pack_key(protocol, proxy)
+                if key is not None:
+                    (alive if health.alive else dead).add(key)
+            self._status = (alive, dead)
+            self._status_version = self.checker.version
+        return self._status
+
+    def _select(self, query, alive, dead):
+        """Recorre el índice más selectivo y filtra por el resto de condiciones"""
+        pool = self.pool
+        protocol_ids = {PROTOCOL_IDS[protocol] for protocol in query.protocols}
+        if query.ports:
+            index = pool.port_index()
+            candidates = sorted(chain.from_iterable(index.get(port, ()) for port in set(query.ports)))
+        elif query.status == 'alive':
+            candidates = sorted(key for key in alive if key in pool)
+        elif len(protocol_ids) == 1:
+            candidates = pool.protocol_keys(query.protocols[0])
+            protocol_ids = None
+        else:
+            candidates = pool.protocol_keys()
+
+        if query.status == 'alive':
+            status_ok = alive.__contains__
+        elif query.status == 'dead':
+            status_ok = dead.__contains__
+        elif query.status == 'unchecked':
+            status_ok = lambda key: key not in alive and key not in dead
+        else:
+            status_ok = None
+        return [
+            key for key in candidates
+            if (not protocol_ids or key >> 48 in protocol_ids) and (status_ok is None or status_ok(key))
+        ]
+
+    async def query(self, query):
+        """Claves empaquetadas que cumplen la consulta, en orden de protocolo e IP"""
+        # El estado se lee en el hilo del loop (el checker lo modifica ahí)
+        alive, dead = self.status_index() if query.status else (set(), set())
+        return await asyncio.to_thread(self._select, query, alive, dead)
+
+    def describe(self, keys):
+        """Convierte claves en líneas 'protocolo://ip:puerto' y su latencia conocida"""
+        labels = []
+        latencies = {}
+        for key in keys:
+            protocol, proxy = unpack_proxy(key)
+            label = f"{protocol}://{proxy}"
+            labels.append(label)
+            latency = self.checker.latency_of(protocol, proxy)
+            if latency is not None:
+                latencies[label] = latency
+        return labels, latencies
+
+    def export(self, keys, chunk=10000):
+        """Archivo en memoria con una línea 'protocolo://ip:puerto' por proxy"""
+        buffer = io.BytesIO()
+        for i in range(0, len(keys), chunk):
+            buffer.write(''.join(
+                f"{protocol}://{proxy}\n" for protocol, proxy in map(unpack_proxy, keys[i:i + chunk])
+            ).encode('ascii'))
+        buffer.seek(0)
+        return buffer
+
+    def latencies(self, proxies):
+        """Latencia conocida (segundos) de cada proxy vivo de la lista"""
+        protocols = {protocol for protocol, _ in self.proxy_sources}
+        result = {}
+        for proxy in proxies:
+            known = [self.checker.latency_of(protocol, proxy) for protocol in protocols]
+            known = [latency for latency in known if latency is not None]
+            if known:
+                result[proxy] = min(known)
+        return result
     
     def is_valid_proxy(self, proxy):
         """Verifica si un proxy tiene formato válido"""
-        pattern = r'^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}:\d{1,5}$'
-        return re.match(pattern, proxy) is not None
+        match = PROXY_RE.fullmatch(proxy)
+        if match is None:
+            return False
+        *octets, port = map(int, match.groups())
+        return all(octet <= 255 for octet in octets) and 0 < port <= 65535
     
-    def format_proxies_message(self, proxies, proxy_type='HTTP'):
-        """Formatea los proxies para enviar por Telegram"""
+    def format_proxies_pages(self, proxies, proxy_type='HTTP', latencies=None):
+        """Formatea los proxies en MarkdownV2, en páginas que caben en un mensaje"""
         if not proxies:
-            return "No se encontraron proxies disponibles en este momento."
+            return [escape_markdown("No se encontraron proxies disponibles en este momento.")]
         
-        message = f"🔒 *Lista de Proxies {proxy_type}*\n"
-        message += f"📅 Actualizado: {datetime.now().strftime('%Y-%m-%d %H:%M')}\n"
-        message += f"📊 Total: {len(proxies)} proxies\n\n"
+        updated = self.pool.updated_at or datetime.now()
+        header = f"🔒 *Lista de Proxies {escape_markdown(proxy_type)}*\n"
+        header += f"📅 Actualizado: {escape_markdown(updated.strftime('%Y-%m-%d %H:%M'))}\n"
+        header += f"📊 Total: {len(proxies)} proxies\n\n"
         
-        # Agrupar proxies en bloques
+        # Agrupar proxies en bloques de código
         chunk_size = 10
-        for i in range(0, min(len(proxies), 50), chunk_size):  # Máximo 50 proxies
-            chunk = proxies[i:i+chunk_size]
-            message += "```\n"
-            for proxy in chunk:
-                message += f"{proxy}\n"
-            message += "```\n\n"
+        width = max(21, max(map(len, proxies)))
+        blocks = []
+        for i in range(0, len(proxies), chunk_size):
+            lines = []
+            for proxy in proxies[i:i+chunk_size]:
+                if latencies and proxy in latencies:
+                    lines.append(f"{proxy:<{width}} {latencies[proxy] * 1000:.0f}ms")
+                else:
+                    lines.append(proxy)
+            blocks.append("```\n" + escape_code("\n".join(lines)) + "\n```\n\n")
         
-        message += f"⚠️ *Nota:* Estos proxies son públicos, úsalos con responsabilidad.\n"
-        message += "🔧 Para probar: `curl --proxy http://IP:PORT http://ifconfig.me`"
+        footer = f"⚠️ *Nota:* {escape_markdown('Estos proxies son públicos, úsalos con responsabilidad.')}\n"
+        footer += "🔧 Para probar: `curl --proxy http://IP:PORT http://ifconfig.me`"
         
-        return message
+        return paginate(header, blocks, footer)
     
-    def get_random_proxies(self, count=10):
-        """Obtiene una selección aleatoria de proxies"""
-        all_proxies = self.fetch_proxies()
-        if len(all_proxies) > count:
-            return random.sample(all_proxies, count)
-        return all_proxies
+    def get_random_proxies(self, count=10, alive_only=False):
+        """Obtiene una selección aleatoria de proxies directamente del pool"""
+        if alive_only:
+            alive = self.checker.alive_keys()
+            if alive:
+                return [proxy for _, proxy in random.sample(alive, min(count, len(alive)))]
+        return self.pool.sample(count)
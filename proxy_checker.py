@@ -0,0 +1,220 @@
+import asyncio
+import heapq
+import socket
+import struct
+import time
+from collections import deque
+import logging
+
+from config import (
+    PROXY_CHECK_CONCURRENCY,
+    PROXY_CHECK_TIMEOUT,
+    PROXY_CHECK_HOST,
+    PROXY_CHECK_PORT,
+    PROXY_CHECK_MODE
+)
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Número de resultados recientes que se guardan por proxy
+HISTORY_SIZE = 10
+# Peso del último resultado en la media móvil de latencia
+LATENCY_ALPHA = 0.3
+
+class ProxyHealth:
+    """Historial de comprobaciones de un proxy"""
+    __slots__ = ('attempts', 'successes', 'latency', 'alive', 'last_checked', 'recent')
+
+    def __init__(self):
+        self.attempts = 0
+        self.successes = 0
+        self.latency = None  # media móvil exponencial en segundos
+        self.alive = False
+        self.last_checked = 0.0
+        self.recent = deque(maxlen=HISTORY_SIZE)
+
+    def record(self, latency):
+        """Registra un resultado (latencia en segundos o None si falló)"""
+        self.attempts += 1
+        self.last_checked = time.time()
+        self.recent.append(latency)
+        self.alive = latency is not None
+        if latency is not None:
+            self.successes += 1
+            if self.latency is None:
+                self.latency = latency
+            else:
+                self.latency = LATENCY_ALPHA * latency + (1 - LATENCY_ALPHA) * self.latency
+
+    @property
+    def success_rate(self):
+        return self.successes / self.attempts if self.attempts else 0.0
+
+    def score(self):
+        """Menor es mejor: latencia penalizada por la tasa de fallos"""
+        return self.latency / max(self.success_rate, 0.1)
+
+class ProxyChecker:
+    """Comprueba proxies http/https/socks4/socks5 con asyncio y mide su latencia"""
+
+    def __init__(self, concurrency=PROXY_CHECK_CONCURRENCY, timeout=PROXY_CHECK_TIMEOUT,
+                 target_host=PROXY_CHECK_HOST, target_port=PROXY_CHECK_PORT, mode=PROXY_CHECK_MODE):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.target_host = target_host
+        self.target_port = target_port
+        self.mode = mode  # 'http' (GET absoluto) o 'connect' para proxies http
+        # (protocolo, 'ip:puerto') -> ProxyHealth
+        self.health = {}
+        # Cambia con cada ronda de comprobación (invalida los renders cacheados)
+        self.version = 0
+        self._semaphore = None
+        self._target_ip = None
+
+    async def _resolve_target(self):
+        """SOCKS4 necesita la IPv4 del destino; se resuelve una sola vez"""
+        if self._target_ip is None:
+            loop = asyncio.get_running_loop()
+            infos = await loop.getaddrinfo(self.target_host, self.target_port, family=socket.AF_INET)
+            self._target_ip = infos[0][4][0]
+        return self._target_ip
+
+    async def _probe_http(self, reader, writer):
+        target = f"{self.target_host}:{self.target_port}"
+        request = (
+            f"GET http://{target}/ HTTP/1.1\r\n"
+            f"Host: {target}\r\n"
+            "Connection: close\r\n\r\n"
+        )
+        writer.write(request.encode())
+        await writer.drain()
+        return self._status_ok(await reader.readline())
+
+    async def _probe_connect(self, reader, writer):
+        target = f"{self.target_host}:{self.target_port}"
+        writer.write(f"CONNECT {target} HTTP/1.1\r\nHost: {target}\r\n\r\n".encode())
+        await writer.drain()
+        return self._status_ok(await reader.readline())
+
+    def _status_ok(self, status_line):
+        parts = status_line.split()
+        return len(parts) >= 2 and parts[0].startswith(b'HTTP/1.') and parts[1][:1] in (b'2', b'3')
+
+    async def _probe_socks4(self, reader, writer):
+        ip = await self._resolve_target()
+        writer.write(struct.pack('>BBH', 4, 1, self.target_port) + socket.inet_aton(ip) + b'\x00')
+        await writer.drain()
+        reply = await reader.readexactly(8)
+        return reply[1] == 0x5A
+
+    async def _probe_socks5(self, reader, writer):
+        # Saludo sin autenticación
+        writer.write(b'\x05\x01\x00')
+        await writer.drain()
+        greeting = await reader.readexactly(2)
+        if greeting != b'\x05\x00':
+            return False
+        host = self.target_host.encode()
+        writer.write(b'\x05\x01\x00\x03' + bytes([len(host)]) + host + struct.pack('>H', self.target_port))
+        await writer.drain()
+        reply = await reader.readexactly(4)
+        return reply[0] == 5 and reply[1] == 0
+
+    async def probe(self, protocol, proxy):
+        """Prueba un proxy; devuelve la latencia en segundos o None si no responde"""
+        host, port = proxy.rsplit(':', 1)
+        if protocol == 'socks4':
+            handshake = self._probe_socks4
+        elif protocol == 'socks5':
+            handshake = self._probe_socks5
+        elif protocol == 'https' or self.mode == 'connect':
+            handshake = self._probe_connect
+        else:
+            handshake = self._probe_http
+
+        start = time.perf_counter()
+        writer = None
+        try:
+            async with asyncio.timeout(self.timeout):
+                reader, writer = await asyncio.open_connection(host, int(port))
+                ok = await handshake(reader, writer)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError):
+            ok = False
+        finally:
+            if writer is not None:
+                writer.close()
+        return time.perf_counter() - start if ok else None
+
+    async def check(self, protocol, proxy):
+        """Prueba un proxy respetando el límite de concurrencia y guarda el resultado"""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            latency = await self.probe(protocol, proxy)
+        health = self.health.get((protocol, proxy))
+        if health is None:
+            health = self.health[(protocol, proxy)] = ProxyHealth()
+        health.record(latency)
+        return latency
+
+    async def check_many(self, keys):
+        """Prueba una lista de (protocolo, 'ip:puerto'); devuelve cuántos están vivos"""
+        results = await asyncio.gather(*(self.check(protocol, proxy) for protocol, proxy in keys))
+        self.version += 1
+        return sum(1 for latency in results if latency is not None)
+
+    def select_batch(self, keys, size):
+        """Elige los proxies nunca comprobados o comprobados hace más tiempo"""
+        def last_checked(key):
+            health = self.health.get(key)
+            return health.last_checked if health else 0.0
+        return heapq.nsmallest(size, keys, key=last_checked)
+
+    def forget_missing(self, keys):
+        """Descarta el historial de proxies que ya no están en el pool"""
+        for key in [key for key in self.health if key not in keys]:
+            del self.health[key]
+
+    def latency_of(self, protocol, proxy):
+        """Latencia media conocida de un proxy vivo, o None"""
+        health = self.health.get((protocol, proxy))
+        return health.latency if health and health.alive else None
+
+    def fastest(self, count, protocol=None):
+        """Devuelve los `count` proxies vivos con mejor puntuación como (protocolo, 'ip:puerto')"""
+        alive = (
+            (health.score(), key) for key, health in self.health.items()
+            if health.alive and (protocol is None or key[0] == protocol)
+        )
+        return [key for _, key in heapq.nsmallest(count, alive)]
+
+    def dump(self):
+        """Historial de cada proxy como tuplas, para guardarlo en disco"""
+        return [
+            (key, health.attempts, health.successes, health.latency, health.alive,
+             health.last_checked, tuple(health.recent))
+            for key, health in self.health.items()
+        ]
+
+    def restore(self, rows, replace=False):
+        """Carga el historial guardado con dump() (con `replace`, en lugar del actual)"""
+        if replace:
+            self.health = {}
+        for key, attempts, successes, latency, alive, last_checked, recent in rows:
+            health = ProxyHealth()
+            health.attempts = attempts
+            health.successes = successes
+            health.latency = latency
+            health.alive = alive
+            health.last_checked = last_checked
+            health.recent.extend(recent)
+            self.health[tuple(key)] = health
+        self.version += 1
+
+    def alive_keys(self, protocol=None):
+        """Todos los proxies cuya última comprobación fue correcta"""
+        return [
+            key for key, health in self.health.items()
+            if health.alive and (protocol is None or key[0] == protocol)
+        ]
@@ -0,0 +1,138 @@
+import re
+import logging
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from config import RENDER_CACHE_SIZE, RENDER_CACHE_TTL
+from cache import TTLCache
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Límite de Telegram para el texto de un mensaje
+MESSAGE_LIMIT = 4096
+# Espacio reservado para la marca "📄 Página i/n" de cada página
+PAGE_MARK_RESERVE = 32
+
+MARKDOWN_V2_RE = re.compile(r'([_*\[\]()~`>#+\-=|{}.!\\])')
+URL_RE = re.compile(r'([)\\])')
+CODE_RE = re.compile(r'([`\\])')
+# Enlace [texto](url) y marcas de formato, para pasar una línea a texto plano
+LINK_RE = re.compile(r'\[((?:\\.|[^\]\\])*)\]\((?:\\.|[^)\\])*\)')
+MARKUP_RE = re.compile(r'\\(.)|\|\||[*_~`]')
+
+def escape_markdown(text):
+    """Escapa un texto para MarkdownV2"""
+    return MARKDOWN_V2_RE.sub(r'\\\1', str(text))
+
+def escape_url(url):
+    """Escapa la URL de un enlace [texto](url) en MarkdownV2"""
+    return URL_RE.sub(r'\\\1', str(url))
+
+def escape_code(text):
+    """Escapa el contenido de un bloque de código en MarkdownV2"""
+    return CODE_RE.sub(r'\\\1', str(text))
+
+def text_length(text):
+    """Longitud tal como la cuenta Telegram (unidades UTF-16)"""
+    return len(text.encode('utf-16-le')) // 2
+
+def plain_text(line):
+    """Quita a una línea MarkdownV2 los enlaces, las marcas y los escapes"""
+    return MARKUP_RE.sub(lambda match: match.group(1) or '', LINK_RE.sub(r'\1', line))
+
+def truncate(block, room):
+    """Recorta un bloque MarkdownV2 a `room` unidades UTF-16 sin partir entidades.
+
+    Se quedan las líneas enteras que quepan; si ni la primera cabe, se envía
+    recortada como texto plano (sin formato, escapado de nuevo).
+    """
+    lines = block.splitlines(keepends=True)
+    kept = []
+    size = 0
+    for line in lines:
+        length = text_length(line)
+        if size + length > room:
+            break
+        kept.append(line)
+        size += length
+    if kept:
+        return ''.join(kept)
+    cut = []
+    size = text_length('…')
+    for char in plain_text(lines[0].rstrip('\n')):
+        escaped = escape_markdown(char)
+        size += text_length(escaped)
+        if size > room:
+            break
+        cut.append(escaped)
+    return ''.join(cut) + '…'
+
+def paginate(header, blocks, footer='', per_page=None, limit=MESSAGE_LIMIT):
+    """Reparte bloques en páginas de como mucho `per_page` bloques y `limit` caracteres.
+
+    Cada página lleva la cabecera y el pie; si hay más de una se añade la
+    marca de página. Un bloque que no cabe solo en una página se recorta con
+    truncate().
+    """
+    room = limit - text_length(header) - text_length(footer) - PAGE_MARK_RESERVE
+    pages = []
+    current = []
+    size = 0
+    for block in blocks:
+        length = text_length(block)
+        if length > room:
+            block = truncate(block, room)
+            length = text_length(block)
+        if current and (size + length > room or (per_page and len(current) >= per_page)):
+            pages.append(current)
+            current, size = [], 0
+        current.append(block)
+        size += length
+    if current or not pages:
+        pages.append(current)
+
+    if len(pages) == 1:
+        return [header + ''.join(pages[0]) + footer]
+    total = len(pages)
+    return [
+        f"{header}{''.join(page)}{footer}\n📄 Página {number}/{total}"
+        for number, page in enumerate(pages, 1)
+    ]
+
+def page_keyboard(prefix, page, pages):
+    """Teclado ◀️ n/m ▶️ para moverse entre páginas (None si solo hay una)"""
+    if pages <= 1:
+        return None
+    buttons = []
+    if page > 0:
+        buttons.append(InlineKeyboardButton("◀️", callback_data=f"{prefix}:{page - 1}"))
+    buttons.append(InlineKeyboardButton(f"{page + 1}/{pages}", callback_data=f"{prefix}:{page}"))
+    if page < pages - 1:
+        buttons.append(InlineKeyboardButton("▶️", callback_data=f"{prefix}:{page + 1}"))
+    return InlineKeyboardMarkup([buttons])
+
+class RenderCache:
+    """Páginas ya renderizadas, por clave (que incluye la versión de los datos).
+
+    Como la clave cambia cuando cambian los datos, nunca se sirve un render
+    obsoleto; las peticiones idénticas de muchos chats reutilizan el mismo texto.
+    """
+
+    def __init__(self, maxsize=RENDER_CACHE_SIZE, ttl=RENDER_CACHE_TTL):
+        self.cache = TTLCache(maxsize, ttl)
+        self.renders = 0
+
+    def pages(self, key, render):
+        """Devuelve las páginas de `key`, llamando a render() solo si no están"""
+        pages = self.cache.get(key)
+        if pages is None:
+            pages = tuple(render())
+            self.cache.set(key, pages)
+            self.renders += 1
+        return pages
+
+    def get_stats(self):
+        stats = self.cache.get_stats()
+        stats['renders'] = self.renders
+        return stats
@@ -0,0 +1,332 @@
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import time
+import logging
+
+from config import STATE_DB_PATH, SEEN_TTL, SEEN_BLOOM_BITS, SEEN_BLOOM_HASHES
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def item_digest(item):
+    """Huella de 64 bits (con signo, cabe en un INTEGER de SQLite) del GUID o enlace"""
+    key = item.get('guid') or item.get('link') or item.get('title', '')
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'big', signed=True)
+
+class BloomFilter:
+    """Filtro de Bloom sobre huellas de 64 bits"""
+
+    def __init__(self, bits, hashes):
+        self.bits = bits
+        self.hashes = hashes
+        self._array = bytearray((bits + 7) // 8)
+
+    def _positions(self, digest):
+        # Doble hashing a partir de las dos mitades de la huella
+        h1 = digest & 0xFFFFFFFF
+        h2 = (digest >> 32) & 0xFFFFFFFF | 1
+        return ((h1 + i * h2) % self.bits for i in range(self.hashes))
+
+    def add(self, digest):
+        for position in self._positions(digest):
+            self._array[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, digest):
+        return all(self._array[position >> 3] & (1 << (position & 7)) for position in self._positions(digest))
+
+class SeenIndex:
+    """Índice de noticias ya entregadas a cada chat, por feed.
+
+    Para cada (chat, feed) guarda un conjunto de huellas con el instante de
+    entrega; caducan pasados SEEN_TTL segundos. Los conjuntos se cargan desde
+    SQLite en un hilo con preload() (o bajo demanda si faltan) por una conexión
+    de lectura propia, y las altas se escriben por lotes. Opcionalmente, un
+    filtro de Bloom por feed con todo lo entregado a cualquier chat evita
+    cargar conjuntos cuando todas las noticias son nuevas; se construye en un
+    hilo (rebuild_blooms) y, hasta tenerlo, los conjuntos se cargan siempre.
+    """
+
+    def __init__(self, path=STATE_DB_PATH, ttl=SEEN_TTL, bloom_bits=SEEN_BLOOM_BITS, bloom_hashes=SEEN_BLOOM_HASHES):
+        self.path = path
+        self.ttl = ttl
+        self.bloom_bits = bloom_bits
+        self.bloom_hashes = bloom_hashes
+        # (chat_id, feed) -> {huella: entregada (hora de pared)}
+        self._sets = {}
+        self._blooms = None
+        # Entregas marcadas mientras se reconstruyen los filtros (None: no se está reconstruyendo)
+        self._marked_during_build = None
+        self._pending = []
+        # Lotes que se están escribiendo, del más viejo al más nuevo
+        self._writing = []
+        self._conn = None
+        self._lock = threading.Lock()
+        # Conexión de lectura: no espera a que el hilo de volcado termine un lote
+        self._read_conn = None
+        self._read_lock = threading.Lock()
+        # Los volcados van de uno en uno y no terminan mientras se precargan conjuntos
+        self._flush_lock = asyncio.Lock()
+        self.stats = {'loads': 0, 'bloom_skips': 0, 'new': 0, 'repeated': 0, 'expired': 0}
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS seen ('
+                ' chat_id INTEGER NOT NULL, feed TEXT NOT NULL, digest INTEGER NOT NULL, seen_at REAL NOT NULL,'
+                ' PRIMARY KEY (chat_id, feed, digest)) WITHOUT ROWID'
+            )
+        return self._conn
+
+    def _new_bloom(self):
+        return BloomFilter(self.bloom_bits, self.bloom_hashes)
+
+    def _bloom(self, feed):
+        """Filtro de Bloom del feed, o None si aún no se ha construido"""
+        if self._blooms is None:
+            return None
+        bloom = self._blooms.get(feed)
+        if bloom is None:
+            bloom = self._blooms[feed] = self._new_bloom()
+        return bloom
+
+    def _build_blooms(self):
+        """Filtros de Bloom con todo lo guardado en disco (lento: se ejecuta en un hilo)"""
+        # Conexión propia: no bloquea las consultas y escrituras de la conexión compartida
+        with self._lock:
+            self._connect()
+        conn = sqlite3.connect(self.path)
+        try:
+            rows = conn.execute('SELECT DISTINCT feed, digest FROM seen').fetchall()
+        finally:
+            conn.close()
+        blooms = {}
+        for feed, digest in rows:
+            bloom = blooms.get(feed)
+            if bloom is None:
+                bloom = blooms[feed] = self._new_bloom()
+            bloom.add(digest)
+        return blooms
+
+    async def rebuild_blooms(self):
+        """Reconstruye los filtros en un hilo y los sustituye de una vez al terminar"""
+        if not self.bloom_bits or self._marked_during_build is not None:
+            return
+        # Lo aún no volcado, y lo que se marque mientras tanto, también cuenta como entregado
+        self._marked_during_build = [(row[1], row[2]) for row in self._unflushed()]
+        try:
+            blooms = await asyncio.to_thread(self._build_blooms)
+        except Exception as e:
+            logger.error(f"Error construyendo los filtros de Bloom: {e}")
+            return
+        finally:
+            marked, self._marked_during_build = self._marked_during_build, None
+        for feed, digest in marked:
+            bloom = blooms.get(feed)
+            if bloom is None:
+                bloom = blooms[feed] = self._new_bloom()
+            bloom.add(digest)
+        self._blooms = blooms
+
+    def _unflushed(self):
+        """Entregas aún no confirmadas en disco: lotes en curso y pendientes"""
+        for batch in self._writing:
+            yield from batch
+        yield from self._pending
+
+    def _load_sets(self, keys):
+        """Lee de SQLite los conjuntos indicados (se ejecuta en un hilo)"""
+        cutoff = time.time() - self.ttl
+        loaded = {}
+        with self._read_lock:
+            if self._read_conn is None:
+                self._read_conn = sqlite3.connect(self.path, check_same_thread=False)
+            for chat_id, feed in keys:
+                try:
+                    rows = self._read_conn.execute(
+                        'SELECT digest, seen_at FROM seen WHERE chat_id = ? AND feed = ? AND seen_at >= ?',
+                        (chat_id, feed, cutoff)
+                    ).fetchall()
+                except sqlite3.OperationalError:
+                    # La tabla aún no existe: nada se ha volcado todavía
+                    rows = []
+                loaded[(chat_id, feed)] = rows
+        return loaded
+
+    def _remember_sets(self, loaded):
+        """Guarda en memoria los conjuntos leídos, con lo que aún no está en disco"""
+        for chat_id, feed, digest, seen_at in self._unflushed():
+            rows = loaded.get((chat_id, feed))
+            if rows is not None:
+                rows.append((digest, seen_at))
+        for key, rows in loaded.items():
+            if key not in self._sets:
+                self._sets[key] = dict(rows)
+                self.stats['loads'] += 1
+
+    def _entries(self, chat_id, feed):
+        key = (chat_id, feed)
+        if key not in self._sets:
+            # Sin preload() se lee aquí mismo, por la conexión de lectura
+            self._remember_sets(self._load_sets([key]))
+        return self._sets[key]
+
+    def _bloom_skips(self, chat_id, feed, digests):
+        """Indica si el filtro de Bloom asegura que nadie ha recibido ninguna de las noticias"""
+        bloom = self._bloom(feed) if self.bloom_bits and (chat_id, feed) not in self._sets else None
+        return bloom is not None and not any(digest in bloom for digest in digests)
+
+    async def preload(self, wanted):
+        """Carga en un hilo los conjuntos que necesitará filter_new()
+
+        `wanted` es una lista de (chat_id, feed, noticias); se omiten los ya
+        cargados y los que el filtro de Bloom permite saltarse.
+        """
+        keys = {
+            (chat_id, feed) for chat_id, feed, items in wanted
+            if (chat_id, feed) not in self._sets
+            and not self._bloom_skips(chat_id, feed, [item_digest(item) for item in items])
+        }
+        if not keys:
+            return
+        # Un volcado que terminara entre la lectura y este punto se perdería de ambos lados
+        async with self._flush_lock:
+            loaded = await asyncio.to_thread(self._load_sets, keys)
+            self._remember_sets(loaded)
+
+    def filter_new(self, chat_id, feed, items):
+        """Devuelve solo las noticias que aún no se han entregado a ese chat"""
+        digests = [item_digest(item) for item in items]
+        if self._bloom_skips(chat_id, feed, digests):
+            # Nadie ha recibido ninguna: no hace falta cargar el conjunto
+            self.stats['bloom_skips'] += 1
+            self.stats['new'] += len(items)
+            return list(items)
+        entries = self._entries(chat_id, feed)
+        new = [item for item, digest in zip(items, digests) if digest not in entries]
+        self.stats['new'] += len(new)
+        self.stats['repeated'] += len(items) - len(new)
+        return new
+
+    def mark(self, chat_id, feed, items, now=None):
+        """Marca noticias como entregadas a un chat"""
+        now = time.time() if now is None else now
+        # Si el conjunto no está cargado (lo saltó el filtro de Bloom) no se lee:
+        # la entrega queda en el filtro y en disco, y se cargará cuando haga falta
+        entries = self._sets.get((chat_id, feed))
+        for item in items:
+            digest = item_digest(item)
+            if entries is not None:
+                if digest in entries:
+                    continue
+                entries[digest] = now
+            self._pending.append((chat_id, feed, digest, now))
+            if self._marked_during_build is not None:
+                self._marked_during_build.append((feed, digest))
+            bloom = self._bloom(feed) if self.bloom_bits else None
+            if bloom is not None:
+                bloom.add(digest)
+
+    def expire(self, now=None):
+        """Olvida en memoria las entregas más antiguas que el TTL; devuelve el corte"""
+        cutoff = (time.time() if now is None else now) - self.ttl
+        removed = 0
+        for key, entries in list(self._sets.items()):
+            old = [digest for digest, seen_at in entries.items() if seen_at < cutoff]
+            for digest in old:
+                del entries[digest]
+            removed += len(old)
+            if not entries:
+                del self._sets[key]
+        # El filtro de Bloom no admite borrados: expire_job lo reconstruye en un hilo;
+        # mientras, lo caducado solo provoca falsos positivos (cargas de más)
+        self.stats['expired'] += removed
+        return cutoff
+
+    def delete_expired(self, cutoff):
+        """Borra de disco las entregas anteriores al corte"""
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                return conn.execute('DELETE FROM seen WHERE seen_at < ?', (cutoff,)).rowcount
+
+    def flush(self):
+        """Escribe en SQLite las entregas pendientes"""
+        pending = self._take_pending()
+        if not pending:
+            return 0
+        return self._finish(pending, self._write(pending))
+
+    async def flush_async(self):
+        async with self._flush_lock:
+            pending = self._take_pending()
+            if not pending:
+                return 0
+            ok = False
+            try:
+                ok = await asyncio.to_thread(self._write, pending)
+            finally:
+                written = self._finish(pending, ok)
+            return written
+
+    def _take_pending(self):
+        pending, self._pending = self._pending, []
+        if pending:
+            self._writing.append(pending)
+        return pending
+
+    def _write(self, pending):
+        """Escribe un lote en SQLite; devuelve False si falla. No toca el estado en memoria"""
+        try:
+            with self._lock:
+                conn = self._connect()
+                with conn:
+                    conn.executemany('INSERT OR IGNORE INTO seen VALUES (?, ?, ?, ?)', pending)
+        except Exception as e:
+            logger.error(f"Error guardando noticias vistas: {e}")
+            return False
+        return True
+
+    def _finish(self, pending, ok):
+        """Retira un lote de los que están en curso y, si falló, lo devuelve a la cola"""
+        self._writing = [batch for batch in self._writing if batch is not pending]
+        if not ok:
+            self._pending[:0] = pending
+            return 0
+        return len(pending)
+
+    async def flush_job(self, context):
+        """Callback para el JobQueue de PTB"""
+        await self.flush_async()
+
+    async def expire_job(self, context):
+        """Callback para el JobQueue de PTB"""
+        await self.flush_async()
+        removed = await asyncio.to_thread(self.delete_expired, self.expire())
+        if removed:
+            logger.info(f"{removed} noticias vistas caducadas")
+        await self.rebuild_blooms()
+
+    async def bloom_job(self, context):
+        """Callback para el JobQueue de PTB: construye los filtros al arrancar"""
+        await self.rebuild_blooms()
+
+    def close(self):
+        """Vuelca lo pendiente y cierra la base de datos"""
+        self.flush()
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        with self._read_lock:
+            if self._read_conn is not None:
+                self._read_conn.close()
+                self._read_conn = None
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['chats'] = len(self._sets)
+        stats['pending'] = len(self._pending)
+        return stats
@@ -0,0 +1,284 @@
+import asyncio
+import hashlib
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import threading
+import time
+from bisect import bisect
+import logging
+
+from telegram import Bot, Update
+
+from config import (
+    BOT_TOKEN,
+    TELEGRAM_API_URL,
+    WEBHOOK_QUEUE_SIZE,
+    WEBHOOK_WORKERS,
+    SHARD_VNODES,
+    SHARD_MAX_RESTARTS,
+    SHARD_RESTART_BACKOFF
+)
+from webhook import WebhookServer
+from metrics import Gauge, Counter
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Espera máxima entre reinicios, y tiempo vivo a partir del cual una caída ya no cuenta como seguida
+MAX_RESTART_BACKOFF = 60
+STABLE_AFTER = 60
+
+# Campos de un update que traen un objeto con su chat
+CHAT_FIELDS = (
+    'message', 'edited_message', 'channel_post', 'edited_channel_post', 'my_chat_member',
+    'chat_member', 'chat_join_request', 'message_reaction', 'message_reaction_count'
+)
+
+def stable_hash(value):
+    """Hash de 64 bits igual en todos los procesos (hash() cambia con PYTHONHASHSEED)"""
+    return int.from_bytes(hashlib.blake2b(str(value).encode(), digest_size=8).digest(), 'big')
+
+def routing_key(data):
+    """chat_id de un update en JSON (o el usuario si no tiene chat), para repartirlo"""
+    for field in CHAT_FIELDS:
+        payload = data.get(field)
+        if payload and 'chat' in payload:
+            return payload['chat']['id']
+    callback = data.get('callback_query')
+    if callback:
+        message = callback.get('message')
+        return message['chat']['id'] if message and 'chat' in message else callback['from']['id']
+    for value in data.values():
+        if isinstance(value, dict) and 'from' in value:
+            return value['from']['id']
+    return data.get('update_id', 0)
+
+class HashRing:
+    """Anillo de hashing consistente: cambiar el número de workers solo mueve ~1/N de los chats"""
+
+    def __init__(self, nodes, vnodes=SHARD_VNODES):
+        points = sorted((stable_hash(f"{node}#{v}"), node) for node in nodes for v in range(vnodes))
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node_for(self, key):
+        """Worker al que pertenece una clave"""
+        i = bisect(self._hashes, stable_hash(key))
+        return self._nodes[i % len(self._nodes)]
+
+class ShardRouter(WebhookServer):
+    """Webhook frontal: valida y deduplica como WebhookServer, pero en vez de
+    procesar cada update lo entrega a la cola del worker dueño de su chat.
+    Una cola por worker, leída en orden, conserva el orden de cada chat.
+    """
+
+    def __init__(self, queues, **kwargs):
+        super().__init__(None, workers=0, **kwargs)
+        self.queues = queues
+        self.ring = HashRing(range(len(queues)))
+        self.routed = [0] * len(queues)
+        Gauge('tiffany_shard_queue', 'Updates pendientes en la cola de cada worker', ['shard']).set_function(
+            lambda: {(str(i),): q.qsize() for i, q in enumerate(self.queues)}
+        )
+        Counter('tiffany_shard_routed_total', 'Updates entregados a cada worker', ['shard']).set_function(
+            lambda: {(str(i),): count for i, count in enumerate(self.routed)}
+        )
+
+    def enqueue(self, data):
+        shard = self.ring.node_for(routing_key(data))
+        try:
+            self.queues[shard].put_nowait(data)
+        except queue.Full:
+            raise asyncio.QueueFull
+        self.routed[shard] += 1
+
+def worker_main(index, count, updates):
+    """Punto de entrada de cada proceso worker"""
+    # Con spawn, si el frontal se lanzó como `python bot.py` el módulo ya está cargado como __mp_main__
+    main = sys.modules.get('__mp_main__')
+    if main is not None and hasattr(main, 'run_shard'):
+        sys.modules.setdefault('bot', main)
+    import bot
+    # Ctrl+C llega a todo el grupo de procesos: el cierre lo coordina el frontal
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    bot.run_shard(index, count, updates)
+
+class ShardPool:
+    """Procesos worker con su cola; reinicia los que mueran inesperadamente.
+
+    Los reinicios esperan cada vez el doble (de `backoff` a MAX_RESTART_BACKOFF
+    segundos) y, si un worker cae más de `max_restarts` veces seguidas, se
+    deja de intentar: algo impide arrancarlo y reintentar solo repetiría las
+    llamadas de arranque a Telegram.
+    """
+
+    def __init__(self, count, queue_size=WEBHOOK_QUEUE_SIZE,
+                 max_restarts=SHARD_MAX_RESTARTS, backoff=SHARD_RESTART_BACKOFF):
+        self.count = count
+        self.max_restarts = max_restarts
+        self.backoff = backoff
+        self._context = multiprocessing.get_context('spawn')
+        self.queues = [self._context.Queue(maxsize=queue_size) for _ in range(count)]
+        self.processes = [None] * count
+        self.restarts = 0
+        self.failed = False
+        self._started_at = [0.0] * count
+        # Caídas seguidas de cada worker y cuándo toca reiniciarlo (None: está vivo)
+        self._failures = [0] * count
+        self._retry_at = [None] * count
+        self._stopping = False
+
+    def _spawn(self, index):
+        process = self._context.Process(
+            target=worker_main, args=(index, self.count, self.queues[index]),
+            name=f"tiffany-shard-{index}", daemon=True
+        )
+        process.start()
+        self.processes[index] = process
+        self._started_at[index] = time.monotonic()
+
+    def start(self):
+        for index in range(self.count):
+            self._spawn(index)
+        logger.info(f"{self.count} workers arrancados")
+
+    async def watch(self, on_give_up=None, interval=1):
+        """Vigila los workers y reinicia los caídos (sus chats esperan en la cola)"""
+        while not self._stopping:
+            await asyncio.sleep(interval)
+            now = time.monotonic()
+            for index, process in enumerate(self.processes):
+                if self._stopping or process.is_alive():
+                    continue
+                if self._retry_at[index] is None:
+                    if now - self._started_at[index] >= STABLE_AFTER:
+                        self._failures[index] = 0
+                    self._failures[index] += 1
+                    if self._failures[index] > self.max_restarts:
+                        logger.error(f"Worker {index} ha caído {self._failures[index]} veces seguidas; se abandona")
+                        self.failed = True
+                        if on_give_up is not None:
+                            on_give_up()
+                        return
+                    delay = min(self.backoff * 2 ** (self._failures[index] - 1), MAX_RESTART_BACKOFF)
+                    logger.error(f"Worker {index} terminó (código {process.exitcode}); reinicio en {delay} s")
+                    self._retry_at[index] = now + delay
+                elif now >= self._retry_at[index]:
+                    self._retry_at[index] = None
+                    self.restarts += 1
+                    self._spawn(index)
+
+    def stop(self, timeout=30):
+        """Pide a cada worker que termine lo encolado y espera a que salga"""
+        self._stopping = True
+        for updates in self.queues:
+            updates.put(None)
+        for index, process in enumerate(self.processes):
+            process.join(timeout)
+            if process.is_alive():
+                logger.warning(f"Worker {index} no terminó a tiempo; se fuerza")
+                process.terminate()
+                process.join()
+
+async def run_sharded(url, port, count, host='0.0.0.0'):
+    """Proceso frontal: arranca los workers, registra el webhook y reparte updates hasta SIGTERM/SIGINT"""
+    pool = ShardPool(count)
+    pool.start()
+    router = ShardRouter(pool.queues)
+    Counter('tiffany_shard_restarts_total', 'Workers reiniciados tras caerse').set_function(lambda: pool.restarts)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stop.set)
+
+    async with Bot(BOT_TOKEN, base_url=f"{TELEGRAM_API_URL}/bot") as bot:
+        await bot.set_webhook(
+            url=f"{url.rstrip('/')}{router.path}",
+            secret_token=router.secret_token or None,
+            allowed_updates=Update.ALL_TYPES
+        )
+    await router.start(host, port)
+    watcher = asyncio.create_task(pool.watch(on_give_up=stop.set))
+
+    try:
+        await stop.wait()
+    finally:
+        logger.info("Cerrando frontal y workers...")
+        await router.stop()
+        watcher.cancel()
+        await asyncio.to_thread(pool.stop)
+    if pool.failed:
+        sys.exit(1)
+
+async def serve_shard(application, updates, lanes=WEBHOOK_WORKERS, backlog=WEBHOOK_QUEUE_SIZE):
+    """Worker: procesa los updates de su cola en `lanes` carriles por chat.
+
+    Los updates de un mismo chat van siempre al mismo carril y se procesan en
+    orden; chats distintos avanzan en paralelo. Como mucho `backlog` updates
+    salen de la cola compartida sin haberse procesado, así el frontal ve la
+    cola llena (y responde 503) si el worker no da abasto.
+    """
+    loop = asyncio.get_running_loop()
+    stop = asyncio.Event()
+    loop.add_signal_handler(signal.SIGTERM, stop.set)
+    lane_queues = [asyncio.Queue() for _ in range(lanes)]
+    slots = threading.BoundedSemaphore(backlog)
+    parent = os.getppid()
+
+    def dispatch(data):
+        lane_queues[routing_key(data) % lanes].put_nowait(data)
+
+    def read():
+        while not stop.is_set():
+            slots.acquire()
+            try:
+                data = updates.get(timeout=1)
+            except queue.Empty:
+                slots.release()
+                if os.getppid() != parent:
+                    logger.error("El proceso frontal ha desaparecido")
+                    break
+                continue
+            if data is None:
+                slots.release()
+                break
+            loop.call_soon_threadsafe(dispatch, data)
+        loop.call_soon_threadsafe(stop.set)
+
+    async def lane(lane_queue):
+        while True:
+            data = await lane_queue.get()
+            try:
+                await application.process_update(Update.de_json(data, application.bot))
+            except Exception as e:
+                logger.error(f"Error processing update {data.get('update_id')}: {e}")
+            finally:
+                slots.release()
+                lane_queue.task_done()
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    tasks = [asyncio.create_task(lane(lane_queue)) for lane_queue in lane_queues]
+    threading.Thread(target=read, name='shard-reader', daemon=True).start()
+
+    try:
+        await stop.wait()
+    finally:
+        try:
+            await asyncio.wait_for(asyncio.gather(*(q.join() for q in lane_queues)), 10)
+        except asyncio.TimeoutError:
+            logger.warning("Se descartan updates sin procesar")
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
@@ -0,0 +1,241 @@
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import logging
+
+from config import STATE_DB_PATH, STATE_CACHE_SIZE, STATE_FLUSH_BATCH
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def monotonic_to_wall(mono):
+    """Convierte un instante de time.monotonic() a hora de pared (para guardarlo)"""
+    return time.time() - (time.monotonic() - mono)
+
+def wall_to_monotonic(wall):
+    """Convierte una hora de pared guardada a la escala de time.monotonic()"""
+    return time.monotonic() - (time.time() - wall)
+
+class StateStore:
+    """Estado por chat con caché LRU acotada y escritura diferida a SQLite.
+
+    Cada entrada se identifica por (espacio de nombres, clave) y guarda un
+    valor serializable en JSON junto al instante (monotónico) de su última
+    modificación. Las escrituras se acumulan y se vuelcan por lotes; las
+    lecturas que no están en memoria se cargan bajo demanda desde el fichero,
+    en un hilo si se usa load_async() y por una conexión propia que no espera
+    a los volcados.
+    """
+
+    def __init__(self, path=STATE_DB_PATH, maxsize=STATE_CACHE_SIZE, flush_batch=STATE_FLUSH_BATCH):
+        self.path = path
+        self.maxsize = maxsize
+        self.flush_batch = flush_batch
+        # (namespace, key) -> [valor, actualizado (monotónico)]
+        self._cache = OrderedDict()
+        # Entradas pendientes de escribir: (namespace, key) -> [valor, actualizado]
+        self._dirty = {}
+        # Lotes que se están escribiendo, del más viejo al más nuevo (siguen siendo legibles)
+        self._writing = []
+        # Claves que no están en disco: no se vuelven a consultar
+        self._absent = OrderedDict()
+        self._conn = None
+        self._lock = threading.Lock()
+        # Conexión de lectura: con WAL lee aunque otro hilo esté volcando un lote
+        self._read_conn = None
+        self._read_lock = threading.Lock()
+        self._flush_task = None
+        # Los volcados van de uno en uno para que se escriban en orden
+        self._flush_lock = asyncio.Lock()
+        self.stats = {'hits': 0, 'loads': 0, 'evictions': 0, 'flushes': 0, 'written': 0}
+
+    def _connect(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS state ('
+                ' namespace TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, updated REAL NOT NULL,'
+                ' PRIMARY KEY (namespace, key))'
+            )
+        return self._conn
+
+    def _load(self, entry_key):
+        """Carga una entrada desde SQLite (o None si no existe)"""
+        with self._read_lock:
+            if self._read_conn is None:
+                self._read_conn = sqlite3.connect(self.path, check_same_thread=False)
+            try:
+                row = self._read_conn.execute(
+                    'SELECT value, updated FROM state WHERE namespace = ? AND key = ?', entry_key
+                ).fetchone()
+            except sqlite3.OperationalError:
+                # La tabla aún no existe: nada se ha volcado todavía
+                row = None
+        if row is None:
+            return None
+        self.stats['loads'] += 1
+        return [json.loads(row[0]), wall_to_monotonic(row[1])]
+
+    def _entry(self, namespace, key):
+        entry_key = (namespace, str(key))
+        entry = self._cache.get(entry_key)
+        if entry is not None:
+            self._cache.move_to_end(entry_key)
+            self.stats['hits'] += 1
+            return entry
+        entry = self._pending(entry_key)
+        if entry is None and entry_key not in self._absent:
+            entry = self._load(entry_key)
+            if entry is None:
+                self._forget_absent(entry_key)
+        if entry is not None:
+            self._remember(entry_key, entry)
+        return entry
+
+    def _pending(self, entry_key):
+        """Entrada aún no escrita en disco (la más reciente), o None"""
+        entry = self._dirty.get(entry_key)
+        if entry is not None:
+            return entry
+        for batch in reversed(self._writing):
+            entry = batch.get(entry_key)
+            if entry is not None:
+                return entry
+        return None
+
+    def _forget_absent(self, entry_key):
+        self._absent[entry_key] = True
+        while len(self._absent) > self.maxsize:
+            self._absent.popitem(last=False)
+
+    async def load_async(self, namespace, key):
+        """Trae una entrada a memoria consultando SQLite en un hilo, para que
+        get()/age() posteriores no toquen el disco desde el event loop
+        """
+        entry_key = (namespace, str(key))
+        if entry_key in self._cache or entry_key in self._absent or self._pending(entry_key):
+            return
+        entry = await asyncio.to_thread(self._load, entry_key)
+        # Mientras se leía pudo guardarse un valor más nuevo
+        if entry_key in self._cache or self._pending(entry_key):
+            return
+        if entry is None:
+            self._forget_absent(entry_key)
+        else:
+            self._remember(entry_key, entry)
+
+    def _remember(self, entry_key, entry):
+        self._cache[entry_key] = entry
+        self._cache.move_to_end(entry_key)
+        while len(self._cache) > self.maxsize:
+            # Lo pendiente sigue en _dirty, así que expulsar no pierde datos
+            self._cache.popitem(last=False)
+            self.stats['evictions'] += 1
+
+    def get(self, namespace, key, default=None):
+        """Devuelve el valor guardado o default"""
+        entry = self._entry(namespace, key)
+        return default if entry is None else entry[0]
+
+    def set(self, namespace, key, value):
+        """Guarda un valor y marca la entrada como modificada ahora"""
+        entry_key = (namespace, str(key))
+        entry = [value, time.monotonic()]
+        self._absent.pop(entry_key, None)
+        self._remember(entry_key, entry)
+        self._dirty[entry_key] = entry
+        if len(self._dirty) >= self.flush_batch:
+            self._schedule_flush()
+
+    def age(self, namespace, key):
+        """Segundos desde la última modificación, o None si no existe"""
+        entry = self._entry(namespace, key)
+        return None if entry is None else time.monotonic() - entry[1]
+
+    def __len__(self):
+        return len(self._cache)
+
+    def _schedule_flush(self):
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+            return
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = loop.create_task(self.flush_async())
+
+    def flush(self):
+        """Escribe en SQLite todas las entradas pendientes en una transacción"""
+        pending = self._take_dirty()
+        if not pending:
+            return 0
+        return self._finish(pending, self._write(pending))
+
+    async def flush_async(self):
+        """Vuelca las escrituras pendientes sin bloquear el event loop"""
+        async with self._flush_lock:
+            # Se recogen y se cierran en el hilo del loop; solo la escritura va al hilo auxiliar
+            pending = self._take_dirty()
+            if not pending:
+                return 0
+            ok = False
+            try:
+                ok = await asyncio.to_thread(self._write, pending)
+            finally:
+                written = self._finish(pending, ok)
+            return written
+
+    def _take_dirty(self):
+        pending, self._dirty = self._dirty, {}
+        if pending:
+            self._writing.append(pending)
+        return pending
+
+    def _write(self, pending):
+        """Escribe un lote en SQLite; devuelve False si falla. No toca el estado en memoria"""
+        rows = [
+            (namespace, key, json.dumps(value), monotonic_to_wall(updated))
+            for (namespace, key), (value, updated) in pending.items()
+        ]
+        try:
+            with self._lock:
+                conn = self._connect()
+                with conn:
+                    conn.executemany('INSERT OR REPLACE INTO state VALUES (?, ?, ?, ?)', rows)
+        except Exception as e:
+            logger.error(f"Error guardando estado: {e}")
+            return False
+        return True
+
+    def _finish(self, pending, ok):
+        """Retira un lote de los que están en curso y reencola lo que no se escribió"""
+        if not ok:
+            # Se reintentará en el siguiente volcado (sin pisar cambios más nuevos)
+            for entry_key, entry in pending.items():
+                self._dirty.setdefault(entry_key, entry)
+        self._writing = [batch for batch in self._writing if batch is not pending]
+        if not ok:
+            return 0
+        self.stats['flushes'] += 1
+        self.stats['written'] += len(pending)
+        return len(pending)
+
+    async def flush_job(self, context):
+        """Callback para el JobQueue de PTB"""
+        await self.flush_async()
+
+    def close(self):
+        """Vuelca lo pendiente y cierra la base de datos"""
+        self.flush()
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+        with self._read_lock:
+            if self._read_conn is not None:
+                self._read_conn.close()
+                self._read_conn = None
@@ -0,0 +1,14 @@
+from types import SimpleNamespace
+
+from admission import message_link
+
+def test_message_link_only_for_public_supergroups_and_channels():
+    def chat(type, username, id=-1001234):
+        return SimpleNamespace(type=type, username=username, id=id)
+
+    assert message_link(chat('supergroup', 'tiffany_grupo'), 7) == "https://t.me/tiffany_grupo/7"
+    assert message_link(chat('channel', 'tiffany_canal'), 7) == "https://t.me/tiffany_canal/7"
+    # En privado el username es el del usuario
+    assert message_link(chat('private', 'alguien', id=42), 7) is None
+    assert message_link(chat('supergroup', None), 7) is None
+    assert message_link(chat('group', None, id=-42), 7) is None
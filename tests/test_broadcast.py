@@ -0,0 +1,72 @@
+import asyncio
+
+from broadcast import BroadcastEngine, Subscription, SubscriptionTable
+from feeds import NewsFeedFetcher, merge_timeline
+from seen import SeenIndex
+
+def make_news(feed, count, newest):
+    return [{
+        'title': f"{feed} noticia {i}",
+        'link': f"https://example.com/{feed}/{i}",
+        'guid': f"{feed}-{i}",
+        'published': '',
+        'timestamp': newest - i * 60,
+        'source': feed
+    } for i in range(count)]
+
+class FakeFeedCache:
+    def __init__(self, items):
+        self.items = items
+        self.loaders = dict.fromkeys(items)
+
+    async def get_items(self, name):
+        return self.items[name]
+
+class FakeOutbox:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text))
+
+def test_broadcast_marks_only_rendered_news(tmp_path):
+    # Dos feeds con 3 noticias cada uno: 6 seleccionadas, pero el mensaje muestra 5
+    items = {'a': make_news('a', 3, 1_700_000_000), 'b': make_news('b', 3, 1_700_000_030)}
+    fetcher = NewsFeedFetcher(feeds={})
+
+    def render(feeds, selected):
+        return fetcher.format_news_message(list(merge_timeline(selected.get(feed, []) for feed in feeds)), 'Test')
+
+    path = str(tmp_path / 'state.db')
+    table = SubscriptionTable(path=path)
+    subscription = Subscription(-100, ['a', 'b'])
+    table.add(subscription)
+    seen = SeenIndex(path=path)
+    outbox = FakeOutbox()
+    engine = BroadcastEngine(table, FakeFeedCache(items), outbox, render, seen=seen)
+
+    asyncio.run(engine.tick())
+    (_, text), = outbox.sent
+    everything = items['a'] + items['b']
+    shown = {item['guid'] for item in everything if item['title'] in text}
+    pending = {
+        item['guid'] for feed, news in items.items()
+        for item in seen.filter_new(subscription.chat_id, feed, news)
+    }
+    assert len(shown) == 5
+    # Lo marcado como entregado es exactamente lo que se mostró
+    assert pending == {item['guid'] for item in everything} - shown == {'a-2'}
+
+    # La noticia que no cupo sale en el siguiente envío
+    subscription.next_due = 0
+    asyncio.run(engine.tick())
+    assert 'a noticia 2' in outbox.sent[-1][1]
+    assert engine.last_tick['skipped'] == 0
+
+    # Ya no queda nada nuevo: el grupo se cuenta como saltado y no recibe mensaje
+    subscription.next_due = 0
+    asyncio.run(engine.tick())
+    assert len(outbox.sent) == 2
+    assert engine.last_tick['groups'] == engine.last_tick['skipped'] == 1
+    seen.close()
+    table.close()
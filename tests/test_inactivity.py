@@ -0,0 +1,27 @@
+import asyncio
+
+from inactivity import InactivityMonitor
+from personality import TiffanyPersonality
+from state import StateStore
+
+def test_group_timeout_override_is_notified(tmp_path):
+    notified = []
+
+    async def run():
+        async def on_idle(group_id):
+            # Igual que notify_inactivity en bot.py
+            if tiffany.check_inactivity(group_id):
+                notified.append(group_id)
+
+        monitor = InactivityMonitor(on_idle, timeout=3600, timeouts={-100: 0.3})
+        tiffany = TiffanyPersonality(state=StateStore(path=str(tmp_path / 'state.db')), monitor=monitor)
+        monitor.start()
+        tiffany.update_activity(-100)
+        tiffany.update_activity(-200)
+        await asyncio.sleep(0.6)
+        await monitor.stop()
+        tiffany.state.close()
+
+    asyncio.run(run())
+    # Solo el grupo con timeout propio ha vencido
+    assert notified == [-100]
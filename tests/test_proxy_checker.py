@@ -0,0 +1,151 @@
+import asyncio
+import socket
+
+from proxy_checker import ProxyChecker
+
+# Proxies de prueba en loopback: cada uno imita el saludo de un protocolo
+
+class Active:
+    """Cuenta las conexiones abiertas a la vez y guarda el máximo"""
+
+    def __init__(self):
+        self.count = 0
+        self.peak = 0
+
+def http_proxy(delay=0, status=b'200 OK', requests=None, active=None):
+    async def handle(reader, writer):
+        if active is not None:
+            active.count += 1
+            active.peak = max(active.peak, active.count)
+        line = await reader.readline()
+        if requests is not None:
+            requests.append(line)
+        # Lee las cabeceras hasta la línea vacía
+        while (await reader.readline()) not in (b'\r\n', b''):
+            pass
+        await asyncio.sleep(delay)
+        writer.write(b'HTTP/1.1 ' + status + b'\r\n\r\n')
+        await writer.drain()
+        writer.close()
+        if active is not None:
+            active.count -= 1
+    return handle
+
+async def socks4_proxy(reader, writer):
+    await reader.readexactly(8)
+    await reader.readuntil(b'\x00')
+    writer.write(b'\x00\x5a' + bytes(6))
+    await writer.drain()
+    writer.close()
+
+async def socks5_proxy(reader, writer):
+    await reader.readexactly(3)
+    writer.write(b'\x05\x00')
+    await writer.drain()
+    header = await reader.readexactly(5)
+    await reader.readexactly(header[4] + 2)
+    writer.write(b'\x05\x00\x00\x01' + bytes(6))
+    await writer.drain()
+    writer.close()
+
+async def silent_proxy(reader, writer):
+    # Acepta la conexión y no contesta nunca
+    await reader.read()
+    writer.close()
+
+async def serve(handler):
+    server = await asyncio.start_server(handler, '127.0.0.1', 0)
+    return server, f"127.0.0.1:{server.sockets[0].getsockname()[1]}"
+
+def closed_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return f"127.0.0.1:{sock.getsockname()[1]}"
+
+def make_checker(**kwargs):
+    kwargs.setdefault('timeout', 0.5)
+    return ProxyChecker(target_host='127.0.0.1', target_port=80, **kwargs)
+
+def test_probe_each_protocol():
+    async def run():
+        requests = []
+        servers = {}
+        for name, handler in (
+            ('http', http_proxy(requests=requests)),
+            ('connect', http_proxy(status=b'200 Connection established', requests=requests)),
+            ('socks4', socks4_proxy),
+            ('socks5', socks5_proxy),
+        ):
+            servers[name] = await serve(handler)
+        checker = make_checker()
+        assert await checker.probe('http', servers['http'][1]) is not None
+        assert await checker.probe('https', servers['connect'][1]) is not None
+        assert await checker.probe('socks4', servers['socks4'][1]) is not None
+        assert await checker.probe('socks5', servers['socks5'][1]) is not None
+        # Con mode='connect' los proxies http también usan CONNECT
+        assert await make_checker(mode='connect').probe('http', servers['connect'][1]) is not None
+        for server, _ in servers.values():
+            server.close()
+        return requests
+
+    requests = asyncio.run(run())
+    assert requests == [
+        b'GET http://127.0.0.1:80/ HTTP/1.1\r\n',
+        b'CONNECT 127.0.0.1:80 HTTP/1.1\r\n',
+        b'CONNECT 127.0.0.1:80 HTTP/1.1\r\n',
+    ]
+
+def test_probe_dead_rejecting_and_silent_proxies():
+    async def run():
+        forbidden, forbidden_addr = await serve(http_proxy(status=b'403 Forbidden'))
+        silent, silent_addr = await serve(silent_proxy)
+        checker = make_checker(timeout=0.2)
+        assert await checker.probe('http', closed_port()) is None
+        assert await checker.probe('socks5', closed_port()) is None
+        assert await checker.probe('http', forbidden_addr) is None
+        started = asyncio.get_running_loop().time()
+        assert await checker.probe('socks4', silent_addr) is None
+        # Abandona al vencer el timeout, no espera más
+        assert asyncio.get_running_loop().time() - started < 1
+        forbidden.close()
+        silent.close()
+
+    asyncio.run(run())
+
+def test_check_many_respects_concurrency_and_records_health():
+    async def run():
+        active = Active()
+        servers = [await serve(http_proxy(delay=0.05, active=active)) for _ in range(5)]
+        keys = [('http', addr) for _, addr in servers] + [('socks5', closed_port())]
+        checker = make_checker(concurrency=2)
+        alive = await checker.check_many(keys)
+        for server, _ in servers:
+            server.close()
+        return checker, keys, alive, active.peak
+
+    checker, keys, alive, peak = asyncio.run(run())
+    assert alive == 5
+    assert peak == 2
+    assert checker.version == 1
+    dead = checker.health[keys[-1]]
+    assert dead.attempts == 1 and not dead.alive
+    assert sorted(checker.alive_keys()) == sorted(keys[:5])
+
+def test_fastest_orders_by_latency_and_skips_dead():
+    async def run():
+        slow, slow_addr = await serve(http_proxy(delay=0.15))
+        medium, medium_addr = await serve(http_proxy(delay=0.05))
+        fast, fast_addr = await serve(socks5_proxy)
+        dead_addr = closed_port()
+        checker = make_checker()
+        await checker.check_many([
+            ('http', slow_addr), ('http', dead_addr), ('socks5', fast_addr), ('http', medium_addr),
+        ])
+        for server in (slow, medium, fast):
+            server.close()
+        return checker, slow_addr, medium_addr, fast_addr
+
+    checker, slow_addr, medium_addr, fast_addr = asyncio.run(run())
+    assert checker.fastest(10) == [('socks5', fast_addr), ('http', medium_addr), ('http', slow_addr)]
+    assert checker.fastest(1) == [('socks5', fast_addr)]
+    assert checker.fastest(10, protocol='http') == [('http', medium_addr), ('http', slow_addr)]
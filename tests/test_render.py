@@ -0,0 +1,22 @@
+from render import escape_markdown, paginate, text_length, truncate
+
+def test_truncate_counts_utf16_and_keeps_whole_lines():
+    line = escape_markdown("🚀 noticia.") + " [Leer más](https://example.com/a)\n"
+    block = line * 40
+    cut = truncate(block, 300)
+    assert text_length(cut) <= 300
+    # Solo líneas completas: ningún enlace ni escape a medias
+    assert cut and len(cut) % len(line) == 0
+
+def test_truncate_long_line_falls_back_to_plain_text():
+    line = escape_markdown("😀" * 100 + ".") + " [Leer más](https://example.com/" + "a" * 200 + ")"
+    cut = truncate(line, 101)
+    assert text_length(cut) <= 101
+    assert cut.endswith('…') and '[' not in cut and not cut[:-1].endswith('\\')
+
+def test_paginate_pages_fit_the_utf16_limit():
+    blocks = [escape_markdown("🔥" * 30) + " [Leer más](https://example.com/x)\n\n"] * 20
+    blocks.append("*" + escape_markdown("🌍" * 400) + "*\n")
+    pages = paginate("*Noticias*\n\n", blocks, footer="_fin_", limit=500)
+    assert len(pages) > 1
+    assert all(text_length(page) <= 500 for page in pages)
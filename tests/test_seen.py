@@ -0,0 +1,38 @@
+import asyncio
+
+from seen import SeenIndex
+
+def make_items(count):
+    return [{'guid': f"guid-{i}", 'title': f"noticia {i}"} for i in range(count)]
+
+def test_unloaded_marks_are_seen_after_preload(tmp_path):
+    items = make_items(3)
+
+    async def run():
+        seen = SeenIndex(path=str(tmp_path / 'state.db'))
+        await seen.rebuild_blooms()
+        # El filtro de Bloom permite no cargar el conjunto y mark() tampoco lo carga
+        assert seen.filter_new(-100, 'a', items[:2]) == items[:2]
+        seen.mark(-100, 'a', items[:1])
+        await seen.flush_async()
+        seen.mark(-100, 'a', items[1:2])
+        assert seen.get_stats()['chats'] == 0
+        # Lo volcado se lee de disco y lo pendiente se añade en memoria
+        await seen.preload([(-100, 'a', items)])
+        assert seen.get_stats()['chats'] == 1
+        assert seen.filter_new(-100, 'a', items) == items[2:]
+        seen.close()
+
+    asyncio.run(run())
+
+def test_failed_flush_is_requeued(tmp_path):
+    async def run():
+        # Un directorio no es una base de datos: la escritura falla
+        seen = SeenIndex(path=str(tmp_path), bloom_bits=0)
+        seen._sets[(-100, 'a')] = {}
+        seen.mark(-100, 'a', make_items(2))
+        assert await seen.flush_async() == 0
+        assert seen.get_stats()['pending'] == 2
+        assert seen._writing == []
+
+    asyncio.run(run())
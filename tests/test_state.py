@@ -0,0 +1,36 @@
+import asyncio
+
+from state import StateStore
+
+def test_overlapping_flushes_keep_batches_readable_and_ordered(tmp_path):
+    path = str(tmp_path / 'state.db')
+
+    async def run():
+        # Caché de una sola entrada: lo que se está volcando no está en memoria
+        store = StateStore(path=path, maxsize=1)
+        store.set('activity', 1, 'old')
+        store.set('activity', 2, 'x')
+        # Retiene la escritura en disco como un commit lento
+        store._lock.acquire()
+        first = asyncio.create_task(store.flush_async())
+        await asyncio.sleep(0)
+        store.set('activity', 1, 'new')
+        store.set('activity', 3, 'y')
+        # Igual que flush_job cuando coincide con un volcado programado
+        second = asyncio.create_task(store.flush_async())
+        await asyncio.sleep(0)
+        try:
+            await store.load_async('activity', 2)
+            assert store.get('activity', 2) == 'x'
+        finally:
+            store._lock.release()
+        await asyncio.gather(first, second)
+        assert store.get('activity', 2) == 'x'
+        store.close()
+
+    asyncio.run(run())
+    reopened = StateStore(path=path)
+    # El lote más nuevo se escribe después y gana
+    assert reopened.get('activity', 1) == 'new'
+    assert reopened.get('activity', 2) == 'x'
+    reopened.close()
@@ -0,0 +1,86 @@
+import re
+import unicodedata
+import logging
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Palabras clave por defecto si frases.json no define "palabras_clave".
+# Un '*' final indica prefijo: "hack*" coincide con hacker, hacking...
+DEFAULT_KEYWORDS = {
+    "ciberseguridad": ["hack*", "seguridad", "virus", "malware", "firewall", "ataque*", "brecha*", "vulnerab*"],
+    "tecnologia": ["python", "linux", "windows", "program*", "código", "github", "git"],
+    "proxies": ["proxy", "proxies", "vpn", "ip", "conexion*", "anonimato"],
+    "noticias": ["noticia*", "novedad*", "actualidad", "último*", "nuevo*"]
+}
+
+WORD_RE = re.compile(r'\w+')
+
+def fold(text):
+    """Minúsculas y sin tildes, para comparar 'código' con 'codigo'"""
+    decomposed = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+class TopicClassifier:
+    """Clasificador de temas compilado una sola vez.
+
+    Las palabras clave se indexan en diccionarios (palabra exacta, prefijo y
+    frases de varias palabras), así que clasificar un mensaje cuesta una
+    pasada por sus palabras con búsquedas O(1), sin importar cuántas palabras
+    clave haya. Se puntúan todos los temas y gana el que más coincidencias
+    tiene; en caso de empate, el que aparece antes en los datos.
+    """
+
+    def __init__(self, keywords=None, default="general"):
+        keywords = keywords or DEFAULT_KEYWORDS
+        self.default = default
+        self.topics = list(keywords)
+        self._exact = {}     # palabra -> índices de tema
+        self._prefixes = {}  # prefijo -> índices de tema
+        self._prefix_lengths = []
+        self._max_words = 1
+
+        for index, topic in enumerate(self.topics):
+            for keyword in keywords[topic]:
+                keyword = fold(keyword.strip())
+                words = WORD_RE.findall(keyword)
+                if not words:
+                    continue
+                # Los prefijos solo se admiten en palabras sueltas
+                target = self._prefixes if keyword.endswith('*') and len(words) == 1 else self._exact
+                self._max_words = max(self._max_words, len(words))
+                target.setdefault(' '.join(words), set()).add(index)
+
+        self._prefix_lengths = sorted({len(prefix) for prefix in self._prefixes})
+
+    def scores(self, message):
+        """Devuelve el número de coincidencias por tema (solo temas con alguna)"""
+        words = WORD_RE.findall(fold(message))
+        counts = [0] * len(self.topics)
+        exact = self._exact
+        prefixes = self._prefixes
+
+        for i, word in enumerate(words):
+            for index in exact.get(word, ()):
+                counts[index] += 1
+            for length in self._prefix_lengths:
+                if length > len(word):
+                    break
+                for index in prefixes.get(word[:length], ()):
+                    counts[index] += 1
+            # Frases de varias palabras ("zero trust")
+            for n in range(2, self._max_words + 1):
+                if i + n > len(words):
+                    break
+                for index in exact.get(' '.join(words[i:i + n]), ()):
+                    counts[index] += 1
+
+        return {self.topics[i]: count for i, count in enumerate(counts) if count}
+
+    def classify(self, message):
+        """Devuelve el tema con más coincidencias o el tema por defecto"""
+        scores = self.scores(message)
+        if not scores:
+            return self.default
+        # max() se queda con el primero en caso de empate (orden de los datos)
+        return max(scores, key=scores.get)
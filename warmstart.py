@@ -0,0 +1,91 @@
+import os
+import pickle
+import time
+import logging
+
+from config import SNAPSHOT_PATH, SNAPSHOT_MAX_AGE
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Cambia si cambia la forma de lo que se guarda; un formato distinto se ignora
+SNAPSHOT_FORMAT = 1
+
+class WarmStart:
+    """Snapshot en disco de los datos que tardan en recargarse (feeds, pool de proxies).
+
+    Se escribe al cerrar el bot y se lee al arrancar, para que tras un
+    despliegue la primera petición se sirva sin esperar a los upstreams. El
+    estado por chat no va aquí: ya vive en SQLite (StateStore, SeenIndex).
+    """
+
+    def __init__(self, path=SNAPSHOT_PATH, max_age=SNAPSHOT_MAX_AGE):
+        self.path = path
+        self.max_age = max_age
+        self.stats = {'loaded': False, 'load_ms': 0.0, 'save_ms': 0.0, 'bytes': 0}
+        # Versión del fichero ya leída (mtime en ns)
+        self._loaded_mtime = None
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def save(self, parts):
+        """Guarda {nombre: datos} de forma atómica (fichero temporal y rename)"""
+        if not self.enabled:
+            return
+        start = time.perf_counter()
+        payload = pickle.dumps(
+            {'format': SNAPSHOT_FORMAT, 'saved_at': time.time(), 'parts': parts},
+            protocol=pickle.HIGHEST_PROTOCOL
+        )
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f"No se pudo guardar el snapshot {self.path}: {e}")
+            return
+        self.stats['save_ms'] = (time.perf_counter() - start) * 1000
+        self.stats['bytes'] = len(payload)
+        logger.info(f"Snapshot guardado: {len(payload)} bytes en {self.stats['save_ms']:.1f} ms")
+
+    def load(self):
+        """Devuelve {nombre: datos} del último snapshot, o {} si no hay uno válido y reciente"""
+        if not self.enabled or not os.path.exists(self.path):
+            return {}
+        start = time.perf_counter()
+        try:
+            with open(self.path, 'rb') as f:
+                self._loaded_mtime = os.fstat(f.fileno()).st_mtime_ns
+                snapshot = pickle.load(f)
+        except Exception as e:
+            logger.warning(f"Snapshot {self.path} ilegible, se ignora: {e}")
+            return {}
+        if not isinstance(snapshot, dict) or snapshot.get('format') != SNAPSHOT_FORMAT:
+            logger.warning(f"Snapshot {self.path} con formato distinto, se ignora")
+            return {}
+        age = time.time() - snapshot['saved_at']
+        if age > self.max_age:
+            logger.info(f"Snapshot de hace {age:.0f} s, demasiado antiguo; arranque en frío")
+            return {}
+        self.stats['loaded'] = True
+        self.stats['load_ms'] = (time.perf_counter() - start) * 1000
+        logger.info(f"Snapshot de hace {age:.0f} s cargado en {self.stats['load_ms']:.1f} ms")
+        return snapshot['parts']
+
+    def load_if_changed(self):
+        """Como load(), pero {} si el fichero no ha cambiado desde la última lectura"""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except (OSError, ValueError):
+            return {}
+        if mtime == self._loaded_mtime:
+            return {}
+        return self.load()
+
+    def get_stats(self):
+        return dict(self.stats)
@@ -0,0 +1,169 @@
+import asyncio
+import hmac
+import signal
+from collections import deque
+import logging
+
+from aiohttp import web
+from telegram import Update
+
+from config import (
+    WEBHOOK_SECRET,
+    WEBHOOK_PATH,
+    WEBHOOK_QUEUE_SIZE,
+    WEBHOOK_WORKERS,
+    WEBHOOK_DEDUP_SIZE
+)
+from metrics import Gauge, Counter, handle_metrics
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+class WebhookServer:
+    """Servidor aiohttp que recibe updates de Telegram y los encola.
+
+    Verifica el secret token, descarta update_id repetidos (Telegram reenvía
+    si no respondemos a tiempo) y devuelve 503 cuando la cola está llena para
+    que Telegram reintente más tarde. Varios workers procesan la cola en
+    paralelo con application.process_update.
+    """
+
+    def __init__(self, application, secret_token=WEBHOOK_SECRET, path=WEBHOOK_PATH,
+                 queue_size=WEBHOOK_QUEUE_SIZE, workers=WEBHOOK_WORKERS, dedup_size=WEBHOOK_DEDUP_SIZE):
+        self.application = application
+        self.secret_token = secret_token
+        self.path = path
+        self.workers = workers
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self._seen = deque(maxlen=dedup_size)
+        self._seen_ids = set()
+        self._tasks = []
+        self._runner = None
+        self.stats = {
+            'received': 0,
+            'duplicates': 0,
+            'rejected': 0,
+            'unauthorized': 0,
+            'processed': 0,
+            'errors': 0
+        }
+        self.web_app = web.Application()
+        self.web_app.router.add_post(self.path, self.handle_update)
+        self.web_app.router.add_get('/', self.handle_health)
+        self.web_app.router.add_get('/metrics', handle_metrics)
+        Gauge('tiffany_webhook_queue', 'Updates pendientes en la cola del webhook').set_function(self.queue.qsize)
+        Counter('tiffany_webhook_updates_total', 'Updates recibidos por el webhook', ['result']).set_function(
+            lambda: {(name,): value for name, value in self.stats.items()}
+        )
+
+    def _is_duplicate(self, update_id):
+        return update_id in self._seen_ids
+
+    def _remember(self, update_id):
+        if len(self._seen) == self._seen.maxlen:
+            self._seen_ids.discard(self._seen[0])
+        self._seen.append(update_id)
+        self._seen_ids.add(update_id)
+
+    async def handle_health(self, request):
+        """Respuesta simple para los health checks del hosting"""
+        return web.json_response({'status': 'ok', 'queue': self.queue.qsize()})
+
+    async def handle_update(self, request):
+        """Recibe un update, lo valida y lo encola"""
+        if self.secret_token:
+            received = request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+            if not hmac.compare_digest(received, self.secret_token):
+                self.stats['unauthorized'] += 1
+                return web.Response(status=403)
+
+        try:
+            data = await request.json()
+            update_id = data['update_id']
+        except Exception:
+            return web.Response(status=400)
+
+        self.stats['received'] += 1
+        if self._is_duplicate(update_id):
+            self.stats['duplicates'] += 1
+            return web.Response()
+
+        try:
+            self.enqueue(data)
+        except asyncio.QueueFull:
+            # Sin marcarlo como visto: Telegram lo reenviará y lo aceptaremos entonces
+            self.stats['rejected'] += 1
+            return web.Response(status=503, headers={'Retry-After': '1'})
+
+        self._remember(update_id)
+        return web.Response()
+
+    def enqueue(self, data):
+        """Encola un update ya validado (asyncio.QueueFull si no cabe)"""
+        self.queue.put_nowait(data)
+
+    async def _worker(self):
+        while True:
+            data = await self.queue.get()
+            try:
+                update = Update.de_json(data, self.application.bot)
+                await self.application.process_update(update)
+                self.stats['processed'] += 1
+            except Exception as e:
+                self.stats['errors'] += 1
+                logger.error(f"Error processing update {data.get('update_id')}: {e}")
+            finally:
+                self.queue.task_done()
+
+    async def start(self, host, port):
+        """Arranca el servidor HTTP y los workers"""
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        self._runner = web.AppRunner(self.web_app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logger.info(f"Webhook escuchando en {host}:{port}{self.path} ({self.workers} workers)")
+
+    async def stop(self, drain_timeout=10):
+        """Deja de aceptar updates, procesa lo encolado y para los workers"""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        try:
+            await asyncio.wait_for(self.queue.join(), drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Se descartan {self.queue.qsize()} updates sin procesar")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+async def run_webhook(application, url, port, host='0.0.0.0'):
+    """Ejecuta el bot en modo webhook hasta recibir SIGTERM/SIGINT"""
+    server = WebhookServer(application)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stop.set)
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.bot.set_webhook(
+        url=f"{url.rstrip('/')}{server.path}",
+        secret_token=server.secret_token or None,
+        allowed_updates=Update.ALL_TYPES
+    )
+    await application.start()
+    await server.start(host, port)
+
+    try:
+        await stop.wait()
+    finally:
+        logger.info("Cerrando webhook...")
+        await server.stop()
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)